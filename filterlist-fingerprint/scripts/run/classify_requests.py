@@ -0,0 +1,79 @@
+"""Classify crawled requests with the filterlists, to see which rules fire on the web"""
+
+from itertools import islice
+import json
+import logging
+from pathlib import Path
+
+import hydra
+import pandas as pd
+from hydra.utils import to_absolute_path
+from omegaconf import DictConfig
+from tqdm import tqdm
+
+from filterlist_parser.adguardparser.classify import classify_requests, iter_request_log
+from filterlist_parser.raw import load_many_rules
+
+logger = logging.getLogger(__name__)
+
+
+@hydra.main(
+    config_path="../../conf",
+    config_name="classify_requests.conf",
+    version_base=None,
+)
+def main(cfg: DictConfig = None) -> None:
+
+    names = [f["name"] for f in cfg.filterlists.list]
+    list_rules = load_many_rules(names, Path(to_absolute_path(cfg.download_fp)))
+    requests_fp = Path(to_absolute_path(cfg.requests_fp))
+
+    if cfg.action == "classify":
+
+        rule_hits, list_coverage, summary = classify_requests(
+            list_rules,
+            iter_request_log(requests_fp, batch_size=cfg.batch_size),
+            workers=cfg.workers,
+        )
+
+        rule_hits.to_csv("rule_hits.csv", index=False)
+        list_coverage.to_csv("list_coverage.csv", index=False)
+        json.dump(summary, open("summary.json", "w", encoding="utf-8"), indent=2)
+
+        tqdm.write(
+            f"{summary['n_requests']} requests, {summary['n_blocked']} blocked, "
+            f"{len(rule_hits)} rules fired, {summary['urls_per_s']:.0f} URLs/s"
+        )
+
+    elif cfg.action == "benchmark":
+
+        # the same requests for every pool size
+        requests = list(
+            islice(
+                (
+                    request
+                    for batch in iter_request_log(requests_fp, batch_size=cfg.batch_size)
+                    for request in batch
+                ),
+                cfg.benchmark.n_requests,
+            )
+        )
+
+        results = []
+
+        for workers in cfg.benchmark.workers:
+            batches = [
+                requests[i : i + cfg.batch_size]
+                for i in range(0, len(requests), cfg.batch_size)
+            ]
+
+            _, _, summary = classify_requests(list_rules, batches, workers=workers)
+            results.append({"workers": workers} | summary)
+
+            tqdm.write(f"workers={workers}: {summary['urls_per_s']:.0f} URLs/s")
+
+        pd.DataFrame(results).to_csv("benchmark.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
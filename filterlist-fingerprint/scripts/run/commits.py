@@ -7,12 +7,16 @@ import logging
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 import hydra
 import pandas as pd
 from hydra.utils import to_absolute_path
-from filterlist_parser.rules import parse_rules
+from filterlist_parser.rules import (
+    RULE_COLUMNS,
+    iter_rule_rows,
+    write_rule_frames,
+)
 from omegaconf import DictConfig
 from tqdm import tqdm
 
@@ -23,63 +27,51 @@ logger = logging.getLogger(__name__)
 tqdm.pandas()
 
 
-def parse_commit_lists(commits_fp: Path):
+def _parse_changed_rules(rules: pd.Series) -> pd.DataFrame:
+    """Parse the non-empty rules of a column of changes, indexed by change index"""
 
-    # expand prev_rule to all features of prev_rule
-    # expand next_rule to all features of next_rule
+    rules = rules[rules.map(lambda rule: isinstance(rule, str) and len(rule) > 0)]
 
-    commits_df = pd.read_csv(commits_fp)
-
-    # remove rows where the file_path does not end with .txt
-    commits_df = commits_df[commits_df["file_path"].str.endswith(".txt")]
-
-    non_empty_prev_commits, non_empty_prev_commits_i = [], []
-    non_empty_new_commits, non_empty_new_commits_i = [], []
+    # parse_by_rule because sending long list of rules overflows npm
+    parsed = pd.DataFrame(
+        list(iter_rule_rows(rules.tolist(), parse_by_rule=True, parallel=True)),
+        columns=RULE_COLUMNS,
+    ).drop(columns=["rule", "rule_regex"])
 
-    for i, row in tqdm(commits_df.iterrows(), total=len(commits_df)):
+    # add the index back
+    parsed["index"] = rules.index.tolist()
 
-        index = row["index"]
-        prev_rule = row["prev_rule"]
-        new_rule = row["new_rule"]
+    return parsed
 
-        if isinstance(prev_rule, str) and len(prev_rule) > 0:
-            non_empty_prev_commits.append(prev_rule)
-            non_empty_prev_commits_i.append(index)
 
-        if isinstance(new_rule, str) and len(new_rule) > 0:
-            non_empty_new_commits.append(new_rule)
-            non_empty_new_commits_i.append(index)
+def _parse_commit_chunk(commits_df: pd.DataFrame) -> pd.DataFrame:
+    """Expand the previous and new rule of a chunk of changes to their features"""
 
-    # parse_by_rule because sending long list of rules overflows npm
-    non_empty_prev_commits = parse_rules(
-        non_empty_prev_commits, parse_by_rule=True, parallel=True
-    ).drop(columns=["rule", "rule_regex"])
-    non_empty_new_commits = parse_rules(
-        non_empty_new_commits, parse_by_rule=True, parallel=True
-    ).drop(columns=["rule", "rule_regex"])
+    # remove rows where the file_path does not end with .txt
+    commits_df = commits_df[commits_df["file_path"].str.endswith(".txt", na=False)]
 
-    # add the index back
-    non_empty_prev_commits["index"] = non_empty_prev_commits_i
-    non_empty_new_commits["index"] = non_empty_new_commits_i
+    changes = commits_df.set_index("index")
 
-    # merge the two dataframes back to the original
+    # merge the parsed rules back to the original
     merged_commits_df = pd.merge(
         commits_df,
-        non_empty_prev_commits,
+        _parse_changed_rules(changes["prev_rule"]),
         on="index",
         how="left",
         suffixes=("", "_prev"),
     )
     merged_commits_df = pd.merge(
         merged_commits_df,
-        non_empty_new_commits,
+        _parse_changed_rules(changes["new_rule"]),
         on="index",
         how="left",
         suffixes=("", "_new"),
     )
 
     # transform all NaNs to None
-    merged_commits_df = merged_commits_df.where(pd.notnull(merged_commits_df), None)
+    merged_commits_df = merged_commits_df.astype(object).where(
+        pd.notnull(merged_commits_df), None
+    )
 
     # json encode the rules because they cause issues when writing them
     merged_commits_df["prev_rule"] = merged_commits_df["prev_rule"].apply(
@@ -92,6 +84,50 @@ def parse_commit_lists(commits_fp: Path):
     return merged_commits_df
 
 
+def iter_parsed_commit_lists(
+    commits_fp: Path, chunk_size: int = 10_000
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the changes of a change log with the features of their previous and
+    new rule, reading and parsing `chunk_size` changes at a time
+
+    Args:
+        commits_fp: path to the `changes.csv` change log
+        chunk_size: number of changes read at once
+
+    Returns:
+        iterator of dataframes of parsed changes
+    """
+
+    with pd.read_csv(commits_fp, chunksize=chunk_size) as reader:
+        for commits_df in tqdm(reader, desc="Change chunks"):
+            yield _parse_commit_chunk(commits_df)
+
+
+def parse_commit_lists(
+    commits_fp: Path, out_fp: Optional[Path] = None, chunk_size: int = 10_000
+):
+    """
+    Expand the previous and new rule of each change to their features
+
+    Args:
+        commits_fp: path to the `changes.csv` change log
+        out_fp: CSV (or Parquet) file the parsed changes are written to as they
+            are parsed. They are returned as one dataframe if None
+        chunk_size: number of changes read and parsed at once
+
+    Returns:
+        the parsed changes if `out_fp` is None, the number of written changes otherwise
+    """
+
+    chunks = iter_parsed_commit_lists(commits_fp, chunk_size=chunk_size)
+
+    if out_fp is None:
+        return pd.concat(list(chunks), ignore_index=True)
+
+    return write_rule_frames(chunks, out_fp)
+
+
 def get_important_rules_from_all_attacks(
     attacks_dir: Path, attack_type: Optional[str] = None
 ) -> pd.DataFrame:
@@ -166,13 +202,17 @@ def main(cfg: DictConfig = None) -> None:
                 if cfg.date_limit
                 else None
             ),
+            fetchers=cfg.scrape.fetchers,
+            parsers=cfg.scrape.parsers,
+            batch_size=cfg.scrape.batch_size,
         )
 
     elif cfg.action == "parse":
-        commits = parse_commit_lists(
-            Path(to_absolute_path(cfg.parse.scrape_fp)) / "changes.csv"
+        parse_commit_lists(
+            Path(to_absolute_path(cfg.parse.scrape_fp)) / "changes.csv",
+            out_fp=Path("changes.csv"),
+            chunk_size=cfg.parse.chunk_size,
         )
-        commits.to_csv("changes.csv", index=False)
 
     elif cfg.action == "history":
 
@@ -194,6 +234,8 @@ def main(cfg: DictConfig = None) -> None:
             Path(to_absolute_path(cfg.history.downloads_dir)),
             important_rules,
             logger=logger,
+            backend=cfg.history.backend,
+            clones_dir=Path(to_absolute_path(cfg.history.clones_dir)),
         )
 
         rules_last_seen.to_csv("rules_last_seen.csv", index=False)
@@ -2,24 +2,28 @@
 Get the domain coverage over lists for all the related attacks
 """
 
-import functools
+import heapq
 import json
 import logging
 import os
-import traceback
-from collections import defaultdict
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import hydra
+import numpy as np
 import pandas as pd
 from hydra.utils import to_absolute_path
 from omegaconf import DictConfig
-from parallelbar import progress_starmap
+from scipy import sparse
 from tqdm import tqdm
 
-from filterlist_parser.aglintparser import AGLintBinding
-from filterlist_parser.rules import get_identifiable_list_rules
+from filterlist_parser.rules import (
+    explode_activating_domains,
+    get_identifiable_list_rules,
+)
 from filterlist_parser.utils import slug
 
 tqdm.pandas()
@@ -28,292 +32,188 @@ logger = logging.getLogger(__name__)
 timestamp = pd.Timestamp.now().strftime("%Y-%m-%d_%H-%M-%S")
 
 
-class DomainNode:
-    """A node in the domain tree representing a prefix or suffix domain"""
+class DomainTree:
+    """A tree representing a set of domains in prefix chains or suffix chains
 
-    domain: str
-    leaf: bool = False
-    subdomains: Dict[str, "DomainNode"]
+    The tree is a compact trie stored in flat arrays, in breadth-first order:
+    - `node_label[i]`: interned label id of node i (node 0 is the root)
+    - `node_leaf[i]`: whether a registered domain ends at node i
+    - `child_offsets[i]:child_offsets[i + 1]`: range of the children of node i, sorted by label
 
-    def __init__(self, domain):
-        self.domain = domain
-        self.subdomains = {}
+    Labels are interned in sorted order, so the children of a node can be looked up with a
+    binary search on their label ids. Registered domains are buffered and the arrays
+    are (re)built in bulk on the next query.
+    """
 
-    def _clear_caches(self):
-        self.__contains__.cache_clear()
-        self.suffixes_for.cache_clear()
-        self.has_suffix.cache_clear()
-        self.leafs.cache_clear()
+    MAGIC = b"DOMTREE1"
 
-    def register(self, parts: List[str]) -> "DomainNode":
-        """Register a domain in the tree
+    reverse: bool = False
 
-        Args:
-            parts (List[str]): List of parts of the domain. ex: ["example", "com"]
+    def __init__(self, domains=None, reverse=False):
+        """Create a new DomainTree
 
-        Returns:
-            DomainNode: The node where the domain is registered
+        Args:
+            domains (List[str], optional): Optional list of domains to fill the tree with.
+            reverse (bool, optional): If True, the tree will be a prefix tree, otherwise a suffix tree.
         """
+        self.reverse = reverse
 
-        if len(parts) == 0:
-            self.leaf = True
-            return self
-
-        if parts[-1] not in self.subdomains:
-            self.subdomains[parts[-1]] = DomainNode(f"{parts[-1]}.{self.domain}")
-
-        # clear caches
-        self._clear_caches()
-
-        return self.subdomains[parts[-1]].register(parts[:-1])
-
-    def __str__(self):
-        return f"DomainNode({self.domain} -> {list(self.subdomains.keys())}, leaf={self.leaf})"
-
-    def __repr__(self) -> str:
-        return self.__str__()
-
-    def __len__(self):
-        return sum([len(v) for v in self.subdomains.values()])
+        self.labels: List[str] = []
+        self.node_label = np.zeros(1, dtype=np.int32)
+        self.node_leaf = np.zeros(1, dtype=np.uint8)
+        self.child_offsets = np.ones(2, dtype=np.int64)
 
-    def __getitem__(self, domain):
-        parts = domain.split(".")
+        self._pending = set()
+        self._query_arrays()
 
-        if len(parts) == 1:
-            return self.subdomains[parts[0]]
+        if domains is not None:
+            self.extend(domains)
 
-        return self.subdomains[parts[-1]][parts[:-1]]
+    def _key(self, domain: str) -> Tuple[str, ...]:
+        """Labels of a domain in walk order, from the root of the tree"""
 
-    @functools.lru_cache(maxsize=1024)
-    def __contains__(self, domain):
         parts = domain.split(".")
 
-        if len(parts) == 1:
-            return parts[0] in self.subdomains
+        return tuple(parts) if self.reverse else tuple(parts[::-1])
 
-        return parts[-1] in self.subdomains and parts[:-1] in self.subdomains[parts[-1]]
+    def _domain(self, key: Tuple[str, ...]) -> str:
+        return ".".join(key) if self.reverse else ".".join(key[::-1])
 
-    @functools.lru_cache(maxsize=1024)
-    def suffixes_for(self, parts: tuple) -> list:
-        """Get all the prefixes for a given suffix
+    def _query_arrays(self):
+        # python lists are faster than numpy scalars for the per-label walks
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+        self._node_label = self.node_label.tolist()
+        self._node_leaf = self.node_leaf.astype(bool).tolist()
+        self._child_offsets = self.child_offsets.tolist()
 
-        Args:
-            parts (tuple): The parts of the suffix. ex: ("example", "com")
-
-        Returns:
-            list: List of suffixes
-        """
+    def _flush(self):
+        """Build the arrays with the registered domains, if any are pending"""
 
-        prefixes = []
-
-        if len(parts) == 0:
-            if self.leaf:
-                prefixes.append(self.domain)
-
-        else:
-            if parts[-1] in self.subdomains:
-                if self.subdomains[parts[-1]].leaf:
-                    prefixes.append(self.subdomains[parts[-1]].domain)
-                prefixes.extend(self.subdomains[parts[-1]].suffixes_for(parts[:-1]))
+        if not self._pending:
+            return
 
-        if "*" in self.subdomains:
-            if self.subdomains["*"].leaf:
-                prefixes.append(self.subdomains["*"].domain)
-            prefixes.extend(self.subdomains["*"].suffixes_for(parts[:-1]))
+        pending = sorted(self._pending)
+        self._pending = set()
 
-        # remove duplicates
-        prefixes = list(set(prefixes))
+        self._build(list(heapq.merge(self.keys(), pending)))
 
-        return prefixes
+    def _build(self, keys: List[Tuple[str, ...]]):
+        """Bulk build the arrays from sorted keys, duplicates allowed"""
 
-    @functools.lru_cache(maxsize=1024)
-    def has_suffix(self, parts: tuple):
-        """Check if this domain matches the suffix
+        keys = [k for k, _ in groupby(keys)]
 
-        Args:
-            parts (tuple): The parts of the domain to check for the suffix. ex: ("example", "com")
-
-        Returns:
-            bool: True if the domain has the suffix
-        """
-
-        if len(parts) == 0:
-            if self.leaf:
-                return True
-            else:
-                parts = ["*"]
+        self.labels = sorted({label for key in keys for label in key})
+        label_ids = {label: i for i, label in enumerate(self.labels)}
+        leafs = set(keys)
 
-        if parts[-1] in self.subdomains:
-            return self.subdomains[parts[-1]].leaf or self.subdomains[
-                parts[-1]
-            ].has_suffix(parts[:-1])
+        node_label = [-1]
+        node_leaf = [False]
+        n_children = []
 
-        if "*" in self.subdomains:
-            return self.subdomains["*"].leaf or self.subdomains["*"].has_suffix(
-                parts[:-1]
-            )
+        # breadth-first: the sorted prefixes of a level are grouped by parent, in the
+        # order of the parents on the previous level
+        depth = 1
+        level = [()]
 
-        return False
+        while level:
+            next_level = sorted({key[:depth] for key in keys if len(key) >= depth})
 
-    def __iter__(self):
-        return iter(self.subdomains.values())
+            counts = Counter(prefix[:-1] for prefix in next_level)
+            n_children.extend(counts.get(prefix, 0) for prefix in level)
 
-    def __next__(self):
-        return next(self.subdomains.values())
+            node_label.extend(label_ids[prefix[-1]] for prefix in next_level)
+            node_leaf.extend(prefix in leafs for prefix in next_level)
 
-    @functools.lru_cache(maxsize=1024)
-    def leafs(self) -> "List[DomainNode]":
-        """Get all the leaf nodes in the tree
+            level = next_level
+            depth += 1
 
-        Returns:
-            List[DomainNode]: List of leaf nodes
-        """
+        self.node_label = np.array(node_label, dtype=np.int32)
+        self.node_leaf = np.array(node_leaf, dtype=np.uint8)
+        self.child_offsets = np.concatenate(
+            [[1], 1 + np.cumsum(n_children, dtype=np.int64)]
+        ).astype(np.int64)
 
-        leafs = []
+        self._query_arrays()
 
-        if len(self.subdomains) == 0:
-            return [self] if self.leaf else []
+    def _child(self, node: int, label: str) -> Optional[int]:
+        label_id = self._label_ids.get(label)
 
-        for subdomain in self.subdomains.values():
-            if subdomain.leaf:
-                leafs.append(subdomain)
+        if label_id is None:
+            return None
 
-            leafs.extend(subdomain.leafs())
+        lo, hi = self._child_offsets[node], self._child_offsets[node + 1]
+        i = bisect_left(self._node_label, label_id, lo, hi)
 
-        return leafs
+        if i < hi and self._node_label[i] == label_id:
+            return i
 
-    def to_dict(self):
-        """Convert the node to a dictionary"""
+        return None
 
-        return {
-            "domain": self.domain,
-            "leaf": self.leaf,
-            "subdomains": {k: v.to_dict() for k, v in self.subdomains.items()},
-        }
+    def _walk(self, key: Tuple[str, ...]) -> Optional[int]:
+        node = 0
 
-    @staticmethod
-    def from_dict(node_dict: dict) -> "DomainNode":
-        """Create a DomainNode from a dictionary"""
+        for label in key:
+            node = self._child(node, label)
 
-        node = DomainNode(node_dict["domain"])
-        node.leaf = node_dict["leaf"]
-        node.subdomains = {
-            k: DomainNode.from_dict(v) for k, v in node_dict["subdomains"].items()
-        }
+            if node is None:
+                return None
 
         return node
 
-    def __add__(self, other):
-
-        new_node = DomainNode(self.domain)
-        new_node.leaf = self.leaf or other.leaf
-
-        self_subdomains = set(self.subdomains.keys())
-        other_subdomains = set(other.subdomains.keys())
-
-        for subdomain in self_subdomains.difference(other_subdomains):
-            new_node.subdomains[subdomain] = self.subdomains[subdomain]
-
-        for subdomain in other_subdomains.difference(self_subdomains):
-            new_node.subdomains[subdomain] = other.subdomains[subdomain]
+    def keys(self) -> Iterator[Tuple[str, ...]]:
+        """Iterate over the keys of the registered domains, in sorted order"""
 
-        for subdomain in self_subdomains.intersection(other_subdomains):
-            new_node.subdomains[subdomain] = (
-                self.subdomains[subdomain] + other.subdomains[subdomain]
-            )
-
-        return new_node
+        self._flush()
 
+        stack = [(0, ())]
 
-class DomainTree:
-    """A tree representing a set of domains in prefix chains or suffix chains"""
-
-    TLDs: Dict[str, DomainNode]
-    reverse: bool = False
-
-    def __init__(self, domains=None, reverse=False):
-        """Create a new DomainTree
-
-        Args:
-            domains (List[str], optional): Optional list of domains to fill the tree with.
-            reverse (bool, optional): If True, the tree will be a prefix tree, otherwise a suffix tree.
-        """
-        self.TLDs = {}
-        self.reverse = reverse
+        while stack:
+            node, key = stack.pop()
 
-        if domains is not None:
-            for domain in domains:
-                self.register(domain)
+            if self._node_leaf[node]:
+                yield key
 
-    def _clear_caches(self):
-        self.__contains__.cache_clear()
-        self.subsets_for.cache_clear()
-        self.has_subset.cache_clear()
-        self.leafs.cache_clear()
+            # reversed, to pop the children in label order
+            for child in range(
+                self._child_offsets[node + 1] - 1, self._child_offsets[node] - 1, -1
+            ):
+                stack.append((child, key + (self.labels[self._node_label[child]],)))
 
     def register(self, domain: str):
         """Register a domain in the tree
 
         Args:
             domain (str)
-
-        Returns:
-            DomainNode: The node where the domain is registered
         """
 
-        parts = domain.split(".")
-
-        if len(parts) > 5:
+        if domain.count(".") > 4:
             logger.warning("Domain %s is too long", domain)
 
-        if self.reverse:
-            parts = parts[::-1]
-
-        if parts[-1] not in self.TLDs:
-            self.TLDs[parts[-1]] = DomainNode(parts[-1])
+        self._pending.add(self._key(domain))
 
-        # clear caches
-        self._clear_caches()
+    def __str__(self):
+        self._flush()
 
-        return self.TLDs[parts[-1]].register(parts[:-1])
+        tlds = [
+            self.labels[self._node_label[i]]
+            for i in range(self._child_offsets[0], self._child_offsets[1])
+        ]
 
-    def __str__(self):
-        return f"DomainTree({list(self.TLDs.keys())}, reverse={self.reverse})"
+        return f"DomainTree({tlds}, reverse={self.reverse})"
 
     def __repr__(self) -> str:
         return self.__str__()
 
     def __len__(self):
-        return sum([len(v) for v in self.TLDs.values()])
-
-    def __getitem__(self, domain):
-        parts = domain.split(".")
-
-        if self.reverse:
-            parts = parts[::-1]
+        self._flush()
+        return int(self.node_leaf.sum())
 
-        if len(parts) == 1:
-            return self.TLDs[parts[0]]
-
-        return self.TLDs[parts[-1]][parts[:-1]]
-
-    @functools.lru_cache(maxsize=1024)
     def __contains__(self, domain):
-        parts = domain.split(".")
-
-        if self.reverse:
-            parts = parts[::-1]
-
-        if len(parts) == 1:
-            return parts[0] in self.TLDs
-
-        return parts[-1] in self.TLDs and ".".join(parts[:-1]) in self.TLDs[parts[-1]]
+        self._flush()
+        return self._walk(self._key(domain)) is not None
 
     def __iter__(self):
-        return iter(self.TLDs.values())
-
-    def __next__(self):
-        return next(self.TLDs.values())
+        return iter(self.leafs())
 
     def append(self, domain):
         self.register(domain)
@@ -322,7 +222,6 @@ class DomainTree:
         for domain in domains:
             self.append(domain)
 
-    @functools.lru_cache(maxsize=1024)
     def subsets_for(self, domain, proper=False):
         """Get all the subdomains registered in the tree for a given domain
 
@@ -340,29 +239,47 @@ class DomainTree:
             )
             domain = str(domain)
 
-        parts = tuple(domain.split("."))
+        self._flush()
 
-        if self.reverse:
-            parts = parts[::-1]
+        key = self._key(domain)
+        tld = self._child(0, key[0])
 
-        if parts[-1] in self.TLDs:
-            subsets = self.TLDs[parts[-1]].suffixes_for(parts[:-1])
+        if tld is None:
+            return []
 
-            if self.reverse:
-                subsets = [DomainTree._reverse_domain(s) for s in subsets]
+        subsets = set()
 
-            if proper:
-                return [s for s in subsets if s != domain]
+        # (node, index of the next label, labels so far); "*" matches any single label
+        stack = [(tld, 1, key[:1])]
 
-            return subsets
+        while stack:
+            node, i, path = stack.pop()
 
-        return []
+            if i == len(key):
+                if self._node_leaf[node]:
+                    subsets.add(path)
+            else:
+                child = self._child(node, key[i])
 
-    @staticmethod
-    def _reverse_domain(domain):
-        return ".".join(domain.split(".")[::-1])
+                if child is not None:
+                    if self._node_leaf[child]:
+                        subsets.add(path + (key[i],))
+                    stack.append((child, i + 1, path + (key[i],)))
+
+            star = self._child(node, "*")
+
+            if star is not None:
+                if self._node_leaf[star]:
+                    subsets.add(path + ("*",))
+                stack.append((star, min(i + 1, len(key)), path + ("*",)))
+
+        subsets = [self._domain(s) for s in subsets]
+
+        if proper:
+            return [s for s in subsets if s != domain]
+
+        return subsets
 
-    @functools.lru_cache(maxsize=1024)
     def has_subset(self, domain: str):
         """Check if the tree has domains with the following prefix or suffix depending on the tree type.
 
@@ -373,156 +290,333 @@ class DomainTree:
             bool: True if the tree has the domain as a prefix
         """
 
-        parts = tuple(domain.split("."))
+        self._flush()
+
+        key = self._key(domain)
+        node = self._child(0, key[0])
+        i = 1
 
-        if self.reverse:
-            parts = parts[::-1]
+        while node is not None:
+
+            if i == len(key):
+                if self._node_leaf[node]:
+                    return True
+                label = "*"
+            else:
+                label = key[i]
+                i += 1
 
-        if parts[-1] in self.TLDs:
-            return self.TLDs[parts[-1]].has_suffix(parts[:-1])
+            child = self._child(node, label)
+
+            if child is None:
+                child = self._child(node, "*")
+
+            if child is None:
+                return False
+
+            if self._node_leaf[child]:
+                return True
+
+            node = child
 
         return False
 
+    def leafs(self) -> List[str]:
+        """Get all the registered domains in the tree"""
+
+        return [self._domain(key) for key in self.keys()]
+
     def to_dict(self):
         """Convert the tree to a dictionary"""
 
-        return {
-            "reverse": self.reverse,
-            "tlds": {k: v.to_dict() for k, v in self.TLDs.items()},
-        }
+        return {"reverse": self.reverse, "domains": self.leafs()}
 
     @staticmethod
     def from_dict(tree_dict: dict):
-        """Create a DomainTree from a dictionary"""
+        """Create a DomainTree from a dictionary, or from the legacy nested format"""
 
         tree = DomainTree(reverse=tree_dict["reverse"])
 
-        for tld, node in tree_dict["tlds"].items():
-            tree.TLDs[tld] = DomainNode(node["domain"])
-            tree.TLDs[tld].subdomains = {
-                k: DomainNode.from_dict(v) for k, v in node["subdomains"].items()
-            }
+        if "domains" in tree_dict:
+            tree.extend(tree_dict["domains"])
+            return tree
+
+        # legacy format: nested nodes, where the domains of the reverse trees are reversed
+        stack = list(tree_dict["tlds"].values())
+
+        while stack:
+            node = stack.pop()
+
+            if node["leaf"]:
+                tree._pending.add(tuple(node["domain"].split(".")[::-1]))
+
+            stack.extend(node["subdomains"].values())
 
         return tree
 
-    @functools.lru_cache(maxsize=1024)
-    def leafs(self) -> "List[DomainNode]":
-        """Get all the leaf nodes in the tree"""
+    def save(self, fp: Path):
+        """Save the tree in a binary file that can be memory-mapped by `load`
 
-        leafs = []
+        Layout: magic, header (reverse, n_nodes, n_labels, label bytes), then the
+        8-byte aligned arrays node_label, node_leaf, child_offsets, label_offsets and
+        the utf-8 label bytes.
+        """
 
-        for tld in self.TLDs.values():
-            leafs.extend(tld.leafs())
+        self._flush()
 
-        return leafs
+        encoded = [label.encode("utf-8") for label in self.labels]
+        label_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        label_offsets[1:] = np.cumsum([len(e) for e in encoded])
 
-    def __add__(self, other):
+        arrays = [
+            self.node_label,
+            self.node_leaf,
+            self.child_offsets,
+            label_offsets,
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        ]
+
+        header = np.array(
+            [self.reverse, len(self.node_label), len(encoded), label_offsets[-1]],
+            dtype=np.int64,
+        )
+
+        with open(fp, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(header.tobytes())
+
+            for array in arrays:
+                data = array.tobytes()
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+
+    @staticmethod
+    def load(fp: Path, mmap: bool = True) -> "DomainTree":
+        """Load a tree saved with `save`
+
+        Args:
+            fp (Path): Path of the binary file
+            mmap (bool, optional): If True, the arrays are memory-mapped instead of read
+
+        Returns:
+            DomainTree: The loaded tree
+        """
+
+        if mmap:
+            buffer = np.memmap(fp, dtype=np.uint8, mode="r")
+        else:
+            buffer = np.fromfile(fp, dtype=np.uint8)
+
+        if buffer[: len(DomainTree.MAGIC)].tobytes() != DomainTree.MAGIC:
+            raise ValueError(f"Not a domain tree file: {fp}")
+
+        offset = len(DomainTree.MAGIC)
+        reverse, n_nodes, n_labels, n_label_bytes = (
+            buffer[offset : offset + 32].view(np.int64).tolist()
+        )
+        offset += 32
+
+        arrays = []
+        for dtype, size in [
+            (np.int32, n_nodes),
+            (np.uint8, n_nodes),
+            (np.int64, n_nodes + 1),
+            (np.int64, n_labels + 1),
+            (np.uint8, n_label_bytes),
+        ]:
+            n_bytes = size * np.dtype(dtype).itemsize
+            arrays.append(buffer[offset : offset + n_bytes].view(dtype))
+            offset += n_bytes + (-n_bytes % 8)
+
+        node_label, node_leaf, child_offsets, label_offsets, label_bytes = arrays
+
+        tree = DomainTree(reverse=bool(reverse))
+        tree.node_label = node_label
+        tree.node_leaf = node_leaf
+        tree.child_offsets = child_offsets
+
+        label_bytes = label_bytes.tobytes()
+        label_offsets = label_offsets.tolist()
+        tree.labels = [
+            label_bytes[start:end].decode("utf-8")
+            for start, end in zip(label_offsets[:-1], label_offsets[1:])
+        ]
+
+        tree._query_arrays()
+
+        return tree
+
+    @staticmethod
+    def merge(trees: List["DomainTree"]) -> "DomainTree":
+        """Merge many trees with a single sorted merge of their domains
+
+        Args:
+            trees (List[DomainTree]): Trees to merge, of the same type
 
-        if self.reverse != other.reverse:
+        Returns:
+            DomainTree: A tree with the domains of all the trees
+        """
+
+        if len({tree.reverse for tree in trees}) > 1:
             raise ValueError("Cannot merge trees with different reverse values")
 
-        new_tree = DomainTree(reverse=self.reverse)
+        merged = DomainTree(reverse=trees[0].reverse if trees else False)
+        merged._build(list(heapq.merge(*(tree.keys() for tree in trees))))
 
-        self_tlds = set(self.TLDs.keys())
-        other_tlds = set(other.TLDs.keys())
+        return merged
 
-        for tld in self_tlds.difference(other_tlds):
-            new_tree.TLDs[tld] = self.TLDs[tld]
+    def __add__(self, other):
+        return DomainTree.merge([self, other])
 
-        for tld in other_tlds.difference(self_tlds):
-            new_tree.TLDs[tld] = other.TLDs[tld]
 
-        for tld in self_tlds.intersection(other_tlds):
-            new_tld = self.TLDs[tld] + other.TLDs[tld]
+def get_rule_counts_per_domain(list_names, list_rules) -> pd.DataFrame:
+    """Count the rules that each domain activates, in each filter list, from the
+    activating domains extracted when the lists were parsed.
+
+    Args:
+        list_names (List[str]): Names of the filter lists
+        list_rules (List[pd.DataFrame]): Parsed filter rules of each list
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns:
+        - list: The name of the filter list
+        - domain: The domain that activates the rules
+        - count_rules: The number of rules that the domain activates
+        - count_cosmetic_rules: The number of cosmetic rules that the domain activates
+        - count_network_rules: The number of network rules that the domain activates
+    """
+
+    list_domain_rules = [
+        explode_activating_domains(rules)[["activating_domain", "cosmetic", "network"]]
+        .assign(list=name)
+        for name, rules in zip(list_names, list_rules)
+        if len(rules) > 0
+    ]
+
+    if not list_domain_rules:
+        return pd.DataFrame(
+            columns=[
+                "list",
+                "domain",
+                "count_rules",
+                "count_cosmetic_rules",
+                "count_network_rules",
+            ]
+        )
 
-            new_tree.TLDs[tld] = new_tld
+    domain_rules = pd.concat(list_domain_rules, ignore_index=True)
 
-        return new_tree
+    return (
+        domain_rules.astype({"cosmetic": int, "network": int})
+        .groupby(["list", "activating_domain"], sort=False)
+        .agg(
+            count_rules=("cosmetic", "size"),
+            count_cosmetic_rules=("cosmetic", "sum"),
+            count_network_rules=("network", "sum"),
+        )
+        .reset_index()
+        .rename(columns={"activating_domain": "domain"})
+    )
 
 
-def get_rule_applicable_domains(list_name, list_rules):
-    """Get all domains that would activate the following filter rules
+def save_rule_applicable_domains(list_name, rule_counts_per_domain):
+    """Save the domains that activate the rules of a filter list
     The output is saved in a csv file with the following columns:
     - domain: The domain that activates the rule
     - count_rules: The number of rules that the domain activates
     - count_cosmetic_rules: The number of cosmetic rules that the domain activates
     - count_network_rules: The number of network rules that the domain activates
 
+    Along with the suffix and prefix trees of these domains.
+
     Args:
         list_name (str): Name of the filter list
-        list_rules (pd.DataFrame): DataFrame containing the filter rules
+        rule_counts_per_domain (pd.DataFrame): Rule counts of the domains of the list
     """
 
-    try:
+    domains = rule_counts_per_domain["domain"].tolist()
 
-        # if the file already exist`s, and the csv contains more than 200 rows, skip
-        # if os.path.exists(f"{slug(list_name)}/rule_counts_per_domain.csv"):
-        #     if pd.read_csv(f"{slug(list_name)}/rule_counts_per_domain.csv").shape[0] > 200:
-        #         logger.info(f"Skipping {list_name}")
-        #         return
+    os.makedirs(slug(list_name), exist_ok=True)
 
-        suffix_domain_tree = DomainTree()
-        prefix_domain_tree = DomainTree(reverse=True)
+    rule_counts_per_domain[
+        ["count_rules", "count_cosmetic_rules", "count_network_rules", "domain"]
+    ].to_csv(f"{slug(list_name)}/rule_counts_per_domain.csv", index=False)
 
-        rules = AGLintBinding.parse_filter_rules(
-            [
-                json.loads(f'"{list_rule.rule}"').strip("\r")
-                for _, list_rule in list_rules.iterrows()
-            ]
-        )
+    DomainTree(domains).save(f"{slug(list_name)}/suffix_tree.bin")
+    DomainTree(domains, reverse=True).save(f"{slug(list_name)}/prefix_tree.bin")
 
-        rule_counts_per_domain = defaultdict(
-            lambda: {"count": 0, "count_cosmetic": 0, "count_network": 0}
-        )
+    json.dump(
+        {"timestamp": timestamp},
+        open(f"{slug(list_name)}/meta.json", "w", encoding="utf-8"),
+    )
 
-        for rule in rules:
-            rule_domains = rule.activating_domains
-            suffix_domain_tree.extend(rule_domains)
-            prefix_domain_tree.extend(rule_domains)
-
-            for domain in rule_domains:
-                rule_counts_per_domain[domain]["count"] += 1
-                rule_counts_per_domain[domain][
-                    "count_cosmetic"
-                ] += rule.is_cosmetic_rule
-                rule_counts_per_domain[domain]["count_network"] += rule.is_network_rule
-
-        rule_counts_per_domain = pd.DataFrame(rule_counts_per_domain).T
-        rule_counts_per_domain["domain"] = rule_counts_per_domain.index
-
-        rule_counts_per_domain.rename(
-            columns={
-                "count": "count_rules",
-                "count_cosmetic": "count_cosmetic_rules",
-                "count_network": "count_network_rules",
-            },
-            inplace=True,
-        )
+    logger.info(f"Done for {list_name}, {len(domains)} domains")
 
-        os.makedirs(slug(list_name), exist_ok=True)
 
-        rule_counts_per_domain.to_csv(
-            f"{slug(list_name)}/rule_counts_per_domain.csv", index=False
-        )
-        json.dump(
-            suffix_domain_tree.to_dict(),
-            open(f"{slug(list_name)}/suffix_tree.json", "w", encoding="utf-8"),
-        )
-        json.dump(
-            prefix_domain_tree.to_dict(),
-            open(f"{slug(list_name)}/prefix_tree.json", "w", encoding="utf-8"),
-        )
-        json.dump(
-            {"timestamp": timestamp},
-            open(f"{slug(list_name)}/meta.json", "w", encoding="utf-8"),
-        )
+def _load_list_tree(list_dir: Path, name: str) -> DomainTree:
+    """Load a tree of a list, from the binary format or the legacy JSON one"""
 
-        logger.info(f"Done for {list_name},` {len(suffix_domain_tree.leafs())} domains")
+    if (list_dir / f"{name}.bin").exists():
+        return DomainTree.load(list_dir / f"{name}.bin")
 
-    except Exception as e:
-        logger.error(f"Error for {list_name}: {e}")
-        traceback.print_exc()
-        return
+    return DomainTree.from_dict(
+        json.load(open(list_dir / f"{name}.json", encoding="utf-8"))
+    )
+
+
+def _subset_edges(tree: DomainTree, domain_ids: Dict[str, int]) -> np.ndarray:
+    """Get the (domain, proper subset) id pairs of the registered domains
+
+    Args:
+        tree (DomainTree): suffix or prefix tree of the domains
+        domain_ids (Dict[str, int]): Integer id of each domain in the count matrix
+
+    Returns:
+        np.ndarray: (n_edges, 2) array of (domain id, subset id), e.g. for a suffix tree
+            (id of "a.example.com", id of "example.com")
+    """
+
+    edges = []
+
+    for domain, domain_id in tqdm(domain_ids.items(), desc="Building Edges"):
+        for subset in tree.subsets_for(domain, proper=True):
+            subset_id = domain_ids.get(subset)
+
+            if subset_id is not None and subset_id != domain_id:
+                edges.append((domain_id, subset_id))
+
+    return np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+
+def _propagate_counts(counts: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Add to each domain the counts of the domains it is related to through an edge, in
+    both directions: the adversary controlling a domain has access to the rules of its
+    subsets (e.g. example.com), and the one controlling a subset can create the domain
+    (e.g. a.example.com).
+
+    Args:
+        counts (np.ndarray): (domains x lists) count matrix
+        edges (np.ndarray): (n_edges, 2) array of (domain id, subset id)
+
+    Returns:
+        np.ndarray: the propagated (domains x lists) count matrix
+    """
+
+    n_domains = counts.shape[0]
+
+    # edges are the transitive closure of the trees, so one product is enough
+    adjacency = sparse.coo_matrix(
+        (
+            np.ones(2 * len(edges), dtype=counts.dtype),
+            (
+                np.concatenate([edges[:, 0], edges[:, 1]]),
+                np.concatenate([edges[:, 1], edges[:, 0]]),
+            ),
+        ),
+        shape=(n_domains, n_domains),
+    ).tocsr()
+
+    return counts + adjacency @ counts
 
 
 def analyze_coverage(exp_dir: Path, list_names):
@@ -539,15 +633,13 @@ def analyze_coverage(exp_dir: Path, list_names):
 
     out_dir.mkdir(exist_ok=True)
 
-    # keyed by domain
-    domain_coverages: Dict[str, pd.DataFrame] = {
-        "count_rules": None,
-        "count_network_rules": None,
-        "count_cosmetic_rules": None,
-    }
+    rule_type_cols = ["count_rules", "count_network_rules", "count_cosmetic_rules"]
+
+    # keyed by rule type, one count series per list, indexed by domain
+    list_counts: Dict[str, List[pd.Series]] = {col: [] for col in rule_type_cols}
 
-    suffix_tree = DomainTree()
-    prefix_tree = DomainTree(reverse=True)
+    suffix_trees = []
+    prefix_trees = []
 
     participating_list_names = []
 
@@ -559,123 +651,82 @@ def analyze_coverage(exp_dir: Path, list_names):
         rule_counts_per_domain = pd.read_csv(
             exp_dir / f"{slug(list_name)}/rule_counts_per_domain.csv"
         )
-        suffix_tree += DomainTree.from_dict(
-            json.load(
-                open(exp_dir / f"{slug(list_name)}/suffix_tree.json", encoding="utf-8")
-            )
-        )
-        prefix_tree += DomainTree.from_dict(
-            json.load(
-                open(exp_dir / f"{slug(list_name)}/prefix_tree.json", encoding="utf-8")
-            )
-        )
+        suffix_trees.append(_load_list_tree(exp_dir / slug(list_name), "suffix_tree"))
+        prefix_trees.append(_load_list_tree(exp_dir / slug(list_name), "prefix_tree"))
 
         if len(rule_counts_per_domain) == 0:
             logger.info(f"Skipping {list_name}")
             continue
 
-        for rule_type_col, old_coverage in domain_coverages.items():
-            _coverage = rule_counts_per_domain[["domain", rule_type_col]].rename(
-                columns={rule_type_col: list_name}
-            )
+        rule_counts_per_domain = rule_counts_per_domain.astype({"domain": str})
 
-            # remove rows where the count is 0
-            _coverage = (
-                _coverage[(_coverage[list_name] > 0)].copy().astype({"domain": str})
-            )
+        # duplicated domains (e.g. "nan") are summed
+        rule_counts_per_domain = rule_counts_per_domain.groupby("domain")[
+            rule_type_cols
+        ].sum()
 
-            if old_coverage is None:
-                domain_coverages[rule_type_col] = _coverage
-            else:
-                domain_coverages[rule_type_col] = old_coverage.merge(
-                    _coverage, on="domain", how="outer"
-                )
+        for rule_type_col in rule_type_cols:
+            counts = rule_counts_per_domain[rule_type_col]
+
+            # remove rows where the count is 0
+            list_counts[rule_type_col].append(counts[counts > 0].rename(list_name))
 
         participating_list_names.append(list_name)
 
-    json.dump(
-        suffix_tree.to_dict(), open(out_dir / "suffix_tree.json", "w", encoding="utf-8")
-    )
-    json.dump(
-        prefix_tree.to_dict(), open(out_dir / "prefix_tree.json", "w", encoding="utf-8")
-    )
+    suffix_tree = DomainTree.merge(suffix_trees)
+    prefix_tree = DomainTree.merge(prefix_trees)
+
+    suffix_tree.save(out_dir / "suffix_tree.bin")
+    prefix_tree.save(out_dir / "prefix_tree.bin")
+
+    # domains x lists count matrices, on a shared integer domain id
+    count_matrices = {
+        rule_type_col: (
+            pd.concat(series, axis=1).fillna(0).astype(np.int64)
+            if series
+            else pd.DataFrame(dtype=np.int64)
+        )
+        for rule_type_col, series in list_counts.items()
+    }
+
+    domains = sorted(set().union(*(m.index for m in count_matrices.values())))
+    domain_ids = {domain: i for i, domain in enumerate(domains)}
+
+    # (domain, subset) pairs are shared by all rule types
+    suffix_edges = _subset_edges(suffix_tree, domain_ids)
+    prefix_edges = _subset_edges(prefix_tree, domain_ids)
+
+    for rule_type_col, count_matrix in count_matrices.items():
 
-    # sort by the number of parts in the domain to ensure that the suffixes and prefixes are added correctly
-    for rule_type_col in domain_coverages.keys():
-        domain_coverages[rule_type_col] = domain_coverages[rule_type_col].fillna(0)
-        domain_coverages[rule_type_col].loc[:, participating_list_names] = (
-            domain_coverages[rule_type_col][participating_list_names].astype(int)
+        counts = (
+            count_matrix.reindex(index=domains, columns=participating_list_names)
+            .fillna(0)
+            .to_numpy(dtype=np.int64)
         )
-        domain_coverages[rule_type_col] = domain_coverages[rule_type_col].sort_values(
-            by="domain", key=lambda x: x.str.count(".")
+
+        # only the domains with rules of this type take part in the propagation
+        present = np.zeros(len(domains), dtype=bool)
+        present[[domain_ids[d] for d in count_matrix.index]] = True
+
+        for edges in (suffix_edges, prefix_edges):
+            edges = edges[present[edges[:, 0]] & present[edges[:, 1]]]
+            counts = _propagate_counts(counts, edges)
+
+        coverage = pd.DataFrame(
+            counts[present], columns=participating_list_names
         )
+        coverage.insert(0, "domain", np.array(domains, dtype=object)[present])
 
-    # for each domain, add the counts from all available suffixes
-    for rule_type_col, coverage in domain_coverages.items():
-        for _, row in tqdm(
-            coverage.iterrows(),
-            desc=f"Adding Suffixes for {rule_type_col}",
-            total=len(coverage),
-        ):
-            suffixes = suffix_tree.subsets_for(row["domain"], proper=True)
-
-            # if adversary controls suffix domain, they have access to all subdomain rules
-            for suffix in suffixes:
-                domain_coverages[rule_type_col].loc[
-                    coverage["domain"] == suffix,
-                    participating_list_names,
-                ] += row[participating_list_names].astype(int)
-
-            # if adversary controls subdomain, they have access to all suffix domain rules
-            if len(suffixes):
-                suffix_counts = domain_coverages[rule_type_col][
-                    domain_coverages[rule_type_col]["domain"].isin(suffixes)
-                ].sum()
-                domain_coverages[rule_type_col].loc[
-                    domain_coverages[rule_type_col]["domain"] == row["domain"],
-                    participating_list_names,
-                ] += suffix_counts[participating_list_names].astype(int)
-
-    # for each domain, add the counts from all available prefixes
-    for rule_type_col in domain_coverages.keys():
-        for _, row in tqdm(
-            domain_coverages[rule_type_col].iterrows(),
-            desc=f"Adding Prefixes for {rule_type_col}",
-            total=len(domain_coverages[rule_type_col]),
-        ):
-            prefixes = prefix_tree.subsets_for(row["domain"], proper=True)
-
-            # if adversary controls prefix domain, they have access to all subdomain rules
-            for prefix in prefixes:
-                domain_coverages[rule_type_col].loc[
-                    domain_coverages[rule_type_col]["domain"] == prefix,
-                    participating_list_names,
-                ] += row[participating_list_names].astype(int)
-
-            # if adversary controls subdomain, they have access to all prefix domain rules
-            if len(prefixes):
-                print(row["domain"], prefixes)
-                prefix_counts = domain_coverages[rule_type_col][
-                    domain_coverages[rule_type_col]["domain"].isin(prefixes)
-                ].sum()
-                domain_coverages[rule_type_col].loc[
-                    domain_coverages[rule_type_col]["domain"] == row["domain"],
-                    participating_list_names,
-                ] += prefix_counts[participating_list_names].astype(int)
-
-    for rule_type_col in domain_coverages.keys():
-
-        domain_coverages[rule_type_col]["total_rules"] = domain_coverages[
-            rule_type_col
-        ][participating_list_names].sum(axis=1)
-        domain_coverages[rule_type_col]["total_lists"] = domain_coverages[
-            rule_type_col
-        ][participating_list_names].apply(lambda x: (x > 0).sum(), axis=1)
-
-        domain_coverages[rule_type_col].to_csv(
-            out_dir / f"coverage_{rule_type_col}.csv", index=False
+        coverage["total_rules"] = counts[present].sum(axis=1)
+        coverage["total_lists"] = (counts[present] > 0).sum(axis=1)
+
+        # sorted by the number of parts in the domain
+        coverage = coverage.sort_values(
+            by="domain", key=lambda x: x.str.count(r"\."), kind="stable"
         )
 
+        coverage.to_csv(out_dir / f"coverage_{rule_type_col}.csv", index=False)
+
 
 @hydra.main(
     config_path="../../conf",
@@ -697,13 +748,20 @@ def main(cfg: DictConfig = None) -> None:
             filterlists_parsed, cfg.patterns, return_as_string=False
         )
 
-        # parallelized
-        progress_starmap(
-            get_rule_applicable_domains,
-            [(name, rules) for name, rules in zip(names_to_fingerprint, allowed_rules)],
-            n_cpu=16,
+        rule_counts_per_domain = get_rule_counts_per_domain(
+            names_to_fingerprint, allowed_rules
+        )
+
+        counts_per_list = dict(
+            tuple(rule_counts_per_domain.groupby("list", sort=False))
         )
 
+        for name in names_to_fingerprint:
+            save_rule_applicable_domains(
+                name,
+                counts_per_list.get(name, rule_counts_per_domain.iloc[:0]),
+            )
+
         json.dump({"timestamp": timestamp}, open("build-meta.json", "w", encoding="utf-8"))
 
     elif cfg.action == "analyze":
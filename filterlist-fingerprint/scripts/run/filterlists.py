@@ -20,10 +20,12 @@ from filterlist_parser.filterlist_subscriptions import (
 )
 from filterlist_parser.raw import download_lists
 from filterlist_parser.rules import (
+    FILTERLIST_COLUMNS,
     unique_sets_of_filterlists,
     get_identifiable_list_rules,
-    parse_rules_from_filterlist_fp,
+    iter_filterlist_frames,
     unique_rules,
+    write_rule_frames,
 )
 from filterlist_parser.utils import slug
 
@@ -100,7 +102,9 @@ def parse_filterlist(cfg, name):
         if not cfg.parse.overwrite and out_fp.exists():
             return
 
-        parse_rules_from_filterlist_fp(list_fp).to_csv(out_fp, index=False)
+        write_rule_frames(
+            iter_filterlist_frames(list_fp), out_fp, columns=FILTERLIST_COLUMNS
+        )
         tqdm.write(f"Filterlist {name} parsed")
     except Exception as e:
         tqdm.write(f"Error parsing {name}: {e}")
@@ -111,9 +115,16 @@ def main(cfg: DictConfig) -> None:
 
     if cfg.action == "download":
 
-        download_lists(
+        statuses = download_lists(
             filterlists=cfg.filterlists.list,
             out_dir=Path(os.getcwd()),
+            max_workers=cfg.download.workers,
+            refresh=cfg.download.refresh,
+            retries=cfg.download.retries,
+        )
+
+        logger.info(
+            "Download statuses: %s", pd.Series(statuses).value_counts().to_dict()
         )
 
     elif cfg.action == "parse":
@@ -9,11 +9,21 @@ from omegaconf import DictConfig
 
 from gh_scraper.extract import adguard as extract_adguard
 from gh_scraper.extract import ublock as extract_ublock
+from gh_scraper.github import GitHubClient
 
 
 @hydra.main(config_path="../../conf", config_name="issues.conf", version_base=None)
 def main(cfg: DictConfig = None) -> None:
 
+    client = GitHubClient(
+        cache_dir=(
+            Path(to_absolute_path(cfg.github.cache_dir))
+            if cfg.github.cache_dir
+            else None
+        ),
+        prefetch=cfg.github.prefetch,
+    )
+
     if cfg.forum.name == "adguard":
         extract_adguard.scrape_confs(
             out_dir=Path(os.getcwd()),
@@ -21,6 +31,7 @@ def main(cfg: DictConfig = None) -> None:
             pages_limit=cfg.pages_limit,
             date_limit=datetime.strptime(cfg.date_limit, "%Y-%m-%dT%H:%M:%SZ") if cfg.date_limit else None,
             overwrite=cfg.overwrite,
+            client=client,
         )
 
         issues = pd.read_csv("issues_confs.csv")
@@ -43,6 +54,7 @@ def main(cfg: DictConfig = None) -> None:
                     else None
                 ),
                 prev_out_dir=cfg.get("prev_out_dir", None),
+                client=client,
             )
 
         else:
@@ -60,6 +72,8 @@ def main(cfg: DictConfig = None) -> None:
 
     else:
         raise ValueError(f"Unknown forum name: {cfg.forum.name}")
+
+    client.close()
     
     print("Issues extraction completed.")
 
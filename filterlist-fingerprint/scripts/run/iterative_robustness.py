@@ -14,33 +14,72 @@ import fingerprint.general as filterlist_general
 
 log = logging.getLogger(__name__)
 
+CHECKPOINT_FP = "state.json"
 
-def update_user_subscriptions(
-    user_subscriptions: pd.DataFrame, marker_to_fl_map: dict, fingerprint_results: dict
-):
-    """Update the identifiable lists after the defender enforces the previous mask rules on all users
-    this effectively makes equivalence sets from the previous iteration no longer identifiable
-    """
 
-    ids_to_remove = set()
+def masked_lists(marker_to_fl_map: dict, fingerprint_results: dict) -> set:
+    """The lists of the previous mask rules, that the defender enforces on all users.
+    This effectively makes equivalence sets from the previous iteration no longer identifiable
+    """
 
     is_key_str = isinstance(list(marker_to_fl_map.keys())[0], str)
 
-    for marker in fingerprint_results["best_mask"]:
-        fl = marker_to_fl_map[str(marker) if is_key_str else marker]
-        ids_to_remove.add(fl)
+    return {
+        marker_to_fl_map[str(marker) if is_key_str else marker]
+        for marker in fingerprint_results["best_mask"]
+    }
 
-    print(ids_to_remove)
 
-    def remove_ids(x):
-        return json.dumps(list(set(json.loads(x)) - ids_to_remove))
+def fingerprint_results_from(
+    best_mask: list, anon_sets: list, best_metric, n_users: int
+) -> dict:
+    """Fingerprint results and statistics of the anonymity sets"""
+
+    anon_set_sizes = np.array([len(s) for s in anon_sets])
+
+    return {
+        "best_mask": best_mask,
+        "best_metric": best_metric,
+        "anon_sets": anon_sets,
+        "stats": {
+            "best_mask_size": len(best_mask),
+            "n_anon_sets": len(anon_sets),
+            "max_anon_set_size": int(np.max(anon_set_sizes)),
+            "mean_anon_set_size": np.mean(anon_set_sizes),
+            "std_anon_set_size": np.std(anon_set_sizes),
+            "median_anon_set_size": int(np.median(anon_set_sizes)),
+            "anon_set_entropy": entropy(anon_set_sizes) / np.log(n_users),
+        },
+    }
 
-    new_subscriptions = user_subscriptions.copy()
-    new_subscriptions["identifiable_unique_lists"] = new_subscriptions[
-        "identifiable_unique_lists"
-    ].apply(remove_ids)
 
-    return new_subscriptions
+def save_checkpoint(
+    iteration: int, removed_lists: set, used_rules: set, summary: dict
+) -> None:
+    """Save the state of the iterative process once an iteration is reported"""
+
+    state = {
+        "iteration": iteration,
+        "removed_lists": sorted(removed_lists),
+        "used_rules": sorted(used_rules),
+        "summary": summary,
+    }
+
+    # write then rename so an interruption leaves the previous checkpoint
+    with open(CHECKPOINT_FP + ".tmp", "w") as f:
+        json.dump(state, f)
+
+    os.replace(CHECKPOINT_FP + ".tmp", CHECKPOINT_FP)
+
+
+def load_checkpoint() -> Optional[dict]:
+    """Load the state of the last reported iteration, if any"""
+
+    if not os.path.exists(CHECKPOINT_FP):
+        return None
+
+    with open(CHECKPOINT_FP) as f:
+        return json.load(f)
 
 
 def report_iteration(
@@ -158,20 +197,42 @@ def main(cfg: DictConfig = None) -> None:
     ) as f:
         fingerprint_results = json.load(f)
 
-    iteration = 0
-
-    iteration_summary, used_rules = report_iteration(
-        iteration,
-        marker_to_fl_map,
-        fingerprint_results,
-        equivalence_sets,
+    # 1.4 User/list index, kept in memory across iterations
+    fingerprinter = filterlist_general.IterativeGeneralFingerprinting(
+        user_subscriptions, col="identifiable_unique_lists"
     )
 
+    state = load_checkpoint()
+
+    if state is None:
+        iteration = 0
+
+        iteration_summary, used_rules = report_iteration(
+            iteration,
+            marker_to_fl_map,
+            fingerprint_results,
+            equivalence_sets,
+        )
+
+        save_checkpoint(
+            iteration, fingerprinter.removed_lists, used_rules, iteration_summary
+        )
+
+    else:
+        iteration = state["iteration"]
+        log.info(f"Resuming after iteration {iteration}")
+
+        marker_to_fl_map, fingerprint_results, iteration_summary = load_iteration(
+            iteration
+        )
+        used_rules = set(state["used_rules"])
+        fingerprinter.remove_lists(state["removed_lists"])
+
     while not "max_iter" in cfg.thresholds or iteration < cfg.thresholds.max_iter:
 
         if (
             "uniqueness" in cfg.thresholds
-            and iteration_summary["n_unique_users"] / len(user_subscriptions)
+            and iteration_summary["n_unique_users"] / fingerprinter.n_users
             <= cfg.thresholds.uniqueness
         ):
             log.info(f"Uniqueness threshold reached. Stopping at iteration {iteration}")
@@ -186,54 +247,32 @@ def main(cfg: DictConfig = None) -> None:
 
         iteration += 1
 
-        if os.path.exists(f"iter_{iteration}"):
-            log.info(f"Loading iteration {iteration}")
-            marker_to_fl_map, fingerprint_results, iteration_summary = load_iteration(
-                iteration
-            )
-
-        else:
-
-            # 2.1 Update user subscriptions
-            user_subscriptions = update_user_subscriptions(
-                user_subscriptions, marker_to_fl_map, fingerprint_results
-            )
-
-            # 2.2 Fingerprinting
-            (best_mask, anon_sets, best_metric), marker_to_fl_map = (
-                filterlist_general.general_fingerprinting(
-                    user_subscriptions,
-                    iteration_summary["best_mask_size"],
-                    col="identifiable_unique_lists",
-                )
-            )
-
-            anon_set_sizes = np.array([len(s) for s in anon_sets])
-
-            fingerprint_results = {
-                "best_mask": best_mask,
-                "best_metric": best_metric,
-                "anon_sets": anon_sets,
-                "stats": {
-                    "best_mask_size": len(best_mask),
-                    "n_anon_sets": len(anon_sets),
-                    "max_anon_set_size": int(np.max(anon_set_sizes)),
-                    "mean_anon_set_size": np.mean(anon_set_sizes),
-                    "std_anon_set_size": np.std(anon_set_sizes),
-                    "median_anon_set_size": int(np.median(anon_set_sizes)),
-                    "anon_set_entropy": entropy(anon_set_sizes)
-                    / np.log(len(user_subscriptions)),
-                },
-            }
-
-            # 2.3 Report iteration
-            iteration_summary, used_rules = report_iteration(
-                iteration,
-                marker_to_fl_map,
-                fingerprint_results,
-                equivalence_sets,
-                used_rules,
-            )
+        # 2.1 Remove the lists of the previous mask from all users
+        removed = masked_lists(marker_to_fl_map, fingerprint_results)
+        log.info(f"Removing lists {sorted(removed)}")
+        fingerprinter.remove_lists(removed)
+
+        # 2.2 Fingerprinting
+        (best_mask, anon_sets, best_metric), marker_to_fl_map = fingerprinter.fingerprint(
+            iteration_summary["best_mask_size"]
+        )
+
+        fingerprint_results = fingerprint_results_from(
+            best_mask, anon_sets, best_metric, fingerprinter.n_users
+        )
+
+        # 2.3 Report iteration
+        iteration_summary, used_rules = report_iteration(
+            iteration,
+            marker_to_fl_map,
+            fingerprint_results,
+            equivalence_sets,
+            used_rules,
+        )
+
+        save_checkpoint(
+            iteration, fingerprinter.removed_lists, used_rules, iteration_summary
+        )
 
     if "entropy" in cfg.thresholds and iteration >= cfg.thresholds.max_iter:
         log.info(f"Max iterations reached. Stopping at iteration {iteration}")
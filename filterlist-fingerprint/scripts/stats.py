@@ -5,6 +5,7 @@ import math
 from pathlib import Path
 from typing import Callable
 from filterlist_parser.utils import filterlist_to_tuple, get_filterlist_name_resolutions
+from fingerprint.coverage import GreedyMaxCoverage
 from matplotlib import pyplot as plt
 
 import numpy as np
@@ -1040,26 +1041,195 @@ def user_filters_changes(user_issues_df: pd.DataFrame):
     )
 
 
+# number of set bits of each byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def subscription_bitmasks(filters: pd.Series):
+    """
+    Encode the subscriptions (JSON lists of filterlists) as packed bitmasks over
+    list ids, parsing each distinct subscription once
+
+    Returns:
+        codes: index of the distinct subscription of each issue
+        masks: (distinct subscriptions x bytes) packed bitmasks
+        set_ids: index of the distinct set of filterlists of each distinct subscription
+        sets: set of filterlists of each distinct subscription
+        sizes: number of filterlists listed by each distinct subscription
+    """
+
+    codes, uniques = pd.factorize(filters)
+    lists = [json.loads(subscription) for subscription in uniques]
+    sets = [set(filterlists) for filterlists in lists]
+
+    list_ids = {}
+    rows, cols = [], []
+    for row, filterlists in enumerate(sets):
+        for name in filterlists:
+            rows.append(row)
+            cols.append(list_ids.setdefault(name, len(list_ids)))
+
+    matrix = np.zeros((len(sets), max(len(list_ids), 1)), dtype=bool)
+    matrix[rows, cols] = True
+    masks = np.packbits(matrix, axis=1)
+
+    # subscriptions listing the same filterlists in another order or with duplicates
+    _, set_ids = np.unique(masks, axis=0, return_inverse=True)
+
+    return (
+        codes,
+        masks,
+        set_ids.reshape(-1),
+        sets,
+        np.array([len(filterlists) for filterlists in lists]),
+    )
+
+
+def _subscription_statistics(
+    change_statistics: pd.DataFrame,
+    n_issues: pd.Series,
+    distribution: pd.Series,
+    span_hours,
+    first_size,
+) -> pd.DataFrame:
+    """
+    `user_subscriptions_statistics` of all the authors at once
+
+    Args:
+        change_statistics: changes of all the authors
+        n_issues: number of issues, indexed by author
+        distribution: JSON share of each subscription, indexed like n_issues
+        span_hours: hours between the first and last issue (per author or global)
+        first_size: size of the first subscription (per author or global)
+    """
+
+    changes = change_statistics.groupby("author").agg(
+        n_changes=("n_added", "size"),
+        average_duration=("duration_hours", "mean"),
+        average_added_n=("n_added", "mean"),
+        average_removed_n=("n_removed", "mean"),
+        average_changed_n=("n_changed", "mean"),
+        median_duration=("duration_hours", "median"),
+        median_added_n=("n_added", "median"),
+        median_removed_n=("n_removed", "median"),
+        median_changed_n=("n_changed", "median"),
+        min_duration=("duration_hours", "min"),
+        max_duration=("duration_hours", "max"),
+    )
+    changes = changes.reindex(n_issues.index)
+
+    n_changes = changes["n_changes"].fillna(0).astype(int)
+    changed = n_changes > 0
+
+    def _where_changed(values, default):
+        return pd.Series(values, index=n_issues.index).where(changed, default)
+
+    stats = pd.DataFrame(
+        {
+            "distribution": distribution,
+            "n_issues": n_issues,
+            "n_changes": n_changes,
+            "average_change_rate": _where_changed(
+                span_hours / n_changes.where(changed), 0
+            ),
+            "average_duration": _where_changed(changes["average_duration"], 0),
+            "average_size": _where_changed(
+                changes["average_added_n"] + changes["average_removed_n"], first_size
+            ),
+            "average_added_n": _where_changed(changes["average_added_n"], 0),
+            "average_removed_n": _where_changed(changes["average_removed_n"], 0),
+            "average_changed_n": _where_changed(changes["average_changed_n"], 0),
+            "median_duration": _where_changed(changes["median_duration"], 0),
+            "median_size": _where_changed(
+                changes["median_added_n"] + changes["median_removed_n"], first_size
+            ),
+            "median_added_n": _where_changed(changes["median_added_n"], 0),
+            "median_removed_n": _where_changed(changes["median_removed_n"], 0),
+            "median_changed_n": _where_changed(changes["median_changed_n"], 0),
+            "min_duration": _where_changed(changes["min_duration"], np.inf),
+            "max_duration": _where_changed(changes["max_duration"], np.inf),
+        }
+    )
+
+    return stats
+
+
 def get_users_changes_df_and_stats_df(users_issues_df: pd.DataFrame):
+    """
+    Changes of subscriptions between the consecutive issues of each author, the
+    authors who never changed, and the subscription statistics of each author,
+    computed over all the issues at once (see `user_filters_changes` and
+    `user_subscriptions_statistics` for a single author)
+    """
+
+    # the issues of each author, in their original order
+    issues = users_issues_df[users_issues_df["author"].notna()].sort_values(
+        "author", kind="stable"
+    )
 
-    change_statistics = []
-    unchanged_users = []
-    users_stats = []
+    codes, masks, set_ids, sets, sizes = subscription_bitmasks(issues["filters"])
 
-    for _, user_issues_df in users_issues_df.groupby("author"):
-        user_change_statistics, unchanged_user, user_values = user_filters_changes(
-            user_issues_df
-        )
-        change_statistics.append(user_change_statistics)
-        unchanged_users.append(unchanged_user)
+    author = issues["author"].to_numpy()
+    first = np.ones(len(issues), dtype=bool)
+    first[1:] = author[1:] != author[:-1]
 
-        user_stats = user_subscriptions_statistics(user_change_statistics, *user_values)
+    subscription = set_ids[codes]
+    changed = ~first
+    changed[1:] &= subscription[1:] != subscription[:-1]
 
-        users_stats.append(user_stats)
+    # a subscription lasts from the issue where it appears to the next change
+    created_at = pd.to_datetime(issues["created_at"]).reset_index(drop=True)
+    since = created_at.where(pd.Series(first | changed)).ffill()
+    duration_hours = (since.shift(1) - created_at).dt.total_seconds() / 60 / 60
 
-    change_statistics = pd.concat(change_statistics)
-    unchanged_users = pd.concat(unchanged_users)
-    users_stats = pd.DataFrame(users_stats)
+    rows = np.flatnonzero(changed)
+    from_masks = masks[codes[rows - 1]]
+    to_masks = masks[codes[rows]]
+    n_added = _POPCOUNT[to_masks & ~from_masks].sum(axis=1)
+    n_removed = _POPCOUNT[from_masks & ~to_masks].sum(axis=1)
+
+    change_statistics = pd.DataFrame(
+        {
+            "from": [sets[code] for code in codes[rows - 1]],
+            "to": issues["filters"].to_numpy()[rows],
+            "n_added": n_added,
+            "n_removed": n_removed,
+            "n_changed": n_added + n_removed,
+            "from_date": issues["created_at"].to_numpy()[rows],
+            "duration_hours": duration_hours.to_numpy()[rows],
+            "author": author[rows],
+        }
+    )
+
+    per_author = issues.groupby("author").agg(
+        filters=("filters", "first"),
+        n_issues=("filters", "size"),
+        min_date=("created_at", "min"),
+        max_date=("created_at", "max"),
+    )
+    n_changes = pd.Series(changed).groupby(author).sum().reindex(per_author.index)
+
+    unchanged_users = per_author[n_changes == 0].reset_index()
+
+    # share of each subscription of the author, most frequent first
+    counts = issues.groupby(["author", "filters"]).size().rename("n").reset_index()
+    counts = counts.sort_values(["author", "n"], ascending=[True, False], kind="stable")
+    counts["share"] = counts["n"] / counts["author"].map(per_author["n_issues"])
+    distribution = counts.groupby("author")["share"].agg(
+        lambda shares: json.dumps(list(shares.to_numpy()))
+    )
+
+    span_hours = (
+        pd.to_datetime(per_author["max_date"]) - pd.to_datetime(per_author["min_date"])
+    ).dt.total_seconds() / 60 / 60
+
+    users_stats = _subscription_statistics(
+        change_statistics,
+        per_author["n_issues"],
+        distribution,
+        span_hours,
+        pd.Series(sizes[codes[first]], index=author[first]),
+    ).reset_index(drop=True)
 
     return change_statistics, unchanged_users, users_stats
 
@@ -1182,18 +1352,24 @@ def users_subscriptions_stats(
 
         # _df = changed_df.copy()
 
-        _df_stats = _df.groupby("author").apply(
-            lambda for_user: user_subscriptions_statistics(
-                for_user,
-                pd.Series(),
-                pd.to_datetime(_df.from_date.min()),
-                pd.to_datetime(_df.from_date.max()),
-                [],
-                (
-                    (issues_df.author == for_user.name)
-                    & (pd.to_datetime(issues_df.created_at) >= min_date)
-                ).sum(),
-            )
+        recent_issues = issues_df[pd.to_datetime(issues_df.created_at) >= min_date]
+        n_issues = (
+            recent_issues.groupby("author")
+            .size()
+            .reindex(np.sort(_df.author.unique()), fill_value=0)
+        )
+
+        _df_stats = _subscription_statistics(
+            _df,
+            n_issues,
+            json.dumps([]),
+            (
+                pd.to_datetime(_df.from_date.max())
+                - pd.to_datetime(_df.from_date.min())
+            ).total_seconds()
+            / 60
+            / 60,
+            0,
         )
 
         users_with_no_changes_and_mult_issues = _df_stats[(_df_stats.n_changes == 0)]
@@ -1439,50 +1615,35 @@ def domain_coverage_stats(
     domain_rule_counts: pd.DataFrame,
     attack_list_rule_counts: pd.DataFrame,
     is_notebook=False,
+    list_weights: dict = None,
+    domain_costs: pd.Series = None,
+    budget: float = None,
+    max_domains: int = None,
 ):
 
-    all_lists = set(list(domain_rule_counts.columns)[1:-2])
+    list_names = list(domain_rule_counts.columns)[1:-2]
+    all_lists = set(list_names)
     unique_lists = set(
         attack_list_rule_counts[attack_list_rule_counts.count_unique > 0].name.values
     )
 
-    def get_domain_with_most_remaining(already_covered_lists: set):
-
-        already_covered_lists = already_covered_lists & all_lists
-        uncovered_lists = all_lists - already_covered_lists
-
-        remaining_domain_rule_counts: pd.DataFrame = domain_rule_counts.drop(
-            columns=list(already_covered_lists) + ["total_rules", "total_lists"]
-        )
-
-        # count the lists where the value is not 0
-        remaining_domain_rule_counts["total_lists"] = (
-            remaining_domain_rule_counts.apply(
-                lambda x: (x[list(uncovered_lists)].values != 0).sum(), axis=1
-            )
-        )
-
-        max_additional_lists = remaining_domain_rule_counts.total_lists.max()
-        domain_with_max = remaining_domain_rule_counts[
-            remaining_domain_rule_counts.total_lists == max_additional_lists
-        ].domain.values[0]
-
-        if max_additional_lists == 0:
-            return domain_with_max, set()
-
-        # get the columns that are not 0
-        additional_covered_lists = set(
-            [
-                col
-                for col in uncovered_lists
-                if remaining_domain_rule_counts.loc[
-                    remaining_domain_rule_counts.domain == domain_with_max, col
-                ].values[0]
-                != 0
-            ]
-        )
+    # greedy max coverage over the (domains x lists) matrix of non-zero counts
+    engine = GreedyMaxCoverage(
+        domain_rule_counts[list_names].to_numpy() != 0,
+        weights=(
+            None
+            if list_weights is None
+            else [list_weights.get(name, 0) for name in list_names]
+        ),
+        costs=None if domain_costs is None else domain_costs.to_numpy(),
+    )
+    picks = engine.run(
+        covered=[name in unique_lists for name in list_names],
+        max_domains=max_domains,
+        budget=budget,
+    )
 
-        return domain_with_max, additional_covered_lists
+    domains = domain_rule_counts.domain.values
 
     already_covered = unique_lists
     chosen_domains = []
@@ -1490,10 +1651,7 @@ def domain_coverage_stats(
     if is_notebook:
         print(f"Total lists: {len(all_lists)}, Unique lists: {len(unique_lists)}")
 
-    while len(already_covered) < len(all_lists):
-
-        domain, additional_lists = get_domain_with_most_remaining(already_covered)
-
+    def _choose(domain, additional_lists):
         already_covered.update(additional_lists)
 
         chosen_domains.append(
@@ -1510,9 +1668,18 @@ def domain_coverage_stats(
                 f"Domain: {domain}, Additional lists: {len(additional_lists)}, Total lists: {len(already_covered)}"
             )
 
-        if len(additional_lists) == 0:
+    for row, new_lists in picks:
+
+        if len(already_covered) >= len(all_lists):
             break
 
+        _choose(domains[row], {list_names[i] for i in new_lists})
+
+    # no domain adds any list anymore
+    no_limits = max_domains is None and budget is None
+    if no_limits and len(already_covered) < len(all_lists) and len(domains):
+        _choose(domains[0], set())
+
     chosen_domains = pd.DataFrame(
         chosen_domains,
         columns=["domain", "additional_lists", "n_additional_lists", "n_total_lists"],
@@ -0,0 +1,371 @@
+"""
+Classify crawled requests with the network rules of filterlists.
+
+Requests are (url, page domain, resource type) records read from a JSONL or
+Parquet request log. They are matched in batches by a pool of workers, each
+holding one compiled `AdblockRules` matcher over the rules of all the lists. The
+result is the number of hits of each rule and, for each list, the number of
+requests that the list alone would block.
+"""
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import json
+import multiprocessing
+from pathlib import Path
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import pandas as pd
+from tqdm import tqdm
+
+from filterlist_parser.adguardparser.parser import AdblockRules
+
+# request log field names, with the accepted aliases
+URL_FIELDS = ("url", "request_url")
+PAGE_DOMAIN_FIELDS = ("page_domain", "domain", "top_level_domain")
+RESOURCE_TYPE_FIELDS = ("resource_type", "type")
+
+RESOURCE_TYPES = [
+    "script",
+    "image",
+    "stylesheet",
+    "object",
+    "xmlhttprequest",
+    "object-subrequest",
+    "subdocument",
+    "document",
+    "media",
+    "websocket",
+    "ping",
+    "other",
+]
+
+# browser (webRequest / CDP) resource types to filter rule options
+RESOURCE_TYPE_ALIASES = {
+    "xhr": "xmlhttprequest",
+    "fetch": "xmlhttprequest",
+    "sub_frame": "subdocument",
+    "main_frame": "document",
+    "img": "image",
+    "imageset": "image",
+    "css": "stylesheet",
+    "font": "other",
+    "beacon": "ping",
+}
+
+Request = Tuple[str, Optional[str], Optional[str]]
+
+
+def _field(record: dict, names: Tuple[str, ...]):
+    for name in names:
+        if name in record:
+            return record[name]
+    return None
+
+
+def _base_domain(host: str) -> str:
+    """Approximation of the registrable domain: the last two labels"""
+    return ".".join(host.split(".")[-2:])
+
+
+def request_options(
+    url: str, page_domain: Optional[str], resource_type: Optional[str]
+) -> dict:
+    """
+    Matching options of a request
+
+    Args:
+        url: requested URL
+        page_domain: domain of the page that made the request
+        resource_type: resource type of the request
+
+    Returns:
+        options: {option: value} for `AdblockRules.should_block`
+    """
+
+    options = {}
+
+    if resource_type:
+        resource_type = RESOURCE_TYPE_ALIASES.get(resource_type, resource_type)
+        options |= {t: t == resource_type for t in RESOURCE_TYPES}
+
+    if page_domain:
+        host = urlsplit(url).hostname or ""
+        options["domain"] = page_domain
+        options["third-party"] = _base_domain(host) != _base_domain(page_domain)
+
+    return options
+
+
+def iter_request_log(fp: Path, batch_size: int = 10_000) -> Iterator[List[Request]]:
+    """
+    Stream the requests of a JSONL or Parquet (needs pyarrow) request log
+
+    Args:
+        fp: path to the request log
+        batch_size: number of requests per batch
+
+    Returns:
+        batches: iterator of lists of (url, page domain, resource type)
+    """
+
+    fp = Path(fp)
+
+    if fp.suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading Parquet request logs requires pyarrow") from e
+
+        for batch in pq.ParquetFile(fp).iter_batches(batch_size=batch_size):
+            yield [
+                (
+                    _field(record, URL_FIELDS),
+                    _field(record, PAGE_DOMAIN_FIELDS),
+                    _field(record, RESOURCE_TYPE_FIELDS),
+                )
+                for record in batch.to_pylist()
+            ]
+
+        return
+
+    batch = []
+
+    with open(fp, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            batch.append(
+                (
+                    _field(record, URL_FIELDS),
+                    _field(record, PAGE_DOMAIN_FIELDS),
+                    _field(record, RESOURCE_TYPE_FIELDS),
+                )
+            )
+
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+
+class RequestClassifier:
+    """A matcher over the rules of many lists, keeping track of the provenance of each rule"""
+
+    def __init__(self, list_rules: Dict[str, Iterable[str]]):
+        """
+        Args:
+            list_rules: {list name: rules of the list}
+        """
+
+        rule_lists: Dict[str, List[str]] = {}
+
+        for name, rules in list_rules.items():
+            for rule in rules:
+                rule = rule.strip()
+
+                if rule:
+                    rule_lists.setdefault(rule, []).append(name)
+
+        self.matcher = AdblockRules(list(rule_lists))
+
+        # only the rules kept by the matcher can fire
+        self.rules = [rule.raw_rule_text.strip() for rule in self.matcher.rules]
+        self.rule_ids = {rule: i for i, rule in enumerate(self.rules)}
+        self.rule_lists = [rule_lists[rule] for rule in self.rules]
+        self.rule_is_exception = [rule.is_exception for rule in self.matcher.rules]
+        self.list_names = list(list_rules)
+
+    def classify(self, requests: Iterable[Request]) -> dict:
+        """
+        Match requests against the rules
+
+        Args:
+            requests: iterator of (url, page domain, resource type)
+
+        Returns:
+            stats: {"n_requests", "n_blocked", "rule_hits": Counter of rule ids,
+                "list_blocked": Counter of list names}
+        """
+
+        rule_hits = Counter()
+        list_blocked = Counter()
+        n_requests = n_blocked = 0
+
+        for url, page_domain, resource_type in requests:
+            if not url:
+                continue
+
+            n_requests += 1
+
+            blocking, exceptions = self.matcher.matching_rules(
+                url, request_options(url, page_domain, resource_type)
+            )
+
+            blocking = [self.rule_ids[r.raw_rule_text.strip()] for r in blocking]
+            exceptions = [self.rule_ids[r.raw_rule_text.strip()] for r in exceptions]
+
+            rule_hits.update(blocking)
+            rule_hits.update(exceptions)
+
+            if blocking and not exceptions:
+                n_blocked += 1
+
+            # each list on its own only applies its own exceptions
+            excepted = {name for i in exceptions for name in self.rule_lists[i]}
+            list_blocked.update(
+                {name for i in blocking for name in self.rule_lists[i]} - excepted
+            )
+
+        return {
+            "n_requests": n_requests,
+            "n_blocked": n_blocked,
+            "rule_hits": rule_hits,
+            "list_blocked": list_blocked,
+        }
+
+
+# matcher of each worker process, inherited from the parent or compiled by the pool initializer
+_CLASSIFIER: Optional[RequestClassifier] = None
+
+
+def _init_worker(list_rules: Dict[str, List[str]]):
+    global _CLASSIFIER
+    _CLASSIFIER = RequestClassifier(list_rules)
+
+
+def _worker_pool(
+    classifier: RequestClassifier, list_rules: Dict[str, List[str]], workers: int
+) -> ProcessPoolExecutor:
+    """A pool sharing the compiled matcher: inherited on fork, compiled once per worker otherwise"""
+
+    global _CLASSIFIER
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        _CLASSIFIER = classifier
+        return ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(list_rules,)
+    )
+
+
+def _classify_batch(batch: List[Request]) -> dict:
+    return _CLASSIFIER.classify(batch)
+
+
+def _merge_stats(total: dict, stats: dict):
+    total["n_requests"] += stats["n_requests"]
+    total["n_blocked"] += stats["n_blocked"]
+    total["rule_hits"].update(stats["rule_hits"])
+    total["list_blocked"].update(stats["list_blocked"])
+
+
+def classify_requests(
+    list_rules: Dict[str, List[str]],
+    batches: Iterable[List[Request]],
+    workers: int = 4,
+) -> Tuple[pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Classify batches of requests on a pool of workers sharing the compiled rules
+
+    Args:
+        list_rules: {list name: rules of the list}
+        batches: iterator of lists of (url, page domain, resource type)
+        workers: number of worker processes, classify in-process if 0
+
+    Returns:
+        rule_hits: columns rule, exception, hits, lists, for the rules that fired
+        list_coverage: columns list, n_rules_hit, n_blocked, share_blocked
+        summary: n_requests, n_blocked, duration_s, urls_per_s
+    """
+
+    list_rules = {name: list(rules) for name, rules in list_rules.items()}
+    classifier = RequestClassifier(list_rules)
+
+    total = {
+        "n_requests": 0,
+        "n_blocked": 0,
+        "rule_hits": Counter(),
+        "list_blocked": Counter(),
+    }
+
+    start = time.perf_counter()
+
+    with tqdm(desc="Requests", unit="url") as pbar:
+
+        if workers == 0:
+            for batch in batches:
+                stats = classifier.classify(batch)
+                _merge_stats(total, stats)
+                pbar.update(stats["n_requests"])
+
+        else:
+            with _worker_pool(classifier, list_rules, workers) as executor:
+                pending = set()
+
+                for batch in batches:
+                    # bounded number of batches in flight
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                        for future in done:
+                            stats = future.result()
+                            _merge_stats(total, stats)
+                            pbar.update(stats["n_requests"])
+
+                    pending.add(executor.submit(_classify_batch, batch))
+
+                for future in pending:
+                    stats = future.result()
+                    _merge_stats(total, stats)
+                    pbar.update(stats["n_requests"])
+
+    duration = time.perf_counter() - start
+
+    rule_hits = pd.DataFrame(
+        [
+            {
+                "rule": classifier.rules[i],
+                "exception": classifier.rule_is_exception[i],
+                "hits": hits,
+                "lists": json.dumps(classifier.rule_lists[i]),
+            }
+            for i, hits in total["rule_hits"].most_common()
+        ],
+        columns=["rule", "exception", "hits", "lists"],
+    )
+
+    rules_hit_per_list = Counter(
+        name for i in total["rule_hits"] for name in classifier.rule_lists[i]
+    )
+
+    list_coverage = pd.DataFrame(
+        [
+            {
+                "list": name,
+                "n_rules_hit": rules_hit_per_list[name],
+                "n_blocked": total["list_blocked"][name],
+                "share_blocked": total["list_blocked"][name]
+                / max(total["n_requests"], 1),
+            }
+            for name in classifier.list_names
+        ]
+    ).sort_values("n_blocked", ascending=False)
+
+    summary = {
+        "n_requests": total["n_requests"],
+        "n_blocked": total["n_blocked"],
+        "duration_s": duration,
+        "urls_per_s": total["n_requests"] / duration if duration > 0 else None,
+    }
+
+    return rule_hits, list_coverage, summary
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import re
 from collections import defaultdict
 from functools import partial
+from itertools import repeat
 from filterlist_parser.utils import split_data
 
 
@@ -460,7 +461,14 @@ class AdblockRules(object):
 
     It is more efficient to use AdblockRules instead of creating AdblockRule
     instances manually and checking them one-by-one because AdblockRules
-    optimizes some common cases.
+    indexes the rules: each rule is filed under one keyword of its pattern,
+    and only the rules filed under the keywords of an URL are checked.
+
+    >>> rules = AdblockRules(["||ads.example.com^", "@@||ads.example.com/ok$image"])
+    >>> rules.should_block("http://ads.example.com/banner.gif")
+    True
+    >>> rules.should_block("http://ads.example.com/ok.gif", {"image": True})
+    False
     """
 
     def __init__(
@@ -490,37 +498,26 @@ class AdblockRules(object):
             if (r.regex or r.options) and r.matching_supported(_params)
         ]
 
-        # "advanced" rules are rules with options,
-        # "basic" rules are rules without options
-        advanced_rules, basic_rules = split_data(self.rules, lambda r: r.options)
-
-        # Rules with domain option are handled separately:
-        # if user passes a domain we can discard all rules which
-        # require another domain. So we build an index:
-        # {domain: [rules_which_require_it]}, and only check
-        # rules which require our domain. If a rule doesn't require any
-        # domain.
-        # TODO: what about ~rules? Should we match them earlier?
-        domain_required_rules, non_domain_rules = split_data(
-            advanced_rules,
-            lambda r: ("domain" in r.options and any(r.options["domain"].values())),
-        )
+        # keywords are picked among the least frequent ones over all the rules
+        token_counts = defaultdict(int)
+        for rule in self.rules:
+            for token in _rule_tokens(rule):
+                token_counts[token] += 1
 
         # split rules into blacklists and whitelists
-        self.blacklist, self.whitelist = self._split_bw(basic_rules)
-        _combined = partial(_combined_regex, use_re2=self.uses_re2, max_mem=max_mem)
-        self.blacklist_re = _combined([r.regex for r in self.blacklist])
-        self.whitelist_re = _combined([r.regex for r in self.whitelist])
-
-        self.blacklist_with_options, self.whitelist_with_options = self._split_bw(
-            non_domain_rules
-        )
-        self.blacklist_require_domain, self.whitelist_require_domain = (
-            self._split_bw_domain(domain_required_rules)
+        self.blacklist, self.whitelist = self._split_bw(self.rules)
+
+        _index = partial(
+            _RuleIndex,
+            token_counts=token_counts,
+            skip_unsupported_rules=skip_unsupported_rules,
+            use_re2=self.uses_re2,
+            max_mem=max_mem,
         )
+        self.blacklist_index = _index(self.blacklist)
+        self.whitelist_index = _index(self.whitelist)
 
     def should_block(self, url, options=None):
-        # TODO: group rules with similar options and match them in bigger steps
         options = options or {}
         if self._is_whitelisted(url, options):
             return False
@@ -528,74 +525,229 @@ class AdblockRules(object):
             return True
         return False
 
-    def _is_whitelisted(self, url, options):
-        return self._matches(
-            url,
-            options,
-            self.whitelist_re,
-            self.whitelist_require_domain,
-            self.whitelist_with_options,
+    def should_block_batch(self, urls, options=None):
+        """
+        Return ``should_block`` for many URLs.
+
+        ``options`` is either one dict shared by all the URLs or an iterable
+        with one dict per URL. The domain option lookups are shared between
+        URLs loaded from the same page domain.
+        """
+        if options is None or isinstance(options, dict):
+            options = repeat(options)
+
+        return [self.should_block(url, opts) for url, opts in zip(urls, options)]
+
+    def matching_rules(self, url, options=None):
+        """
+        Return the rules matching ``url``/``options``, as a tuple of
+        (blocking rules, exception rules). The URL is blocked if there are
+        blocking rules and no exception rules.
+        """
+        options = options or {}
+        return (
+            self.blacklist_index.matching_rules(url, options),
+            self.whitelist_index.matching_rules(url, options),
         )
 
+    def _is_whitelisted(self, url, options):
+        return self.whitelist_index.matches(url, options)
+
     def _is_blacklisted(self, url, options):
-        return self._matches(
-            url,
-            options,
-            self.blacklist_re,
-            self.blacklist_require_domain,
-            self.blacklist_with_options,
-        )
+        return self.blacklist_index.matches(url, options)
 
-    def _matches(
-        self, url, options, general_re, domain_required_rules, rules_with_options
-    ):
-        """
-        Return if ``url``/``options`` are matched by rules defined by
-        ``general_re``, ``domain_required_rules`` and ``rules_with_options``.
+    @classmethod
+    def _split_bw(cls, rules):
+        return split_data(rules, lambda r: not r.is_exception)
 
-        ``general_re`` is a compiled regex for rules without options.
 
-        ``domain_required_rules`` is a {domain: [rules_which_require_it]}
-        mapping.
+# a keyword is a run of these characters, in lowercase URLs and rule patterns
+_TOKEN_RE = re.compile(r"[a-z0-9%]{2,}")
+_TOKEN_CHARS_RE = re.compile(r"[a-z0-9%]+")
 
-         ``rules_with_options`` is a list of AdblockRule instances that
-        don't require any domain, but have other options.
-        """
-        if general_re and general_re.search(url):
-            return True
 
-        rules = []
-        if "domain" in options and domain_required_rules:
-            src_domain = options["domain"]
-            for domain in _domain_variants(src_domain):
-                if domain in domain_required_rules:
-                    rules.extend(domain_required_rules[domain])
+def _rule_tokens(rule):
+    """
+    Keywords that any URL matched by ``rule`` contains as a whole token.
+    A run of the pattern is a whole token of the URL only if it is delimited
+    on both sides by a separator or an anchor, not by a wildcard or by the
+    unanchored start or end of the pattern.
+
+    >>> _rule_tokens(AdblockRule("||ads.example.com^"))
+    ['ads', 'example', 'com']
+    >>> _rule_tokens(AdblockRule("/banner/*/img"))
+    ['banner']
+    >>> _rule_tokens(AdblockRule("/ads[0-9]/"))
+    []
+    """
+    pattern = rule.rule_text.lower()
 
-        rules.extend(rules_with_options)
+    if len(pattern) > 1 and pattern.startswith("/") and pattern.endswith("/"):
+        # regular expressions are not indexed
+        return []
 
-        if self.skip_unsupported_rules:
-            rules = [rule for rule in rules if rule.matching_supported(options)]
+    tokens = []
+    for match in _TOKEN_CHARS_RE.finditer(pattern):
+        start, end = match.span()
 
-        return any(rule.match_url(url, options) for rule in rules)
+        if end - start < 2:
+            continue
+        if start == 0 or pattern[start - 1] == "*":
+            continue
+        if end == len(pattern) or pattern[end] == "*":
+            continue
 
-    @classmethod
-    def _split_bw(cls, rules):
-        return split_data(rules, lambda r: not r.is_exception)
+        tokens.append(match.group())
 
-    @classmethod
-    def _split_bw_domain(cls, rules):
-        blacklist, whitelist = cls._split_bw(rules)
-        return cls._domain_index(blacklist), cls._domain_index(whitelist)
+    return tokens
 
-    @classmethod
-    def _domain_index(cls, rules):
-        result = defaultdict(list)
-        for rule in rules:
+
+class _RuleIndex(object):
+    """
+    Rules of one kind (blocking or exception) indexed for matching.
+
+    * each rule is filed under its least frequent keyword, rules without
+      keywords are always checked (option-less ones through a combined regex)
+    * rules with ``domain=`` options are indexed by domain: a rule requiring
+      some domains is only checked for the pages of these domains, and a rule
+      only excluding domains is not checked for the pages of these domains
+    """
+
+    def __init__(
+        self,
+        rules,
+        token_counts,
+        skip_unsupported_rules=True,
+        use_re2=False,
+        max_mem=None,
+    ):
+        self.rules = rules
+        self.skip_unsupported_rules = skip_unsupported_rules
+
+        self.by_token = defaultdict(list)
+        self.untokenized = []
+        untokenized_basic = []
+
+        for i, rule in enumerate(rules):
+            tokens = _rule_tokens(rule)
+
+            if tokens:
+                self.by_token[min(tokens, key=token_counts.__getitem__)].append(i)
+            elif rule.options:
+                self.untokenized.append(i)
+            else:
+                untokenized_basic.append(i)
+
+        self.by_token = dict(self.by_token)
+        self.untokenized_basic = untokenized_basic
+        self.untokenized_basic_re = _combined_regex(
+            [rules[i].regex for i in untokenized_basic],
+            use_re2=use_re2,
+            max_mem=max_mem,
+        )
+
+        # option-less rules match case-insensitively, like the combined regex
+        self.basic_re = [
+            None if rule.options else re.compile(rule.regex, re.IGNORECASE)
+            for rule in rules
+        ]
+
+        self.requires_domain = set()
+        self.domain_required = defaultdict(set)
+        self.domain_excluded = defaultdict(set)
+
+        for i, rule in enumerate(rules):
             domains = rule.options.get("domain", {})
-            for domain, required in domains.items():
-                if required:
-                    result[domain].append(rule)
-        return dict(result)
+
+            if any(domains.values()):
+                self.requires_domain.add(i)
+                for domain, required in domains.items():
+                    if required:
+                        self.domain_required[domain].add(i)
+
+            else:
+                for domain in domains:
+                    self.domain_excluded[domain].add(i)
+
+        self._domain_cache = {}
+
+    def _domain_filter(self, options):
+        """Rules (enabled, disabled) by the domain option, cached by domain"""
+
+        domain = options.get("domain")
+
+        if domain is None:
+            return frozenset(), frozenset()
+
+        if domain not in self._domain_cache:
+            enabled, disabled = set(), set()
+
+            for variant in _domain_variants(domain):
+                enabled |= self.domain_required.get(variant, set())
+                disabled |= self.domain_excluded.get(variant, set())
+
+            if len(self._domain_cache) > 4096:
+                self._domain_cache.clear()
+
+            self._domain_cache[domain] = (enabled, disabled)
+
+        return self._domain_cache[domain]
+
+    def _candidates(self, url, options):
+        enabled, disabled = self._domain_filter(options)
+
+        candidates = list(self.untokenized)
+        for token in set(_TOKEN_RE.findall(url.lower())):
+            candidates.extend(self.by_token.get(token, ()))
+
+        for i in candidates:
+            if i in disabled:
+                continue
+            if i in self.requires_domain and i not in enabled:
+                continue
+
+            yield i
+
+    def _rule_matches(self, i, url, options):
+        basic_re = self.basic_re[i]
+
+        if basic_re is not None:
+            return bool(basic_re.search(url))
+
+        rule = self.rules[i]
+
+        if self.skip_unsupported_rules and not rule.matching_supported(options):
+            return False
+
+        return rule.match_url(url, options)
+
+    def matches(self, url, options):
+        """Return if any rule matches ``url``/``options``"""
+
+        if self.untokenized_basic_re and self.untokenized_basic_re.search(url):
+            return True
+
+        return any(
+            self._rule_matches(i, url, options)
+            for i in self._candidates(url, options)
+        )
+
+    def matching_rules(self, url, options):
+        """Return all the rules matching ``url``/``options``"""
+
+        matching = [
+            self.rules[i]
+            for i in self.untokenized_basic
+            if self.basic_re[i].search(url)
+        ]
+
+        matching.extend(
+            self.rules[i]
+            for i in self._candidates(url, options)
+            if self._rule_matches(i, url, options)
+        )
+
+        return matching
 
 
 def _domain_variants(domain):
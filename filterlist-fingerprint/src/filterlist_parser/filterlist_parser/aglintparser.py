@@ -1,10 +1,11 @@
 """A module to interact with the aglint package"""
 
 import json
+from itertools import islice
 from pathlib import Path
 import subprocess
 import re
-from typing import Iterator, List
+from typing import Iterable, Iterator, List
 from pynpm import YarnPackage, NPMPackage
 from tqdm import tqdm
 
@@ -158,7 +159,9 @@ class AGLintBinding:
                         tqdm.write(f"Error parsing line: {line}")
 
     @staticmethod
-    def _parse_filter_rules_sync(rule_texts: list[str]) -> Iterator["AdblockRule"]:
+    def _parse_filter_rules_sync(
+        rule_texts: list[str], keep_ast: bool = False
+    ) -> Iterator["AdblockRule"]:
         """
         Parse a list of filter rules using aglint, turning each rule line into 
         an AdblockRule object. All of these rules are passed to nodejs 
@@ -166,6 +169,7 @@ class AGLintBinding:
 
         Args:
             rule_texts (list[str]): The filter rule texts.
+            keep_ast (bool, optional): Keep the AST of each rule. Defaults to False.
 
         Returns:
             Iterator[AdblockRule]: An iterator of AdblockRule rules.
@@ -194,38 +198,33 @@ class AGLintBinding:
 
                         if is_parser_error(rule_ats):
                             yield None
+                            continue
 
-                        yield AdblockRule(rule_ats)
+                        yield AdblockRule(rule_ats, keep_ast=keep_ast)
                     except json.JSONDecodeError:
                         tqdm.write(f"Error parsing line: {line}")
 
     @staticmethod
     def parse_filter_rules(
-        rule_texts: list[str], batch_size=10
+        rule_texts: Iterable[str], batch_size=10, keep_ast: bool = False
     ) -> Iterator["AdblockRule"]:
-        """Parse a list of filter rules using aglint, turning each rule line into an AdblockRule object.
+        """Parse filter rules using aglint, turning each rule line into an AdblockRule object.
+        Rules are read and parsed one batch at a time, so `rule_texts` can be a stream.
 
         Args:
-            rule_texts (list[str]): The filter rule texts.
+            rule_texts (Iterable[str]): The filter rule texts.
             batch_size (int, optional): The batch size to use when parsing the rules. Each batch is passed to nodejs in one command. Defaults to 10.
+            keep_ast (bool, optional): Keep the AST of each rule in the AdblockRule. Defaults to False.
 
         Returns:
-            Iterator[AdblockRule]: An iterator of AdblockRule rules.
+            Iterator[AdblockRule]: An iterator of AdblockRule rules, None for parsing errors.
 
         """
 
-        rules = []
-        n_rules = len(rule_texts)
-        n_iterations = n_rules // batch_size + 1
-
-        for i in range(n_iterations):
+        rule_texts = iter(rule_texts)
 
-            start = i * batch_size
-            end = (i + 1) * batch_size if i != n_iterations - 1 else n_rules
-
-            rules.extend(AGLintBinding._parse_filter_rules_sync(rule_texts[start:end]))
-
-        return rules
+        while batch := list(islice(rule_texts, batch_size)):
+            yield from AGLintBinding._parse_filter_rules_sync(batch, keep_ast)
 
 
 def is_parser_error(rule: dict) -> bool:
@@ -233,6 +232,56 @@ def is_parser_error(rule: dict) -> bool:
     return rule["category"] == "ParserError"
 
 
+def get_activating_domains(
+    raw_rule_text: str, is_cosmetic: bool, is_network: bool, options: dict
+) -> List[str]:
+    """Get the source domains where a rule would be checked in their contexts.
+
+    Args:
+        raw_rule_text (str): The filter rule text.
+        is_cosmetic (bool): Whether the rule is a cosmetic rule.
+        is_network (bool): Whether the rule is a network rule.
+        options (dict): The modifiers of the rule.
+
+    Returns:
+        List[str]: The activating domains, without negated or empty ones.
+    """
+
+    domains = []
+
+    if is_cosmetic:
+
+        try:
+            _domains, _ = raw_rule_text.split("#", 1)
+        except ValueError:
+            _domains = ""
+
+        separator = ","
+        if "|" in _domains:
+            separator = "|"
+
+        if len(_domains) > 0:
+            domains.extend(_domains.split(separator))
+
+    if is_network:
+
+        _domains = options.get("domain", "")
+
+        separator = ","
+        if "|" in _domains:
+            separator = "|"
+
+        domains = _domains.split(separator)
+        # remove negatives
+        domains = [domain for domain in domains if not domain.startswith("~")]
+
+    return [domain for domain in domains if len(domain) > 0]
+
+
+# marks a lazily computed attribute that was not computed yet
+_UNSET = object()
+
+
 class AdblockRule(object):
     """A representation of a filter rule with useful attributes and methods"""
 
@@ -301,8 +350,29 @@ class AdblockRule(object):
         r"/*\.(html|htm|php|asp|aspx|jsp|jspx|cfm|cgi|pl|py|rb|xml|json)[^\w]*"
     )
 
+    EXTENDED_CSS_SEPARATORS = ("#?#", "#@?#", "#$?#", "#@$?#")
+
+    HIDE_TOKENS = (
+        "visibility: hidden",
+        "display: none",
+        "display:none",
+        "visibility:hidden",
+    )
+
+    REMOVE_TOKENS = (
+        "remove()",
+        "remove: 1",
+        "remove:1",
+        "remove: true",
+        "remove:true",
+    )
+
+    # only the fields needed to describe the rule are kept, the agtree AST is
+    # dropped and the costlier attributes are computed on first access
     __slots__ = [
-        "raw_rule_text",
+        "_text",  # raw rule text, unescaped
+        "_pattern",  # pattern of network rules, unescaped
+        "_type",  # agtree rule type
         "is_comment",
         "is_cosmetic_rule",
         "is_network_rule",
@@ -310,88 +380,52 @@ class AdblockRule(object):
         "is_html_rule",
         "is_js_rule",
         "is_exception",
-        "cosmetic_how",  # hide or remove
         "network_how",  # block or advanced
-        "resource_type",  # script, image, stylesheet, etc.
-        "raw_options",
         "options",
-        "_options_keys",
-        "rule_text",
-        "regex",
-        "regex_re",
+        "_raw_rule_text",
+        "_cosmetic_how",  # hide or remove
+        "_resource_type",  # script, image, stylesheet, etc.
+        "_activating_domains",
         "_rule_ats",
     ]
 
-    def __init__(self, rule_ats: dict):
+    # the rules are not compiled to regular expressions
+    regex = None
 
-        # defaults
-        self.is_extended_css = False
-        self.cosmetic_how = None
-        self.network_how = None
-        self.regex = None
-        self._rule_ats = rule_ats
+    def __init__(self, rule_ats: dict, keep_ast: bool = False):
+        """
+        Args:
+            rule_ats (dict): The agtree AST of the rule, as output by aglint.
+            keep_ast (bool, optional): Keep the AST in `_rule_ats`. Defaults to False.
+        """
 
-        self.raw_rule_text = self.rule_text = json.dumps(rule_ats["raws"]["text"])
+        self._rule_ats = rule_ats if keep_ast else None
 
-        if self.raw_rule_text[0] == '"' and self.raw_rule_text[-1] == '"':
-            self.raw_rule_text = self.raw_rule_text[1:-1]
+        self._text = rule_ats["raws"]["text"]
+        self._type = rule_ats["type"]
+        self._pattern = None
+
+        self._raw_rule_text = None
+        self._cosmetic_how = _UNSET
+        self._resource_type = _UNSET
+        self._activating_domains = None
 
         self.is_comment = rule_ats["category"] == "Comment"
         self.is_cosmetic_rule = rule_ats["category"] == "Cosmetic"
         self.is_network_rule = rule_ats["category"] == "Network"
-        self.is_js_rule = rule_ats["type"] in (
+        self.is_js_rule = self._type in (
             "JsInjectionRule",
             "ScriptletInjectionRule",
         )
-        self.is_html_rule = rule_ats["type"] == "HtmlRule"
+        self.is_html_rule = self._type == "HtmlRule"
         self.is_exception = rule_ats.get("exception", False)
 
-        # check cosmetic attributes
-        if self.is_cosmetic_rule and not self.is_js_rule and not self.is_html_rule:
-
-            self.is_extended_css = rule_ats["separator"]["value"] in (
-                "#?#",
-                "#@?#",
-                "#$?#",
-                "#@$?#",
-            )
-
-            if rule_ats["type"] == "ElementHidingRule":
-                self.cosmetic_how = "hide"
-
-            else:
-                # there might be css injection ways to hide elements
-                if any(
-                    token in self.raw_rule_text
-                    for token in [
-                        "visibility: hidden",
-                        "display: none",
-                        "display:none",
-                        "visibility:hidden",
-                    ]
-                ):
-                    self.cosmetic_how = "hide"
-
-                else:
-                    # check if removed
-                    if any(
-                        token in self.raw_rule_text
-                        for token in [
-                            "remove()",
-                            "remove: 1",
-                            "remove:1",
-                            "remove: true",
-                            "remove:true",
-                        ]
-                    ):
-                        self.cosmetic_how = "remove"
-
-                    else:
-                        self.cosmetic_how = "other"
-
-        # if it is an html rule it is cosmetically removing
-        if self.is_html_rule:
-            self.cosmetic_how = "remove"
+        self.is_extended_css = (
+            self.is_cosmetic_rule
+            and not self.is_js_rule
+            and not self.is_html_rule
+            and rule_ats["separator"]["value"] in self.EXTENDED_CSS_SEPARATORS
+        )
 
         self.options = {}
         if "modifiers" in rule_ats:
@@ -406,8 +440,9 @@ class AdblockRule(object):
                     self.options[modifier["modifier"]["value"]] = modifier_value
 
         # check network attributes
+        self.network_how = None
         if self.is_network_rule:
-            self.rule_text = json.dumps(rule_ats["pattern"]["value"])
+            self._pattern = rule_ats["pattern"]["value"]
 
             # check for how the network rule is blocking
             if any(key in self.ADVANCED_OPTIONS for key in self.options):
@@ -415,7 +450,38 @@ class AdblockRule(object):
             else:
                 self.network_how = "block"
 
-        self.resource_type = self.get_blocked_resource()
+    @property
+    def raw_rule_text(self) -> str:
+        """The rule text, JSON-escaped without the quotes"""
+
+        if self._raw_rule_text is None:
+            self._raw_rule_text = json.dumps(self._text)[1:-1]
+
+        return self._raw_rule_text
+
+    @property
+    def rule_text(self) -> str:
+        """The pattern of network rules, or the rule text otherwise, JSON-encoded"""
+
+        return json.dumps(self._pattern if self.is_network_rule else self._text)
+
+    @property
+    def cosmetic_how(self):
+        """How the cosmetic rule acts on elements: hide, remove or other. None for other rules"""
+
+        if self._cosmetic_how is _UNSET:
+            self._cosmetic_how = self._get_cosmetic_how()
+
+        return self._cosmetic_how
+
+    @property
+    def resource_type(self):
+        """Type of resource that the rule is blocking, see `get_blocked_resource`"""
+
+        if self._resource_type is _UNSET:
+            self._resource_type = self.get_blocked_resource()
+
+        return self._resource_type
 
     @property
     def is_generic_rule(self) -> bool:
@@ -424,8 +490,8 @@ class AdblockRule(object):
         return (
             (
                 (self.is_network_rule and not self.is_exception)
-                or (self.is_cosmetic_rule and (self.raw_rule_text.startswith("#")))
-                or (self.is_js_rule and self.raw_rule_text.startswith("#%#"))
+                or (self.is_cosmetic_rule and (self._text.startswith("#")))
+                or (self.is_js_rule and self._text.startswith("#%#"))
             )
             and "domain" not in self.options
             and "app" not in self.options
@@ -435,35 +501,15 @@ class AdblockRule(object):
     def activating_domains(self) -> List[str]:
         """Get the source domains where the rule would be checked in their contexts"""
 
-        domains = []
-
-        if self.is_cosmetic_rule:
-
-            try:
-                _domains, _ = self.raw_rule_text.split("#", 1)
-            except ValueError:
-                _domains = ""
-
-            separator = ","
-            if "|" in _domains:
-                separator = "|"
-
-            if len(_domains) > 0:
-                domains.extend(_domains.split(separator))
-
-        if self.is_network_rule:
-
-            _domains = self.options.get("domain", "")
-
-            separator = ","
-            if "|" in _domains:
-                separator = "|"
-
-            domains = _domains.split(separator)
-            # remove negatives
-            domains = [domain for domain in domains if not domain.startswith("~")]
+        if self._activating_domains is None:
+            self._activating_domains = get_activating_domains(
+                self.raw_rule_text,
+                self.is_cosmetic_rule,
+                self.is_network_rule,
+                self.options,
+            )
 
-        return domains
+        return self._activating_domains
 
     @property
     def is_third_party_rule(self):
@@ -485,6 +531,30 @@ class AdblockRule(object):
         """Always True. Aglint will throw an error otherwise."""
         return True
 
+    def _get_cosmetic_how(self):
+
+        # if it is an html rule it is cosmetically removing
+        if self.is_html_rule:
+            return "remove"
+
+        if not self.is_cosmetic_rule or self.is_js_rule:
+            return None
+
+        if self._type == "ElementHidingRule":
+            return "hide"
+
+        # there might be css injection ways to hide elements
+        text = self.raw_rule_text
+
+        if any(token in text for token in self.HIDE_TOKENS):
+            return "hide"
+
+        # check if removed
+        if any(token in text for token in self.REMOVE_TOKENS):
+            return "remove"
+
+        return "other"
+
     def get_blocked_resource(self):
         """
         Get the type of resource that the rule is blocking.
@@ -495,18 +565,18 @@ class AdblockRule(object):
         if not self.is_network_rule:
             return None
 
-        if "script" in self.options or self.JS_PATTERN.search(self.rule_text):
+        rule_text = self.rule_text
+
+        if "script" in self.options or self.JS_PATTERN.search(rule_text):
             return "script"
 
-        if "image" in self.options or self.IMG_PATTERN.search(self.rule_text):
+        if "image" in self.options or self.IMG_PATTERN.search(rule_text):
             return "image"
 
-        if "stylesheet" in self.options or self.STYLESHEET_PATTERN.search(
-            self.rule_text
-        ):
+        if "stylesheet" in self.options or self.STYLESHEET_PATTERN.search(rule_text):
             return "stylesheet"
 
-        if "document" in self.options or self.DOCUMENT_PATTERN.search(self.rule_text):
+        if "document" in self.options or self.DOCUMENT_PATTERN.search(rule_text):
             return "document"
 
         return None
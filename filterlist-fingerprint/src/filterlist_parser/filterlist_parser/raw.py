@@ -1,15 +1,28 @@
 """Functions for downloading and parsing adguard's filterlists"""
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from email.utils import formatdate
+import os
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from filterlist_parser.utils import slug
 import tqdm
 import yaml
 
+REQ_TIMEOUT_S = 20
+CHUNK_SIZE = 1 << 16
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+READ_BUFFER_SIZE = 1 << 20
+COMMENT_PREFIXES = ("!", "# ", "[Adblock")
+COMMENT_PREFIXES_BYTES = tuple(prefix.encode() for prefix in COMMENT_PREFIXES)
+
 
 def get_adguard_lists() -> list[dict]:
     """
@@ -50,43 +63,216 @@ def get_adguard_lists() -> list[dict]:
     return filters
 
 
-def download_list(url: str, out: Path) -> None:
+def make_session(max_workers: int = 16, retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
     """
-    Download a filterlist to a file
+    Create a pooled session that retries failed requests with an exponential backoff
+
+    Args:
+        max_workers: number of connections kept alive per host
+        retries: number of retries on connection errors and 429/5xx responses
+        backoff_factor: backoff factor between retries (0.5 -> 0.5s, 1s, 2s, ...)
+
+    Returns:
+        session: the configured session
+    """
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET", "HEAD"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def read_list_header(fp: Path) -> dict:
+    """
+    Read the `! CONFIG` header written by `download_list` at the top of a filterlist file
+
+    Args:
+        fp: path to the downloaded filterlist
+
+    Returns:
+        header: dictionary of the header keys (url, timestamp, etag, last-modified)
+    """
+
+    header = {}
+
+    with open(fp, encoding="utf-8", errors="replace") as f:
+        if f.readline().strip() != "! CONFIG":
+            return header
+
+        for line in f:
+            if not line.startswith("! ") or " = " not in line:
+                break
+
+            key, value = line[2:].split(" = ", 1)
+            header[key] = value.strip()
+
+    return header
+
+
+def download_list(
+    url: str,
+    out: Path,
+    session: Optional[requests.Session] = None,
+    conditional: bool = True,
+    timeout: float = REQ_TIMEOUT_S,
+) -> bool:
+    """
+    Download a filterlist to a file. The body is streamed to disk and the file is
+    replaced atomically once complete. If the file exists and `conditional` is set,
+    the stored ETag / Last-Modified validators are sent and the file is kept untouched
+    when the server answers 304 Not Modified.
 
     Args:
         url: url of the filterlist
         out: path to the output file
+        session: session to use for the request. A new one is created if None
+        conditional: send a conditional request if the file exists
+        timeout: connect/read timeout in seconds
+
+    Returns:
+        modified: False if the server reported that the list did not change
     """
 
-    resp = requests.get(url)
-    resp.raise_for_status()
+    session = session or make_session(max_workers=1)
+
+    headers = {}
+
+    if conditional and out.exists():
+        header = read_list_header(out)
+
+        if "etag" in header:
+            headers["If-None-Match"] = header["etag"]
+
+        headers["If-Modified-Since"] = header.get(
+            "last-modified", formatdate(out.stat().st_mtime, usegmt=True)
+        )
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+
+        if resp.status_code == 304:
+            return False
+
+        resp.raise_for_status()
+
+        tmp = out.with_name(out.name + ".part")
 
-    with open(out, "w") as f:
-        f.write("! CONFIG\n")
-        f.write("! url = " + url + "\n")
-        f.write("! timestamp = " + datetime.now().isoformat() + "\n")
-        f.write("\n")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(b"! CONFIG\n")
+                f.write(f"! url = {url}\n".encode())
+                f.write(f"! timestamp = {datetime.now().isoformat()}\n".encode())
 
-        f.write(resp.text)
+                for key in ("ETag", "Last-Modified"):
+                    if key in resp.headers:
+                        f.write(f"! {key.lower()} = {resp.headers[key]}\n".encode())
 
+                f.write(b"\n")
 
-def download_lists(filterlists: list[dict], out_dir: Path) -> None:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+
+            os.replace(tmp, out)
+
+        finally:
+            # only left behind if the transfer was interrupted
+            tmp.unlink(missing_ok=True)
+
+    return True
+
+
+def download_lists(
+    filterlists: list[dict],
+    out_dir: Path,
+    max_workers: int = 16,
+    refresh: bool = True,
+    retries: int = 3,
+    timeout: float = REQ_TIMEOUT_S,
+) -> dict:
     """
-    Download a list of filterlists to a directory
+    Download a list of filterlists to a directory, concurrently
 
     Args:
         filterlists: list of filterlists with name and url
         out_dir: directory to save the filterlists
+        max_workers: number of concurrent downloads
+        refresh: re-check existing lists with a conditional request. If False, existing lists are skipped
+        retries: number of retries per list on connection errors and 429/5xx responses
+        timeout: connect/read timeout in seconds
+
+    Returns:
+        statuses: {name: "downloaded" | "not-modified" | "skipped" | "failed"}
     """
 
-    for filterlist in tqdm.tqdm(filterlists):
+    statuses = {}
+    session = make_session(max_workers=max_workers, retries=retries)
+
+    def _download(filterlist: dict) -> str:
         out = out_dir / f"{slug(filterlist["name"])}.txt"
 
-        if out.exists():
-            continue
+        if out.exists() and not refresh:
+            return "skipped"
+
+        try:
+            modified = download_list(
+                filterlist["url"], out, session=session, timeout=timeout
+            )
+        except requests.RequestException as e:
+            tqdm.tqdm.write(f"Error downloading {filterlist["name"]}: {e}")
+            return "failed"
+
+        return "downloaded" if modified else "not-modified"
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_download, fl): fl["name"] for fl in filterlists}
+
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            statuses[futures[future]] = future.result()
+
+    return statuses
+
+
+def iter_rule_lines(fp: Path, as_bytes: bool = False) -> Iterator[str | bytes]:
+    """
+    Stream the rule lines of a filterlist file, skipping comments and empty lines.
+    The file is read through a large buffer and each line goes through a single
+    prefix check.
+
+    Args:
+        fp: path to the filterlist file
+        as_bytes: yield raw bytes lines instead of decoded strings
+
+    Returns:
+        out: iterator of the rule lines (with their line ending)
+    """
 
-        download_list(filterlist["url"], out)
+    if as_bytes:
+        f = open(fp, "rb", buffering=READ_BUFFER_SIZE)
+        comment_prefixes = COMMENT_PREFIXES_BYTES
+        line_ending = b"\r\n"
+    else:
+        f = open(fp, encoding="utf-8", buffering=READ_BUFFER_SIZE)
+        comment_prefixes = COMMENT_PREFIXES
+        line_ending = "\r\n"
+
+    with f:
+        for line in f:
+            # empty lines (just a line ending, \n or \r\n) and comments
+            if not line.rstrip(line_ending) or line.startswith(comment_prefixes):
+                continue
+
+            yield line
 
 
 def load_rules_str(name: str, filterlist_dir: Path) -> str:
@@ -101,43 +287,51 @@ def load_rules_str(name: str, filterlist_dir: Path) -> str:
         out: string of the rules
     """
 
-    out = ""
+    return "".join(load_rules_iter(name, filterlist_dir))
 
-    for line in load_rules_iter(name, filterlist_dir):
-        out += line
 
-    return out
-
-
-def load_rules_iter(name: str, filterlist_dir: Path) -> Iterable[str]:
+def load_rules_iter(
+    name: str, filterlist_dir: Path, as_bytes: bool = False
+) -> Iterator[str | bytes]:
     """
     Load the rules from a filterlist file as an iterator
 
     Args:
         name: name of the filterlist
         filterlist_dir: directory of the filterlists
+        as_bytes: yield raw bytes lines instead of decoded strings
 
     Returns:
         out: iterator of the rules
     """
 
-    with open(filterlist_dir / (slug(name) + ".txt")) as f:
-        while True:
+    return iter_rule_lines(filterlist_dir / (slug(name) + ".txt"), as_bytes=as_bytes)
 
-            line = f.readline()
-            if not line:
-                break
 
-            # if a comment
-            if (
-                line.startswith("!")
-                or line.startswith("# ")
-                or line.startswith("[Adblock")
-            ):
-                continue
+def load_many_rules(
+    names: Iterable[str],
+    filterlist_dir: Path,
+    max_workers: int = 8,
+    as_bytes: bool = False,
+) -> dict[str, list[str | bytes]]:
+    """
+    Load the rules of many filterlists concurrently
 
-            # if an empty / line
-            if len(line) < 2:
-                continue
+    Args:
+        names: names of the filterlists
+        filterlist_dir: directory of the filterlists
+        max_workers: number of lists read at the same time
+        as_bytes: load raw bytes lines instead of decoded strings
 
-            yield line
+    Returns:
+        out: {name: list of rules}
+    """
+
+    names = list(names)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rules = executor.map(
+            lambda name: list(load_rules_iter(name, filterlist_dir, as_bytes)), names
+        )
+
+        return dict(zip(names, rules))
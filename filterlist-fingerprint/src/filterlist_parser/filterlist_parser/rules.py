@@ -1,13 +1,18 @@
 """Module for parsing and analyzing filter rules"""
 
 import json
-from typing import Dict, Iterable, List, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
 
 import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
 
-from filterlist_parser.aglintparser import AdblockRule, AGLintBinding
+from filterlist_parser.aglintparser import (
+    AdblockRule,
+    AGLintBinding,
+    get_activating_domains,
+)
 
 
 def _make_rule_row(rule: AdblockRule) -> dict:
@@ -28,6 +33,7 @@ def _make_rule_row(rule: AdblockRule) -> dict:
             "network_how": None,
             "resource": None,
             "rule_regex": None,
+            "activating_domains": None,
         }
 
     return {
@@ -44,99 +50,318 @@ def _make_rule_row(rule: AdblockRule) -> dict:
         "network_how": rule.network_how,
         "resource": rule.resource_type,
         "rule_regex": rule.regex,
+        "activating_domains": json.dumps(rule.activating_domains),
     }
 
 
+# columns of the parsed rules, in the order they are written
+RULE_COLUMNS = [
+    "rule",
+    "cosmetic",
+    "network",
+    "html",
+    "script",
+    "exception",
+    "extended_css",
+    "generic",
+    "options",
+    "cosmetic_how",
+    "network_how",
+    "resource",
+    "rule_regex",
+    "activating_domains",
+    "well_formed",
+    "parsing_error",
+]
+
+# columns of the rules parsed from a filterlist file, all well-formed
+FILTERLIST_COLUMNS = [
+    column for column in RULE_COLUMNS if column not in ("well_formed", "parsing_error")
+]
+
+# Parquet types of the columns, the options and domains are JSON strings
+RULE_COLUMN_TYPES = {
+    "rule": "string",
+    "cosmetic": "bool",
+    "network": "bool",
+    "html": "bool",
+    "script": "bool",
+    "exception": "bool",
+    "extended_css": "bool",
+    "generic": "bool",
+    "options": "string",
+    "cosmetic_how": "string",
+    "network_how": "string",
+    "resource": "string",
+    "rule_regex": "string",
+    "activating_domains": "string",
+    "well_formed": "bool",
+    "parsing_error": "bool",
+}
+
+
+def iter_parsed_rules(
+    rules: Iterable[str], parse_by_rule=False, parallel=False, chunk_size=1000
+) -> Iterator[Optional[AdblockRule]]:
+    """
+    Stream the parsed rules of a list of rules
+
+    Args:
+        rules (Iterable[str]): Rules, can be a stream
+        parse_by_rule (bool, optional): If false, pass batches of rules to the AGLint parser. Defaults to False.
+        parallel (bool, optional): Parallelize the parsing, one chunk of rules at a time. Defaults to False.
+        chunk_size (int, optional): Number of rules parsed in parallel at once. Defaults to 1000.
+
+    Returns:
+        Iterator[Optional[AdblockRule]]: The parsed rules, None for parsing errors
+    """
+
+    total = len(rules) if hasattr(rules, "__len__") else None
+
+    if not parse_by_rule:
+        yield from tqdm(AGLintBinding.parse_filter_rules(rules), total=total)
+        return
+
+    def _parse_rule(rule):
+        try:
+            return AGLintBinding.parse_filter_rule(rule)
+        except AGLintBinding.ParsingError:
+            return None
+
+    if not parallel:
+        for rule in tqdm(rules, total=total):
+            yield _parse_rule(rule)
+        return
+
+    from joblib import Parallel, delayed
+
+    rules = iter(rules)
+
+    with tqdm(total=total) as pbar, Parallel(n_jobs=-1) as parallel_pool:
+        while chunk := list(islice(rules, chunk_size)):
+            yield from parallel_pool(delayed(_parse_rule)(rule) for rule in chunk)
+            pbar.update(len(chunk))
+
+
+def iter_rule_rows(rules: Iterable[str], **kwargs) -> Iterator[dict]:
+    """
+    Stream the metadata of each rule in a list of rules
+
+    Args:
+        rules (Iterable[str]): Rules, can be a stream
+        **kwargs: Arguments of `iter_parsed_rules`
+
+    Returns:
+        Iterator[dict]: One row of metadata per rule
+    """
+
+    for rule in iter_parsed_rules(rules, **kwargs):
+
+        # only if parsing error happened
+        if rule is None:
+            yield {
+                "rule": None,
+                "cosmetic": False,
+                "network": False,
+                "html": False,
+                "script": False,
+                "exception": False,
+                "extended_css": False,
+                "generic": False,
+                "options": None,
+                "cosmetic_how": None,
+                "network_how": None,
+                "resource": None,
+                "parsing_error": True,
+                "rule_regex": None,
+                "activating_domains": None,
+            }
+            continue
+
+        yield _make_rule_row(rule) | {
+            "well_formed": rule.is_well_formed,
+            "parsing_error": False,
+        }
+
+
+def iter_rule_frames(
+    rules: Iterable[str], chunk_size=10_000, **kwargs
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the metadata of a list of rules as dataframes of `chunk_size` rows,
+    with the `RULE_COLUMNS` columns
+
+    Args:
+        rules (Iterable[str]): Rules, can be a stream
+        chunk_size (int, optional): Number of rows per dataframe. Defaults to 10_000.
+        **kwargs: Arguments of `iter_parsed_rules`
+
+    Returns:
+        Iterator[pd.DataFrame]: Dataframes with metadata for each rule
+    """
+
+    rows = iter_rule_rows(rules, **kwargs)
+
+    while chunk := list(islice(rows, chunk_size)):
+        yield pd.DataFrame(chunk, columns=RULE_COLUMNS)
+
+
+def _rule_frame_schema(table, pa):
+    """
+    Parquet schema of dataframes of parsed rules: the rule features (also with a
+    _prev or _new suffix, as in the parsed changes) get their `RULE_COLUMN_TYPES`
+    type, the other columns the type found in the first chunk, strings if unknown
+    """
+
+    types = {"bool": pa.bool_(), "string": pa.string()}
+    fields = []
+
+    for field in table.schema:
+        name = field.name
+        for suffix in ("_prev", "_new"):
+            if name.endswith(suffix) and name[: -len(suffix)] in RULE_COLUMN_TYPES:
+                name = name[: -len(suffix)]
+
+        if name in RULE_COLUMN_TYPES:
+            fields.append(field.with_type(types[RULE_COLUMN_TYPES[name]]))
+        elif pa.types.is_null(field.type):
+            fields.append(field.with_type(pa.string()))
+        else:
+            fields.append(field)
+
+    return pa.schema(fields)
+
+
+def write_rule_frames(
+    frames: Iterable[pd.DataFrame], fp: Path, columns: Optional[List[str]] = None
+) -> int:
+    """
+    Write dataframes to a CSV file, or a Parquet file (needs pyarrow), as they come.
+    Empty dataframes are skipped. If none has rows, the file only has the columns.
+
+    Args:
+        frames (Iterable[pd.DataFrame]): Dataframes with the same columns
+        fp (Path): Output file, Parquet if it ends with .parquet
+        columns (List[str], optional): Columns of the file when no dataframe has
+            rows. Defaults to those of the first dataframe, or `RULE_COLUMNS`.
+
+    Returns:
+        int: Number of rows written
+    """
+
+    fp = Path(fp)
+    n_rows = 0
+
+    def _header(frame):
+        nonlocal columns
+        if columns is None:
+            columns = list(frame.columns)
+
+    if fp.suffix == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet files requires pyarrow") from e
+
+        writer = None
+
+        try:
+            for frame in frames:
+                _header(frame)
+                if frame.empty:
+                    continue
+
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+
+                if writer is None:
+                    schema = _rule_frame_schema(table, pa)
+                    writer = pq.ParquetWriter(fp, schema)
+
+                writer.write_table(table.cast(schema))
+                n_rows += len(frame)
+
+            if writer is None:
+                empty = pa.Table.from_pandas(
+                    pd.DataFrame(columns=columns or RULE_COLUMNS), preserve_index=False
+                )
+                pq.write_table(_rule_frame_schema(empty, pa).empty_table(), fp)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return n_rows
+
+    header_written = False
+
+    with open(fp, "w", newline="") as f:
+        for frame in frames:
+            _header(frame)
+            if frame.empty:
+                continue
+
+            frame.to_csv(f, index=False, header=not header_written)
+            header_written = True
+            n_rows += len(frame)
+
+        if not header_written:
+            pd.DataFrame(columns=columns or RULE_COLUMNS).to_csv(f, index=False)
+
+    return n_rows
+
+
 def parse_rules(
     rules: Iterable[str], parse_by_rule=False, parallel=False
 ) -> pd.DataFrame:
     """
-    Creates a dataframe with metadata for each rule in a list of rules
+    Creates a dataframe with metadata for each rule in a list of rules. See
+    `iter_rule_frames` and `write_rule_frames` to parse long lists in bounded memory.
 
     Args:
         rules (Iterable[str]): List of rules
-        parse_by_rule (bool, optional): If false, pass all rules to the AGLint parser at once. Defaults to False.
+        parse_by_rule (bool, optional): If false, pass batches of rules to the AGLint parser. Defaults to False.
         parallel (bool, optional): Parallelize the parsing. Defaults to False.
 
     Returns:
         pd.DataFrame: DataFrame with metadata for each rule
     """
 
-    # could throw an error if the list is long
+    return pd.DataFrame(
+        list(iter_rule_rows(rules, parse_by_rule=parse_by_rule, parallel=parallel))
+    )
 
-    rules_metadata = []
 
-    def _parse_by_rule_iterator(rules):
+def iter_filterlist_frames(
+    filterlist_fp: Path, chunk_size=10_000
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the metadata of the well-formed rules of a filterlist file as
+    dataframes of `chunk_size` rows, with the `FILTERLIST_COLUMNS` columns
 
-        def _parse_rule(rule):
-            try:
-                return AGLintBinding.parse_filter_rule(rule)
-            except AGLintBinding.ParsingError:
-                return None
+    Args:
+        filterlist_fp (Path): Path to the filterlist file
+        chunk_size (int, optional): Number of rows per dataframe. Defaults to 10_000.
 
-        if not parallel:
-            for rule in tqdm(rules):
-                yield _parse_rule(rule)
+    Returns:
+        Iterator[pd.DataFrame]: Dataframes with metadata for each rule
+    """
 
-        else:
-            from joblib import Parallel, delayed
-
-            rules = list(rules)
-            results = Parallel(n_jobs=-1)(
-                delayed(_parse_rule)(rule) for rule in tqdm(rules)
-            )
-
-            for rule, result in zip(rules, results):
-                if result is None:
-                    yield None
-                else:
-                    yield result
-
-    iterator = (
-        _parse_by_rule_iterator
-        if parse_by_rule
-        else lambda rules: tqdm(
-            AGLintBinding.parse_filter_rules(rules), total=len(rules)
-        )
+    rows = (
+        _make_rule_row(rule)
+        for rule in AGLintBinding.parse_filter_list(Path(filterlist_fp))
+        if rule.is_well_formed
     )
 
-    for rule in iterator(rules):
-
-        # only if parsing error happened
-        if rule is None:
-            rules_metadata.append(
-                {
-                    "rule": None,
-                    "cosmetic": False,
-                    "network": False,
-                    "html": False,
-                    "script": False,
-                    "exception": False,
-                    "extended_css": False,
-                    "generic": False,
-                    "options": None,
-                    "cosmetic_how": None,
-                    "network_how": None,
-                    "resource": None,
-                    "parsing_error": True,
-                    "rule_regex": None,
-                }
-            )
-            continue
-
-        rules_metadata.append(
-            _make_rule_row(rule)
-            | {"well_formed": rule.is_well_formed, "parsing_error": False}
-        )
-
-    return pd.DataFrame(rules_metadata)
+    while chunk := list(islice(rows, chunk_size)):
+        yield pd.DataFrame(chunk, columns=FILTERLIST_COLUMNS)
 
 
 def parse_rules_from_filterlist_fp(
     filterlist_fp: Path,
 ) -> pd.DataFrame:
     """
-    Parse rules from a filterlist file path
+    Parse rules from a filterlist file path. See `iter_filterlist_frames` and
+    `write_rule_frames` to parse long lists in bounded memory.
 
     Args:
         filterlist_fp (Path): Path to the filterlist file
@@ -145,16 +370,54 @@ def parse_rules_from_filterlist_fp(
         pd.DataFrame: DataFrame with metadata for each rule
     """
 
-    rules_metadata = []
+    frames = list(iter_filterlist_frames(filterlist_fp))
 
-    for rule in AGLintBinding.parse_filter_list(filterlist_fp):
+    if not frames:
+        return pd.DataFrame(columns=FILTERLIST_COLUMNS)
 
-        if not rule.is_well_formed:
-            continue
+    return pd.concat(frames, ignore_index=True)
 
-        rules_metadata.append(_make_rule_row(rule))
 
-    return pd.DataFrame(rules_metadata)
+def explode_activating_domains(rules: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per (rule, activating domain) of parsed rules. The domains stored at
+    parsing time are used, or derived from the stored rule and options for lists
+    parsed before they were.
+
+    Args:
+        rules (pd.DataFrame): Parsed rules, as returned by `parse_rules_from_filterlist_fp`
+
+    Returns:
+        pd.DataFrame: The rules, with an `activating_domain` column, indexed like `rules`
+    """
+
+    if "activating_domains" in rules.columns:
+        domains = rules["activating_domains"].map(
+            lambda d: json.loads(d) if isinstance(d, str) else []
+        )
+
+    else:
+        domains = pd.Series(
+            [
+                get_activating_domains(
+                    json.loads(f'"{rule}"').strip("\r"),
+                    cosmetic,
+                    network,
+                    json.loads(options) if isinstance(options, str) else {},
+                )
+                for rule, cosmetic, network, options in zip(
+                    rules["rule"], rules["cosmetic"], rules["network"], rules["options"]
+                )
+            ],
+            index=rules.index,
+            dtype=object,
+        )
+
+    return (
+        rules.assign(activating_domain=domains)
+        .explode("activating_domain")
+        .dropna(subset=["activating_domain"])
+    )
 
 
 def _rules_mask_for_pattern(rules: pd.DataFrame, pattern):
@@ -103,13 +103,51 @@ def prepare_rules(user_rules: pd.DataFrame, n_rules):
 
 # FILTERLIST MATRIX OPERATIONS
 
-def viable_candidates_positive(
-    filterlists_matrix, rule_index, available_candidates=None
-):
 
-    certain_rules = np.sum(
-        filterlists_matrix * filterlists_matrix[:, [rule_index]], axis=0
-    ) == np.sum(filterlists_matrix[:, [rule_index]])
+def filterlist_rule_masks(filterlists_matrix: np.ndarray) -> np.ndarray:
+    """Pack the lists of each rule into a bitmask of 64-bit words
+
+    Args:
+        filterlists_matrix (np.ndarray): (lists x rules) boolean matrix
+
+    Returns:
+        np.ndarray: (rules x words) uint64 matrix, one word per 64 lists
+    """
+
+    n_lists, n_rules = filterlists_matrix.shape
+    n_words = max((n_lists + 63) // 64, 1)
+
+    masks = np.zeros((n_rules, n_words * 8), dtype=np.uint8)
+    masks[:, : (n_lists + 7) // 8] = np.packbits(filterlists_matrix.T, axis=1)
+
+    return masks.view(np.uint64)
+
+
+def _rule_masks(filterlists_matrix):
+    """Accept a boolean (lists x rules) matrix as well as its packed rule masks"""
+
+    if filterlists_matrix.dtype == bool:
+        return filterlist_rule_masks(filterlists_matrix)
+
+    return filterlists_matrix
+
+
+def viable_candidates_positive(rule_masks, rule_index, available_candidates=None):
+    """Rules that are not in every list that has the rule `rule_index`
+
+    Args:
+        rule_masks (np.ndarray): Rule masks from `filterlist_rule_masks`
+        rule_index (int): The rule found in the user's lists
+        available_candidates (np.ndarray, optional): Mask of the candidate rules
+
+    Returns:
+        np.ndarray: Mask of the rules that can still tell users apart
+    """
+
+    rule_masks = _rule_masks(rule_masks)
+
+    # rules in all the lists of the rule are certain to be there too
+    certain_rules = ~np.any(rule_masks[rule_index] & ~rule_masks, axis=1)
 
     if available_candidates is None:
         return ~certain_rules
@@ -122,13 +160,21 @@ def viable_candidates_positive(
     )
 
 
-def viable_candidates_negative(
-    filterlists_matrix, rule_index, available_candidates=None
-):
+def viable_candidates_negative(rule_masks, rule_index, available_candidates=None):
+    """Rules that are in at least one list without the rule `rule_index`
 
-    target_rules = (
-        np.sum(filterlists_matrix * ~filterlists_matrix[:, [rule_index]], axis=0) > 0
-    )
+    Args:
+        rule_masks (np.ndarray): Rule masks from `filterlist_rule_masks`
+        rule_index (int): The rule missing from the user's lists
+        available_candidates (np.ndarray, optional): Mask of the candidate rules
+
+    Returns:
+        np.ndarray: Mask of the rules that can still tell users apart
+    """
+
+    rule_masks = _rule_masks(rule_masks)
+
+    target_rules = np.any(rule_masks & ~rule_masks[rule_index], axis=1)
 
     if available_candidates is None:
         return target_rules
@@ -0,0 +1,123 @@
+"""
+Greedy maximum coverage of lists by controlled domains.
+
+Each domain covers the lists in which it activates rules. The coverage of each
+domain is a packed bitset row over the lists, and domains are picked with a lazy
+greedy (CELF): marginal gains only shrink as lists get covered, so a stale gain is
+an upper bound and only the top of the priority queue has to be re-evaluated.
+"""
+
+import heapq
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# number of set bits of each byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+class GreedyMaxCoverage:
+    """Lazy greedy maximum coverage over a (domains x lists) boolean matrix"""
+
+    def __init__(
+        self,
+        covers: np.ndarray,
+        weights: Optional[np.ndarray] = None,
+        costs: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            covers: (domains x lists) boolean matrix, True if the domain covers the list
+            weights: weight of each list. Each list counts as 1 if None
+            costs: cost of each domain. Each domain costs 1 if None
+        """
+
+        covers = np.asarray(covers, dtype=bool)
+
+        self.n_domains, self.n_lists = covers.shape
+        self.bitsets = np.packbits(covers, axis=1)
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.costs = None if costs is None else np.asarray(costs, dtype=float)
+
+    def _gains(self, rows, uncovered: np.ndarray) -> np.ndarray:
+        """Marginal gains of the rows, given the packed bitset of the uncovered lists"""
+
+        new = self.bitsets[rows] & uncovered
+
+        if self.weights is None:
+            return _POPCOUNT[new].sum(axis=-1)
+
+        new = np.unpackbits(new, axis=-1, count=self.n_lists).astype(bool)
+        return new @ self.weights
+
+    def run(
+        self,
+        covered: Optional[np.ndarray] = None,
+        max_domains: Optional[int] = None,
+        budget: Optional[float] = None,
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Pick domains until no domain adds coverage, or a limit is reached
+
+        Args:
+            covered: boolean mask of the lists covered from the start
+            max_domains: maximum number of picked domains
+            budget: maximum total cost of the picked domains. Domains are then
+                ranked by gain per cost
+
+        Returns:
+            picks: list of (domain row, indices of the newly covered lists), in pick order
+        """
+
+        covered = (
+            np.zeros(self.n_lists, dtype=bool)
+            if covered is None
+            else np.asarray(covered, dtype=bool).copy()
+        )
+        uncovered = np.packbits(~covered)
+
+        costs = np.ones(self.n_domains) if self.costs is None else self.costs
+
+        def _priority(gain, row):
+            return gain / costs[row] if budget is not None else gain
+
+        # (-priority, row, iteration at which the priority was computed)
+        gains = self._gains(slice(None), uncovered)
+        heap = [
+            (-_priority(gain, row), row, 0)
+            for row, gain in enumerate(gains.tolist())
+            if gain > 0
+        ]
+        heapq.heapify(heap)
+
+        picks = []
+        spent = 0.0
+
+        while heap and (max_domains is None or len(picks) < max_domains):
+
+            priority, row, iteration = heapq.heappop(heap)
+
+            if budget is not None and spent + costs[row] > budget:
+                # too expensive for the remaining budget, cheaper domains may still fit
+                continue
+
+            if iteration != len(picks):
+                # stale upper bound, re-evaluate and push back
+                gain = self._gains(row, uncovered)
+
+                if gain > 0:
+                    heapq.heappush(heap, (-_priority(gain, row), row, len(picks)))
+
+                continue
+
+            new = np.flatnonzero(
+                np.unpackbits(self.bitsets[row] & uncovered, count=self.n_lists)
+            )
+
+            covered[new] = True
+            uncovered = np.packbits(~covered)
+            spent += costs[row]
+
+            picks.append((row, new))
+
+        return picks
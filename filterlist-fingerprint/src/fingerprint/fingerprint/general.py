@@ -1,7 +1,6 @@
 #!/usr/bin/python
 
 from collections import Counter
-from functools import reduce
 from tqdm import tqdm
 import pandas as pd
 
@@ -50,17 +49,18 @@ class GeneralFingerprinting:
                     if len(e_class) == 1:
                         continue
 
+                    # occurences of all the items of the class in one pass
                     items = set()
+                    occurences = Counter()
                     for user in e_class:
                         items |= self.users_attrs[user]
+                        occurences.update(self.users_attrs[user])
 
                     for item in items:
                         if item in sig_set:
                             continue
 
-                        occurence = reduce(
-                            lambda x, y: x + (item in self.users_attrs[y]), e_class, 0
-                        )
+                        occurence = occurences[item]
 
                         sep_metric[item] += occurence * (len(e_class) - occurence)
 
@@ -73,10 +73,10 @@ class GeneralFingerprinting:
                     break
 
                 new_classes = []
+                user_set = self.attrs_users[best_item]
 
                 # Division into subpartitions
                 for e_class in e_classes:
-                    user_set = set(self.attrs_users[best_item])
 
                     new_set1 = e_class - user_set
                     new_set2 = e_class - new_set1
@@ -109,3 +109,72 @@ def general_fingerprinting(
     fingerprinter = GeneralFingerprinting(k, users, attrs)
 
     return fingerprinter.greedy_group_fingerprinting(), listname_from_index
+
+
+class IterativeGeneralFingerprinting:
+    """
+    General fingerprinting over successive removals of lists, e.g. when a defender
+    neutralizes the lists of the previous fingerprints. The user/list index is
+    prepared once and the removed lists are dropped from it in place.
+    """
+
+    def __init__(self, user_subscriptions: pd.DataFrame, col="identifiable_lists"):
+        """
+        Args:
+            user_subscriptions (pd.DataFrame): A dataframe with the user subscriptions
+            col (str, optional): The user subscriptions column. Defaults to "identifiable_lists".
+        """
+
+        users, attrs, listname_from_index = prepare(user_subscriptions, col=col)
+
+        self.users_attrs = {user: set(user_attrs) for user, user_attrs in users.items()}
+        self.attrs_users = attrs
+        self.listname_from_index = listname_from_index
+        self.index_from_listname = {v: k for k, v in listname_from_index.items()}
+        self.removed_lists = set()
+
+    @property
+    def n_users(self) -> int:
+        return len(self.users_attrs)
+
+    def remove_lists(self, list_names) -> None:
+        """Remove lists from the subscriptions of every user"""
+
+        for list_name in list_names:
+            self.removed_lists.add(list_name)
+
+            index = self.index_from_listname.get(list_name)
+            if index is None or index not in self.attrs_users:
+                continue
+
+            for user in self.attrs_users.pop(index):
+                self.users_attrs[user].discard(index)
+
+    def fingerprint(self, k) -> tuple:
+        """
+        Run the general fingerprinting on the remaining lists
+
+        Args:
+            k (int): Maximum size of the signature
+
+        Returns (tuple): Like `general_fingerprinting`, the (signature, equivalence
+            classes, best metric) and the mapping from signature items to list names
+        """
+
+        # the remaining lists are renumbered contiguously, in their original order
+        remaining = sorted(self.attrs_users)
+        renumber = {index: i for i, index in enumerate(remaining)}
+
+        users = {
+            user: [renumber[index] for index in user_attrs]
+            for user, user_attrs in self.users_attrs.items()
+        }
+        attrs = {renumber[index]: self.attrs_users[index] for index in remaining}
+        listname_from_index = {
+            renumber[index]: self.listname_from_index[index] for index in remaining
+        }
+
+        fingerprinter = GeneralFingerprinting(k, users, attrs)
+
+        return fingerprinter.greedy_group_fingerprinting(), listname_from_index
+
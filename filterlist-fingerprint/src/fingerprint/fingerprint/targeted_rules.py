@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 
 from fingerprint.common import (
+    filterlist_rule_masks,
     prepare_rules,
     viable_candidates_negative,
     viable_candidates_positive,
@@ -27,17 +28,20 @@ N_CPU = int(os.getenv("N_CPU", 4))
 def prepare_readonly_filterlist_data(
     filterlist_rules: np.ndarray, smm: Optional[SharedMemoryManager] = None
 ):
+    """Pack the (lists x rules) matrix into per-rule list bitmasks, shared read-only"""
+
+    rule_masks = filterlist_rule_masks(filterlist_rules)
 
     if smm:
-        _filterlist_rules_buff = smm.SharedMemory(filterlist_rules.nbytes)
-        filterlist_rules_shared = np.ndarray(
-            filterlist_rules.shape, dtype=bool, buffer=_filterlist_rules_buff.buf
+        _rule_masks_buff = smm.SharedMemory(rule_masks.nbytes)
+        rule_masks_shared = np.ndarray(
+            rule_masks.shape, dtype=np.uint64, buffer=_rule_masks_buff.buf
         )
-        filterlist_rules_shared[:] = filterlist_rules
+        rule_masks_shared[:] = rule_masks
 
-        return [(_filterlist_rules_buff, filterlist_rules.shape)]
+        return [(_rule_masks_buff, rule_masks.shape)]
 
-    return filterlist_rules
+    return rule_masks
 
 
 def prepare_readonly_user_data(
@@ -192,7 +196,7 @@ def _greedy_individual_fingerprint_filterlist_aware(shared_data, uid):
         (_user_attrs_buff, user_attrs_shape),
         (_attr_users_buff, attr_users_shape),
         (_non_empty_attrs_buff, non_empty_attrs_shape),
-        (_filterlist_rules_buff, filterlist_rules_shape),
+        (_rule_masks_buff, rule_masks_shape),
     ) = shared_data
 
     user_attrs = np.ndarray(user_attrs_shape, dtype=bool, buffer=_user_attrs_buff.buf)
@@ -200,8 +204,8 @@ def _greedy_individual_fingerprint_filterlist_aware(shared_data, uid):
     non_empty_attrs = np.ndarray(
         non_empty_attrs_shape, dtype=bool, buffer=_non_empty_attrs_buff.buf
     )
-    filterlist_rules = np.ndarray(
-        filterlist_rules_shape, dtype=bool, buffer=_filterlist_rules_buff.buf
+    rule_masks = np.ndarray(
+        rule_masks_shape, dtype=np.uint64, buffer=_rule_masks_buff.buf
     )
 
     # """
@@ -258,13 +262,13 @@ def _greedy_individual_fingerprint_filterlist_aware(shared_data, uid):
             if user_attrs[uid, min_a]:
                 mask[min_a] = 1
                 non_empty_attrs = viable_candidates_positive(
-                    filterlist_rules, min_a, non_empty_attrs
+                    rule_masks, min_a, non_empty_attrs
                 ).reshape(-1, 1)
 
             else:
                 mask[min_a] = -1
                 non_empty_attrs = viable_candidates_negative(
-                    filterlist_rules, min_a, non_empty_attrs
+                    rule_masks, min_a, non_empty_attrs
                 ).reshape(-1, 1)
 
             with timer("update_anon_set"):
@@ -4,6 +4,7 @@ import os
 from typing import Optional, override
 from pathlib import Path
 from gh_scraper.extract.common import OS_PREFIXES, BaseExtractor
+from gh_scraper.github import GitHubClient
 import pandas as pd
 
 # Bot issues are considered unique
@@ -138,6 +139,7 @@ def scrape_confs(
     pages_limit: Optional[int] = None,
     date_limit: Optional[datetime] = None,
     overwrite: bool = False,
+    client: Optional[GitHubClient] = None,
 ):
     out_csv = out_dir / "issues_confs.csv"
     if overwrite and out_csv.exists():
@@ -149,6 +151,7 @@ def scrape_confs(
         cols=COLS,
         pages_limit=pages_limit,
         date_limit=date_limit,
+        client=client,
     )
 
     extractor.scrape_confs()
@@ -6,6 +6,7 @@ from pathlib import Path
 import traceback
 from typing import Optional, Tuple
 
+from gh_scraper.github import GitHubClient
 from gh_scraper.logging import CSVExperimentLogger
 from gh_scraper.scrape_issues import scrape_issues_iter
 import pandas as pd
@@ -106,6 +107,7 @@ class BaseExtractor:
         date_limit: Optional[datetime] = None,
         exit_on_error: bool = False,
         prev_out_dir: Optional[Path] = None,
+        client: Optional[GitHubClient] = None,
     ):
 
         self.out_dir = out_dir
@@ -116,6 +118,7 @@ class BaseExtractor:
 
         self.exit_on_error = exit_on_error
         self.prev_out_dir = prev_out_dir
+        self.client = client
 
     @abstractmethod
     def is_valid_issue_body(self, body: str) -> bool:
@@ -195,6 +198,7 @@ class BaseExtractor:
                         pages_limit=self.pages_limit,
                         date_limit=self.date_limit,
                         page_start=page_start,
+                        client=self.client,
                     )
                 )
             ):
@@ -6,6 +6,7 @@ from typing import Optional, override
 from pathlib import Path
 from csv import writer, reader, DictWriter
 from gh_scraper.extract.common import DEFAULT_COLS, BaseExtractor, BROWSERS, OS_PREFIXES
+from gh_scraper.github import GitHubClient
 from gh_scraper.logging import CSVExperimentLogger
 import numpy as np
 import pandas as pd
@@ -245,6 +246,7 @@ def scrape_confs(
     pages_limit: Optional[int] = None,
     date_limit: Optional[datetime] = None,
     prev_out_dir: Optional[str] = None,
+    client: Optional[GitHubClient] = None,
 ):
 
     if prev_out_dir is not None:
@@ -258,6 +260,7 @@ def scrape_confs(
         date_limit,
         exit_on_error=True,
         prev_out_dir=prev_out_dir,
+        client=client,
     )
 
     if prev_out_dir is not None:
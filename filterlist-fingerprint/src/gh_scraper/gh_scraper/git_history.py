@@ -0,0 +1,310 @@
+"""
+Rule history from a local clone of a filterlist repository.
+
+Instead of one GitHub API call per time delta plus one raw.githubusercontent request
+per watched file and snapshot, the repository is cloned once (bare, shallow up to the
+last commit before the oldest date of interest). Snapshot commits are then resolved from a single `git log`,
+and all file contents are read through one `git cat-file --batch` process.
+"""
+
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import subprocess
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+
+GITHUB_URL = "https://github.com"
+
+
+class GitError(Exception):
+    """Raised when a git command fails"""
+
+
+def _git(*args, cwd: Optional[Path] = None) -> str:
+    proc = subprocess.run(
+        ["git", *args], cwd=cwd, capture_output=True, text=True, check=False
+    )
+
+    if proc.returncode != 0:
+        raise GitError(f"git {' '.join(args)} failed: {proc.stderr.strip()}")
+
+    return proc.stdout
+
+
+def _as_utc_timestamp(date: datetime) -> float:
+    """Naive datetimes are considered UTC, as the GitHub API `until` parameter did"""
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return date.timestamp()
+
+
+def _format_commit_date(timestamp: int) -> str:
+    """Format a commit timestamp like the GitHub API does"""
+
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class LocalRepo:
+    """A local bare clone of a git repository"""
+
+    def __init__(self, path: Path, ref: str = "HEAD"):
+        self.path = Path(path)
+        self.ref = ref
+
+    @classmethod
+    def clone(
+        cls,
+        url: str,
+        dest: Path,
+        since: Optional[datetime] = None,
+        branch: Optional[str] = None,
+    ) -> "LocalRepo":
+        """
+        Clone (or update) a bare, single-branch copy of a repository
+
+        Args:
+            url: repository url (`file://` for local repositories if shallow)
+            dest: directory of the clone
+            since: only fetch the history after this date, and the last commit
+                before it (the snapshot at that date). Full history if None
+            branch: branch to clone. The default branch if None
+
+        Returns:
+            LocalRepo: the cloned repository
+        """
+
+        dest = Path(dest)
+        shallow = [f"--shallow-since={int(_as_utc_timestamp(since))}"] if since else []
+        ref = branch or "HEAD"
+
+        if (dest / "HEAD").exists():
+            tqdm.write(f"Updating clone {dest}")
+            _git("fetch", "--prune", *shallow, "origin", ref, cwd=dest)
+            ref = "FETCH_HEAD"
+
+        else:
+            tqdm.write(f"Cloning {url} to {dest}")
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            _git(
+                "clone",
+                "--bare",
+                "--single-branch",
+                *(["--branch", branch] if branch else []),
+                *shallow,
+                url,
+                str(dest),
+            )
+
+        repo = cls(dest, ref=ref)
+
+        if since:
+            repo.deepen(since, branch or "HEAD")
+
+        return repo
+
+    def deepen(self, date: datetime, remote_ref: str = "HEAD", step: int = 100):
+        """
+        Fetch older history in a shallow clone until it has a commit at or before
+        the date, or its whole history
+
+        Args:
+            date: date the clone must go back to
+            remote_ref: reference fetched from the origin
+            step: number of commits fetched at a time
+        """
+
+        timestamp = _as_utc_timestamp(date)
+
+        while _git("rev-parse", "--is-shallow-repository", cwd=self.path).strip() == "true":
+            commits = self.commits()
+
+            if commits and commits[0][0] <= timestamp:
+                return
+
+            _git("fetch", f"--deepen={step}", "origin", remote_ref, cwd=self.path)
+
+    def commits(self, paths: Optional[Iterable[str]] = None) -> List[Tuple[int, str]]:
+        """
+        List the commits reachable from the reference
+
+        Args:
+            paths: only list commits touching these paths. All commits if None
+
+        Returns:
+            commits: list of (commit timestamp, sha) sorted by timestamp
+        """
+
+        out = _git(
+            "log",
+            "--format=%ct %H",
+            self.ref,
+            *(["--", *paths] if paths else []),
+            cwd=self.path,
+        )
+
+        commits = []
+        for line in out.splitlines():
+            timestamp, sha = line.split(" ", 1)
+            commits.append((int(timestamp), sha))
+
+        return sorted(commits)
+
+    def read_files(self, objects: Iterable[Tuple[str, str]]) -> Iterator[Optional[bytes]]:
+        """
+        Read many files at many commits through a single `git cat-file --batch` process
+
+        Args:
+            objects: iterator of (commit sha, file path)
+
+        Returns:
+            contents: iterator of the file contents, None if the file does not exist at that commit
+        """
+
+        with subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=self.path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        ) as proc:
+
+            try:
+                for sha, path in objects:
+                    proc.stdin.write(f"{sha}:{path}\n".encode())
+                    proc.stdin.flush()
+
+                    header = proc.stdout.readline().split()
+
+                    if len(header) != 3:
+                        # "<object> missing" or "<object> ambiguous"
+                        yield None
+                        continue
+
+                    content = proc.stdout.read(int(header[2]))
+                    proc.stdout.read(1)  # trailing newline
+
+                    yield content
+
+            finally:
+                proc.stdin.close()
+
+
+def snapshot_commits(
+    commits: List[Tuple[int, str]], dates: Iterable[datetime]
+) -> List[Optional[Tuple[int, str]]]:
+    """
+    Find the latest commit at or before each date
+
+    Args:
+        commits: list of (commit timestamp, sha) sorted by timestamp
+        dates: dates of the snapshots
+
+    Returns:
+        snapshots: (commit timestamp, sha) for each date, None if there are no commits before it
+    """
+
+    timestamps = [timestamp for timestamp, _ in commits]
+    snapshots = []
+
+    for date in dates:
+        i = bisect_right(timestamps, _as_utc_timestamp(date))
+        snapshots.append(commits[i - 1] if i > 0 else None)
+
+    return snapshots
+
+
+def rules_last_seen(
+    snapshots: Iterable[Tuple[str, set]], watched_rules: Iterable[str]
+) -> Dict[str, Optional[str]]:
+    """
+    Compute the last-seen date of each watched rule with a single walk from the
+    newest snapshot backwards. A rule's last-seen date is the oldest snapshot of the
+    uninterrupted run of snapshots containing it, starting from the newest one. Rules
+    that are never interrupted within the walked snapshots get None.
+
+    Args:
+        snapshots: iterator of (date, set of rules) ordered from the newest to the oldest
+        watched_rules: rules to track
+
+    Returns:
+        last_seen: {rule: date or None}
+    """
+
+    last_seen = {rule: None for rule in watched_rules}
+    alive = set(last_seen)
+
+    for date, rules in snapshots:
+        # once missing from a snapshot, a rule is not updated anymore
+        alive &= rules
+
+        for rule in alive:
+            last_seen[rule] = date
+
+        if not alive:
+            break
+
+    # rules never removed within the walked snapshots have no last-seen date
+    for rule in alive:
+        last_seen[rule] = None
+
+    return last_seen
+
+
+def track_rules_history_local(
+    repo: LocalRepo,
+    file_paths: Iterable[str],
+    watched_rules: Iterable[str],
+    download_timestamp: datetime,
+    timedeltas: List[timedelta],
+) -> Dict[str, Optional[str]]:
+    """
+    Get the last seen timestamp for each watched rule, from a local clone
+
+    Args:
+        repo: local clone of the filterlist repository
+        file_paths: files of the repository making up the watched filterlists
+        watched_rules: rules to watch
+        download_timestamp: timestamp of the downloaded filterlists
+        timedeltas: increasing time deltas before the download timestamp to take snapshots at
+
+    Returns:
+        last_seen: {rule: commit date or None}
+    """
+
+    file_paths = sorted(set(file_paths))
+
+    commits = repo.commits()
+    snapshots = snapshot_commits(
+        commits, [download_timestamp - delta for delta in timedeltas]
+    )
+
+    if None in snapshots:
+        tqdm.write(
+            f"No commits before {download_timestamp - timedeltas[snapshots.index(None)]}"
+        )
+        snapshots = snapshots[: snapshots.index(None)]
+
+    def _snapshot_rules() -> Iterator[Tuple[str, set]]:
+
+        # consecutive deltas often resolve to the same commit
+        prev_sha, prev_rules = None, None
+
+        for timestamp, sha in tqdm(snapshots, desc="Snapshots"):
+
+            if sha != prev_sha:
+                contents = repo.read_files((sha, fp) for fp in file_paths)
+
+                prev_rules = {
+                    line.strip("\r\t")
+                    for content in contents
+                    if content is not None
+                    for line in content.decode("utf-8", errors="replace").split("\n")
+                }
+                prev_sha = sha
+
+            yield _format_commit_date(timestamp), prev_rules
+
+    return rules_last_seen(_snapshot_rules(), watched_rules)
@@ -0,0 +1,299 @@
+"""
+Shared GitHub REST client used by the issue and commit scrapers.
+
+- one pooled session with a consistent auth header and a timeout on every request
+- primary (`X-RateLimit-Remaining` / `X-RateLimit-Reset`) and secondary (`Retry-After`)
+  rate limits are respected by sleeping until the quota is available again
+- responses are cached on disk by URL and revalidated with `If-None-Match`, a 304
+  answer does not count against the quota
+- paginated endpoints are prefetched a few pages ahead on a thread pool
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_API_URL = "https://api.github.com"
+REQ_TIMEOUT_S = 20
+
+
+class GitHubAPIError(Exception):
+    """Raised when the GitHub API answers with an unexpected status"""
+
+
+class GitHubClient:
+    """A thread-safe GitHub REST client with rate-limit awareness and an ETag cache"""
+
+    def __init__(
+        self,
+        token: Optional[str] = GITHUB_TOKEN,
+        cache_dir: Optional[Path] = None,
+        prefetch: int = 4,
+        timeout: float = REQ_TIMEOUT_S,
+        retries: int = 3,
+        max_rate_limit_waits: int = 5,
+        base_url: str = GITHUB_API_URL,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            token: GitHub API token. Requests are anonymous if None
+            cache_dir: directory of the on-disk response cache. No caching if None
+            prefetch: number of pages fetched ahead (and concurrently) when paginating
+            timeout: connect/read timeout in seconds
+            retries: number of retries on connection errors and 5xx responses
+            max_rate_limit_waits: number of times a request waits for the rate limit before failing
+            base_url: API root, overridable to point to a local stand-in
+            sleep: sleep function, overridable for testing
+        """
+
+        self.base_url = base_url.rstrip("/")
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.prefetch = max(1, prefetch)
+        self.timeout = timeout
+        self.max_rate_limit_waits = max_rate_limit_waits
+        self.sleep = sleep
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        adapter = HTTPAdapter(
+            pool_connections=self.prefetch,
+            pool_maxsize=self.prefetch,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=["GET"],
+                raise_on_status=False,
+                # rate limits are handled by the client itself
+                respect_retry_after_header=False,
+            ),
+        )
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+        )
+
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        # rate-limit state shared between threads
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._reset_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+    def url(self, path: str) -> str:
+        """Resolve an API path (e.g. `repos/{repo}/issues`) to a full URL"""
+
+        if path.startswith(("http://", "https://")):
+            return path
+
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _cache_fp(self, url: str, params: dict) -> Path:
+        key = url + "?" + json.dumps(params, sort_keys=True, default=str)
+        return self.cache_dir / f"{sha256(key.encode()).hexdigest()}.json"
+
+    def _load_cache(self, fp: Optional[Path]) -> Optional[dict]:
+        if fp is None or not fp.exists():
+            return None
+
+        try:
+            with open(fp, encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return None
+
+    def _store_cache(self, fp: Optional[Path], etag: Optional[str], data: Any):
+        if fp is None or etag is None:
+            return
+
+        tmp = fp.with_name(f"{fp.name}.{threading.get_ident()}.part")
+
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "data": data}, f)
+
+        os.replace(tmp, fp)
+
+    def _wait_for_quota(self):
+        """Sleep until the rate limit resets if the last response exhausted the quota"""
+
+        with self._lock:
+            if self._remaining != 0 or self._reset_at is None:
+                return
+
+            reset_at = self._reset_at
+            delay = reset_at - time.time()
+
+        if delay > 0:
+            tqdm.write(f"GitHub rate limit exhausted, sleeping {delay:.0f}s")
+            self.sleep(delay + 1)
+
+        with self._lock:
+            # the quota has been renewed, unless a newer response says otherwise
+            if self._reset_at == reset_at:
+                self._remaining = None
+
+    def _update_quota(self, resp: requests.Response):
+        with self._lock:
+            if "X-RateLimit-Remaining" in resp.headers:
+                self._remaining = int(resp.headers["X-RateLimit-Remaining"])
+
+            if "X-RateLimit-Reset" in resp.headers:
+                self._reset_at = int(resp.headers["X-RateLimit-Reset"])
+
+    def _rate_limit_delay(self, resp: requests.Response) -> Optional[float]:
+        """Seconds to wait before retrying a rate-limited response, None if not rate-limited"""
+
+        if resp.status_code not in (403, 429):
+            return None
+
+        if "Retry-After" in resp.headers:
+            return float(resp.headers["Retry-After"])
+
+        if resp.headers.get("X-RateLimit-Remaining") == "0":
+            reset_at = int(resp.headers.get("X-RateLimit-Reset", time.time() + 60))
+            return max(reset_at - time.time(), 0) + 1
+
+        return None
+
+    def get(self, path: str, params: Optional[dict] = None) -> Any:
+        """
+        GET an API endpoint and return the decoded JSON body
+
+        Args:
+            path: API path or full URL
+            params: query parameters
+
+        Returns:
+            data: decoded JSON body, from the cache if the server answered 304
+        """
+
+        url = self.url(path)
+        params = dict(params or {})
+
+        cache_fp = self._cache_fp(url, params) if self.cache_dir is not None else None
+        cached = self._load_cache(cache_fp)
+
+        headers = {}
+        if cached is not None:
+            headers["If-None-Match"] = cached["etag"]
+
+        for _ in range(self.max_rate_limit_waits + 1):
+            self._wait_for_quota()
+
+            resp = self.session.get(
+                url, params=params, headers=headers, timeout=self.timeout
+            )
+            self._update_quota(resp)
+
+            delay = self._rate_limit_delay(resp)
+            if delay is None:
+                break
+
+            tqdm.write(f"GitHub rate limit hit on {resp.url}, sleeping {delay:.0f}s")
+            self.sleep(delay)
+
+        if resp.status_code == 304 and cached is not None:
+            return cached["data"]
+
+        if resp.status_code != 200:
+            raise GitHubAPIError(f"Invalid response: {resp} - {resp.text}")
+
+        data = resp.json()
+        self._store_cache(cache_fp, resp.headers.get("ETag"), data)
+
+        return data
+
+    def paginate(
+        self,
+        path: str,
+        params: Optional[dict] = None,
+        page_start: int = 1,
+        pages_limit: Optional[int] = None,
+    ) -> Iterator[list]:
+        """
+        Stream the pages of a paginated list endpoint in order. The next `prefetch`
+        pages are requested concurrently while the current one is consumed, and the
+        stream stops at the first empty page.
+
+        Args:
+            path: API path or full URL
+            params: query parameters, without `page`
+            page_start: first page to fetch
+            pages_limit: last page to fetch (inclusive). All pages if None
+
+        Returns:
+            pages: iterator of the decoded JSON list of each page
+        """
+
+        params = dict(params or {})
+        url = self.url(path)
+
+        executor = ThreadPoolExecutor(max_workers=self.prefetch)
+        pending = deque()
+        next_page = page_start
+
+        def _submit():
+            nonlocal next_page
+
+            if pages_limit and next_page > pages_limit:
+                return
+
+            pending.append(
+                (next_page, executor.submit(self.get, url, params | {"page": next_page}))
+            )
+            next_page += 1
+
+        try:
+            for _ in range(self.prefetch):
+                _submit()
+
+            while pending:
+                page, future = pending.popleft()
+                data = future.result()
+
+                tqdm.write(f"{url}?page={page}")
+
+                if not isinstance(data, list) or len(data) == 0:
+                    return
+
+                yield data
+
+                _submit()
+
+        finally:
+            # the consumer may stop early (e.g. date limit reached)
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -81,7 +81,7 @@ class CSVExperimentLogger:
         self.file = None
         self.writer = None
 
-    def log(self, row: dict):
+    def log(self, row: dict, sync: bool = True):
 
         if self.writer is None:
             raise ValueError(
@@ -99,13 +99,22 @@ class CSVExperimentLogger:
         self.writer.writerow(row)
         self._processed_ids.add(row[self.header[self.id_column]])
 
-        # save to disk
-        self.file.flush()
-        os.fsync(self.file.fileno())
+        if sync:
+            self.sync()
 
     def log_many(self, rows: List[dict]):
+        """Log a batch of rows and save them to disk at once"""
+
         for row in rows:
-            self.log(row)
+            self.log(row, sync=False)
+
+        self.sync()
+
+    def sync(self):
+        """Flush the written rows to disk"""
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
 
     def processed(self, id: str):
         return id in self.processed_ids
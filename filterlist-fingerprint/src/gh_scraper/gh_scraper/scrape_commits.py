@@ -22,17 +22,22 @@ Ref for parsing diffs:
 - so modifications are a lower bound, additions and removals upper bound
 """
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from io import StringIO
 import json
 import logging
+import multiprocessing
 import os
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set
 from dotenv import load_dotenv
 
+from filterlist_parser.raw import make_session
 from filterlist_parser.utils import slug
+from gh_scraper.git_history import GITHUB_URL, LocalRepo, track_rules_history_local
+from gh_scraper.github import GitHubClient
 from gh_scraper.logging import CSVExperimentLogger
 import pandas as pd
 import requests
@@ -43,6 +48,7 @@ load_dotenv()
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 REQ_TIMEOUT_S = 20
+N_CPU = int(os.getenv("N_CPU", 4))
 
 
 class CommitListError(Exception):
@@ -296,6 +302,10 @@ def track_rules_history(
     important_rules: pd.DataFrame,
     logger=logging.getLogger(__name__),
     health_check: bool = False,
+    backend: str = "git",
+    clones_dir: Path = Path("clones"),
+    clone_margin: timedelta = timedelta(days=30),
+    remote_url: str = GITHUB_URL + "/{repo}.git",
 ):
     """
     This function tracks the history of the rules in filterlists from version control (e.g. github)
@@ -307,6 +317,10 @@ def track_rules_history(
     - important_rules: pd.DataFrame: columns: rule, filterlists
     - logger: logging.Logger: logger object
     - health_check: bool: whether to perform a health check
+    - backend: str: "git" to read the history from local clones, "api" to query GitHub for each snapshot
+    - clones_dir: Path: directory of the local clones (git backend)
+    - clone_margin: timedelta: history fetched before the oldest snapshot at once, the clone is deepened further if it has no commit preceding the snapshot (git backend)
+    - remote_url: str: url template of the repositories to clone (git backend)
 
     Returns:
     - pd.DataFrame: columns: rule, last_seen
@@ -384,14 +398,38 @@ def track_rules_history(
 
         tqdm.write(f"{repo}:\t\t watching {len(watched_rules)} rules")
 
-        _rules_last_seen = _track_rules_history_for_repo(
-            repo,
-            filepaths_to_watch[repo],
-            watched_rules,
-            filterlist_timestamp,
-            timedeltas,
-            branch=branches[repo],
-        )
+        if backend == "git":
+            # approximation; just take the first timestamp to a participating filterlist
+            download_timestamp = filterlist_timestamp[repo_filterlists[0]]
+            branch = branches[repo]
+
+            local_repo = LocalRepo.clone(
+                remote_url.format(repo=repo),
+                Path(clones_dir) / slug(repo),
+                since=download_timestamp - timedeltas[-1] - clone_margin,
+                branch=None if branch in {"master", "main"} else branch,
+            )
+
+            _rules_last_seen = track_rules_history_local(
+                local_repo,
+                filepaths_to_watch[repo],
+                watched_rules,
+                download_timestamp,
+                timedeltas,
+            )
+
+        elif backend == "api":
+            _rules_last_seen = _track_rules_history_for_repo(
+                repo,
+                filepaths_to_watch[repo],
+                watched_rules,
+                filterlist_timestamp,
+                timedeltas,
+                branch=branches[repo],
+            )
+
+        else:
+            raise ValueError(f"Unknown history backend: {backend}")
 
         os.makedirs("per_repo", exist_ok=True)
         _df = pd.DataFrame(_rules_last_seen.items(), columns=["rule", "last_seen"])
@@ -409,73 +447,113 @@ def scrape_commits_iter(
     page_start=1,
     pages_limit: Optional[int] = None,
     date_limit: Optional[datetime] = None,
+    client: Optional[GitHubClient] = None,
 ):
+    """
+    Stream the commits of a repository, newest first. Pages are prefetched concurrently by the client.
+
+    Args:
+        repo: repository name (owner/name)
+        url_args: query parameters of the commits endpoint, must contain `per_page`
+        page_start: first page to fetch
+        pages_limit: last page to fetch
+        date_limit: stop at the first commit authored before this date
+        client: GitHub client to use. A new one is created if None
+    """
 
     if url_args is None:
         url_args = {}
 
-    page = page_start
+    own_client = client is None
+    client = client or GitHubClient()
 
-    resp = requests.get(
-        f"https://api.github.com/repos/{repo}/commits",
-        params={"per_page": url_args["per_page"], "page": page},
-        headers={"Authorization": f"token {GITHUB_TOKEN}"},
-    )
+    try:
+        pages = client.paginate(
+            f"repos/{repo}/commits",
+            params={"per_page": url_args["per_page"]},
+            page_start=page_start,
+            pages_limit=pages_limit,
+        )
 
-    tqdm.write(resp.request.url)
+        first_page = True
 
-    if not _is_valid_commit_list_resp(resp):
-        raise CommitListError(f"Invalid response: {resp} - {resp.text}")
+        for commits in pages:
 
-    while _is_valid_commit_list_resp(resp):
-        for commit in resp.json():
+            if first_page and "url" not in commits[0]:
+                raise CommitListError(f"Invalid response: {commits[0]}")
 
-            if (
-                date_limit
-                and datetime.strptime(
-                    commit["commit"]["author"]["date"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                < date_limit
-            ):
-                return
+            first_page = False
 
-            yield commit
+            for commit in commits:
 
-        if pages_limit and page >= pages_limit:
-            return
+                if (
+                    date_limit
+                    and datetime.strptime(
+                        commit["commit"]["author"]["date"], "%Y-%m-%dT%H:%M:%SZ"
+                    )
+                    < date_limit
+                ):
+                    pages.close()
+                    return
 
-        page += 1
-        resp = requests.get(
-            f"https://api.github.com/repos/{repo}/commits",
-            params={"per_page": url_args["per_page"], "page": page},
-            headers={"Authorization": f"token {GITHUB_TOKEN}"},
-        )
+                yield commit
 
-        tqdm.write(resp.request.url)
+        if first_page:
+            raise CommitListError(f"No commits found for {repo} from page {page_start}")
 
-        if not _is_valid_commit_list_resp(resp):
-            raise CommitListError(f"Invalid response: {resp} - {resp.text}")
+    finally:
+        if own_client:
+            client.close()
+
+
+def fetch_commit_patch(
+    repo: str, sha: str, session: Optional[requests.Session] = None
+) -> str:
+    """Download the patch of a commit from github.com (does not count against the API quota)"""
+
+    resp = (session or requests).get(
+        f"https://github.com/{repo}/commit/{sha}.patch", timeout=REQ_TIMEOUT_S
+    )
+    resp.raise_for_status()
+
+    return resp.text
 
 
-def unpack_commit(repo, commit_data):
+def parse_commit_patch(patch: str, commit_data: dict) -> List[dict]:
+    """
+    Turn the patch of a commit into rule changes. A removal directly followed by an
+    addition is a modification, other lines are additions and removals.
+
+    Args:
+        patch: patch text of the commit
+        commit_data: commit data with at least `sha` and `commit.author.date`
+
+    Returns:
+        changes: list of change rows
+    """
 
-    # each commit contains a list of files changed
     changes = []
 
-    patches_resp = requests.get(
-        f"https://github.com/{repo}/commit/{commit_data['sha']}.patch"
-    )
+    commit_id = commit_data["sha"]
+    timestamp = commit_data["commit"]["author"]["date"]
+
+    def _change(file_path, change_type, prev_rule, new_rule):
+        return {
+            "commit_id": commit_id,
+            "file_path": file_path,
+            "change_type": change_type,
+            "timestamp": timestamp,
+            "prev_rule": prev_rule,
+            "new_rule": new_rule,
+        }
 
-    patch_set = PatchSet(StringIO(patches_resp.text))
+    patch_set = PatchSet(StringIO(patch))
 
     for patched_file in patch_set:
         file_path = patched_file.path  # file name
 
         for hunk in patched_file:
 
-            # modified: if a removal directly followed by an addition
-            # added and removed otherwise
-
             prev_removed = None
 
             for line in hunk:
@@ -484,27 +562,11 @@ def unpack_commit(repo, commit_data):
 
                     if prev_removed is not None:
                         changes.append(
-                            {
-                                "commit_id": commit_data["sha"],
-                                "file_path": file_path,
-                                "change_type": "modified",
-                                "timestamp": commit_data["commit"]["author"]["date"],
-                                "prev_rule": prev_removed.value,
-                                "new_rule": line.value,
-                            }
+                            _change(file_path, "modified", prev_removed.value, line.value)
                         )
 
                     else:
-                        changes.append(
-                            {
-                                "commit_id": commit_data["sha"],
-                                "file_path": file_path,
-                                "change_type": "added",
-                                "timestamp": commit_data["commit"]["author"]["date"],
-                                "prev_rule": None,
-                                "new_rule": line.value,
-                            }
-                        )
+                        changes.append(_change(file_path, "added", None, line.value))
 
                 elif line.is_removed:
                     prev_removed = line
@@ -512,36 +574,133 @@ def unpack_commit(repo, commit_data):
                 else:
                     if prev_removed is not None:
                         changes.append(
-                            {
-                                "commit_id": commit_data["sha"],
-                                "file_path": file_path,
-                                "change_type": "removed",
-                                "timestamp": commit_data["commit"]["author"]["date"],
-                                "prev_rule": prev_removed.value,
-                                "new_rule": None,
-                            }
+                            _change(file_path, "removed", prev_removed.value, None)
                         )
 
                     prev_removed = None
 
             if prev_removed is not None:
-                changes.append(
-                    {
-                        "commit_id": commit_data["sha"],
-                        "file_path": file_path,
-                        "change_type": "removed",
-                        "timestamp": commit_data["commit"]["author"]["date"],
-                        "prev_rule": prev_removed.value,
-                        "new_rule": None,
-                    }
-                )
+                changes.append(_change(file_path, "removed", prev_removed.value, None))
 
     return changes
 
 
+def unpack_commit(repo, commit_data, session: Optional[requests.Session] = None):
+    """Download and parse the rule changes of a commit"""
+
+    return parse_commit_patch(
+        fetch_commit_patch(repo, commit_data["sha"], session), commit_data
+    )
+
+
+def _commit_meta(commit_data: dict) -> dict:
+    """The part of the commit data needed to parse its patch (cheap to send to workers)"""
+
+    return {
+        "sha": commit_data["sha"],
+        "commit": {"author": {"date": commit_data["commit"]["author"]["date"]}},
+    }
+
+
+def unpack_commits_iter(
+    repo: str,
+    commits: Iterable[dict],
+    fetchers: int = 16,
+    parsers: int = N_CPU,
+):
+    """
+    Pipeline that downloads commit patches on a thread pool and parses them on a
+    process pool. At most `4 * fetchers` commits are in flight and results are
+    yielded in the order of `commits`.
+
+    Args:
+        repo: repository name (owner/name)
+        commits: iterator of commit data
+        fetchers: number of concurrent patch downloads
+        parsers: number of patch parsing processes. Parse in the fetcher threads if 0
+
+    Returns:
+        iterator of (commit data, list of changes)
+    """
+
+    session = make_session(max_workers=fetchers)
+    # the parsers are started from the fetcher threads, forking them is unsafe
+    parse_pool = (
+        ProcessPoolExecutor(
+            max_workers=parsers, mp_context=multiprocessing.get_context("spawn")
+        )
+        if parsers > 0
+        else None
+    )
+    fetch_pool = ThreadPoolExecutor(max_workers=fetchers)
+
+    def _fetch_and_parse(commit_data):
+        patch = fetch_commit_patch(repo, commit_data["sha"], session)
+
+        if parse_pool is None:
+            return parse_commit_patch(patch, commit_data)
+
+        return parse_pool.submit(parse_commit_patch, patch, _commit_meta(commit_data))
+
+    pending = deque()
+    commits = iter(commits)
+
+    def _submit():
+        commit_data = next(commits, None)
+        if commit_data is not None:
+            pending.append((commit_data, fetch_pool.submit(_fetch_and_parse, commit_data)))
+
+    try:
+        for _ in range(4 * fetchers):
+            _submit()
+
+        while pending:
+            commit_data, future = pending.popleft()
+            changes = future.result()
+
+            if parse_pool is not None:
+                changes = changes.result()
+
+            yield commit_data, changes
+
+            _submit()
+
+    finally:
+        fetch_pool.shutdown(wait=True, cancel_futures=True)
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True, cancel_futures=True)
+        session.close()
+
+
 def scrape_commits(
-    out_dir: Path, config: dict, force=False, pages_limit=None, date_limit=None
+    out_dir: Path,
+    config: dict,
+    force=False,
+    pages_limit=None,
+    date_limit=None,
+    client: Optional[GitHubClient] = None,
+    fetchers: int = 16,
+    parsers: int = N_CPU,
+    batch_size: int = 1000,
 ):
+    """
+    Scrape the rule changes of every commit of a repository to `changes.csv`.
+    Patches are fetched and parsed concurrently and rows are written in batches of
+    whole commits. Every processed commit, with or without rule changes, is
+    recorded in `processed_commits.csv` once its changes are written, and skipped
+    when the scraping is resumed.
+
+    Args:
+        out_dir: output directory
+        config: forum configuration with `repo` and `params.per_page`
+        force: overwrite an existing `changes.csv` and `processed_commits.csv`
+        pages_limit: last page of the commit list to scrape
+        date_limit: stop at the first commit authored before this date
+        client: GitHub client to list the commits
+        fetchers: number of concurrent patch downloads
+        parsers: number of patch parsing processes
+        batch_size: minimum number of rows written (and fsynced) at once
+    """
 
     cols = [
         "index",
@@ -554,39 +713,66 @@ def scrape_commits(
     ]
 
     out_csv = out_dir / "changes.csv"
+    commits_csv = out_dir / "processed_commits.csv"
 
-    n_changes = 0
+    with CSVExperimentLogger(
+        out_csv, cols, mkdir=True, append=not force
+    ) as logger, CSVExperimentLogger(
+        commits_csv, ["commit_id", "n_changes"], mkdir=True, append=not force
+    ) as commits_logger:
 
-    with CSVExperimentLogger(out_csv, cols, mkdir=True, append=not force) as logger:
+        n_changes = len(logger.processed_ids)
 
-        page_start = len(logger.processed_ids) // config["params"]["per_page"] + 1
+        processed_commits = set(commits_logger.processed_ids)
+        if n_changes > 0:
+            # commits written before a crash, or by a run without a commits log
+            processed_commits |= set(
+                pd.read_csv(out_csv, usecols=["commit_id"])["commit_id"]
+            )
 
-        n_changes += len(logger.processed_ids)
+        commits = (
+            commit
+            for commit in scrape_commits_iter(
+                repo=config["repo"],
+                url_args=config.get("params"),
+                pages_limit=pages_limit,
+                date_limit=date_limit,
+                client=client,
+            )
+            if commit["sha"] not in processed_commits
+        )
 
+        batch = []
+        commits_batch = []
         index = 0
 
-        for i, commit in tqdm(
-            enumerate(
-                scrape_commits_iter(
-                    repo=config["repo"],
-                    url_args=config.get("params"),
-                    pages_limit=pages_limit,
-                    date_limit=date_limit,
-                    page_start=page_start,
+        try:
+            for index, (commit, changes) in tqdm(
+                enumerate(
+                    unpack_commits_iter(
+                        config["repo"], commits, fetchers=fetchers, parsers=parsers
+                    )
                 )
-            )
-        ):
-            try:
+            ):
+                for change in changes:
+                    batch.append({"index": n_changes, **change})
+                    n_changes += 1
 
-                index = i + (page_start - 1) * config["params"]["per_page"]
+                commits_batch.append(
+                    {"commit_id": commit["sha"], "n_changes": len(changes)}
+                )
 
-                if logger.processed(str(index)):
-                    continue
+                # only write whole commits to keep resuming consistent
+                if len(batch) >= batch_size or len(commits_batch) >= batch_size:
+                    logger.log_many(batch)
+                    commits_logger.log_many(commits_batch)
+                    batch = []
+                    commits_batch = []
 
-                for change in unpack_commit(config["repo"], commit):
-                    logger.log({"index": n_changes, **change})
-                    n_changes += 1
+        except Exception as e:
+            print(f"Error at index {index}: {e}")
+            raise e
 
-            except Exception as e:
-                print(f"Error at index {index}: {e}")
-                raise e
\ No newline at end of file
+        finally:
+            logger.log_many(batch)
+            commits_logger.log_many(commits_batch)
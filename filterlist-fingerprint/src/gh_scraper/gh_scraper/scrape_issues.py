@@ -1,78 +1,71 @@
 from datetime import datetime
-import os
-from pathlib import Path
 from typing import Optional
-from dotenv import load_dotenv
-from csv import writer
 
-import requests
-import tqdm
-
-load_dotenv()
-
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+from gh_scraper.github import GitHubClient
 
 
 class IssueListError(Exception):
     pass
 
 
-def _is_valid_issue_list_resp(resp: requests.Response) -> bool:
-    return (
-        resp.status_code == 200
-        and resp.headers["Content-Type"] == "application/json; charset=utf-8"
-        and isinstance(resp.json(), list)
-        and len(resp.json()) > 0
-        and "url" in resp.json()[0]
-    )
-
-
 def scrape_issues_iter(
     repo: str,
     url_args: Optional[dict] = None,
     page_start=1,
     pages_limit: Optional[int] = None,
     date_limit: Optional[datetime] = None,
+    client: Optional[GitHubClient] = None,
 ):
+    """
+    Stream the issues of a repository, newest first unless `url_args` says otherwise.
+    Pages are prefetched concurrently by the client.
+
+    Args:
+        repo: repository name (owner/name)
+        url_args: query parameters of the issues endpoint
+        page_start: first page to fetch
+        pages_limit: last page to fetch
+        date_limit: stop at the first issue created before this date
+        client: GitHub client to use. A new one is created if None
+    """
 
     if url_args is None:
         url_args = {}
 
-    page = page_start
-
-    resp = requests.get(
-        f"https://api.github.com/repos/{repo}/issues",
-        params={**url_args, "page": page},
-        headers={
-            "Authorization": f"Bearer {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github+json",
-        },
-    )
-    
-    tqdm.tqdm.write(resp.request.url)
-
-    if not _is_valid_issue_list_resp(resp):
-        raise IssueListError(f"Invalid response: {resp} - {resp.text}")
-
-    while _is_valid_issue_list_resp(resp):
-        for issue in resp.json():
-            if (
-                date_limit
-                and datetime.strptime(issue["created_at"], "%Y-%m-%dT%H:%M:%SZ")
-                < date_limit
-            ):
-                return
-
-            yield issue
-
-        if pages_limit and page >= pages_limit:
-            return
-
-        page += 1
-        resp = requests.get(
-            f"https://api.github.com/repos/{repo}/issues",
-            params={**url_args, "page": page},
-            headers={"Authorization": f"token {GITHUB_TOKEN}"},
+    own_client = client is None
+    client = client or GitHubClient()
+
+    try:
+        pages = client.paginate(
+            f"repos/{repo}/issues",
+            params=dict(url_args),
+            page_start=page_start,
+            pages_limit=pages_limit,
         )
 
-        tqdm.tqdm.write(resp.request.url)
+        first_page = True
+
+        for issues in pages:
+
+            if first_page and "url" not in issues[0]:
+                raise IssueListError(f"Invalid response: {issues[0]}")
+
+            first_page = False
+
+            for issue in issues:
+                if (
+                    date_limit
+                    and datetime.strptime(issue["created_at"], "%Y-%m-%dT%H:%M:%SZ")
+                    < date_limit
+                ):
+                    pages.close()
+                    return
+
+                yield issue
+
+        if first_page:
+            raise IssueListError(f"No issues found for {repo} from page {page_start}")
+
+    finally:
+        if own_client:
+            client.close()
@@ -0,0 +1,74 @@
+import random
+
+from filterlist_parser.adguardparser.parser import AdblockRule, AdblockRules
+
+RULES = [
+    "||ads.example.com^",
+    "||example.com/ads/$image",
+    "/banner/*/img",
+    "swf|",
+    "-ads_",
+    "/ads[0-9]?/",
+    "||tracker.net^$script,domain=news.com|blog.org",
+    "||cdn.net/lib.js$domain=~safe.com",
+    "@@||ads.example.com/allowed^",
+    "@@||tracker.net/ok$domain=blog.org",
+]
+
+URLS = [
+    "http://ads.example.com/x.gif",
+    "http://ads.example.com/allowed/x.gif",
+    "http://sub.example.com/ads/a.png",
+    "http://cdn.net/banner/1/img.png",
+    "http://example.com/annoying.swf",
+    "http://example.com/swf/index.html",
+    "http://x.com/top-ads_1.js",
+    "http://x.com/ads7/",
+    "http://tracker.net/t.js",
+    "http://tracker.net/ok.js",
+    "http://cdn.net/lib.js",
+]
+
+PAGE_DOMAINS = ["news.com", "www.blog.org", "safe.com", "other.com"]
+
+
+def brute_force_should_block(rules, url, options):
+    def _matches(rule):
+        if not rule.matching_supported(options):
+            return False
+        if rule.options:
+            return rule.match_url(url, options)
+        return rule.match_url(url.lower()) or rule.match_url(url)
+
+    if any(_matches(rule) for rule in rules if rule.is_exception):
+        return False
+
+    return any(_matches(rule) for rule in rules if not rule.is_exception)
+
+
+def test_indexed_matching_matches_brute_force():
+
+    rules = AdblockRules(RULES, use_re2=False)
+    plain_rules = [AdblockRule(rule) for rule in RULES]
+
+    random.seed(0)
+    requests = [
+        (url, {"domain": domain, "image": random.random() < 0.5, "script": True})
+        for url in URLS
+        for domain in PAGE_DOMAINS
+    ]
+
+    expected = [brute_force_should_block(plain_rules, *request) for request in requests]
+
+    assert [rules.should_block(*request) for request in requests] == expected
+    assert rules.should_block_batch(
+        [url for url, _ in requests], [options for _, options in requests]
+    ) == expected
+
+    assert sum(expected) > 0 and not all(expected)
+
+    blocking, exceptions = rules.matching_rules(
+        "http://tracker.net/ok.js", {"domain": "blog.org", "script": True}
+    )
+    assert [rule.raw_rule_text for rule in blocking] == [RULES[6]]
+    assert [rule.raw_rule_text for rule in exceptions] == [RULES[9]]
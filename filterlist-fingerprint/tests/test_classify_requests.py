@@ -0,0 +1,60 @@
+import json
+
+from filterlist_parser.adguardparser.classify import (
+    classify_requests,
+    iter_request_log,
+    request_options,
+)
+
+LIST_RULES = {
+    "Ads": ["||ads.example.com^\n", "||cdn.net/ad.js$script\n", "@@||ads.example.com/ok^\n"],
+    "Privacy": ["||ads.example.com^\n", "||tracker.net^$third-party\n"],
+}
+
+REQUESTS = [
+    {"url": "http://ads.example.com/b.gif", "page_domain": "news.com", "resource_type": "image"},
+    {"url": "http://ads.example.com/ok/b.gif", "page_domain": "news.com", "resource_type": "image"},
+    {"url": "http://cdn.net/ad.js", "page_domain": "news.com", "resource_type": "script"},
+    {"url": "http://cdn.net/ad.js", "page_domain": "news.com", "resource_type": "image"},
+    {"url": "http://tracker.net/t", "page_domain": "tracker.net", "resource_type": "xhr"},
+    {"url": "http://tracker.net/t", "page_domain": "news.com", "resource_type": "xhr"},
+]
+
+
+def test_request_options():
+
+    options = request_options("http://a.cdn.net/x", "www.news.com", "sub_frame")
+
+    assert options["subdocument"] and not options["script"]
+    assert options["domain"] == "www.news.com"
+    assert options["third-party"]
+    assert not request_options("http://a.news.com/x", "news.com", None)["third-party"]
+
+
+def test_classify_request_log(tmp_path):
+
+    log_fp = tmp_path / "requests.jsonl"
+    log_fp.write_text("\n".join(json.dumps(r) for r in REQUESTS) + "\n")
+
+    batches = list(iter_request_log(log_fp, batch_size=4))
+    assert [len(b) for b in batches] == [4, 2]
+
+    for workers in (0, 2):
+        rule_hits, list_coverage, summary = classify_requests(
+            LIST_RULES, iter_request_log(log_fp, batch_size=2), workers=workers
+        )
+
+        assert summary["n_requests"] == len(REQUESTS)
+        assert summary["n_blocked"] == 3
+
+        hits = dict(zip(rule_hits.rule, rule_hits.hits))
+        assert hits == {
+            "||ads.example.com^": 2,
+            "@@||ads.example.com/ok^": 1,
+            "||cdn.net/ad.js$script": 1,
+            "||tracker.net^$third-party": 1,
+        }
+
+        # the Privacy list has no exception for ads.example.com/ok
+        blocked = dict(zip(list_coverage.list, list_coverage.n_blocked))
+        assert blocked == {"Ads": 2, "Privacy": 3}
@@ -0,0 +1,65 @@
+from itertools import combinations
+
+import numpy as np
+from fingerprint.coverage import GreedyMaxCoverage
+
+
+def naive_greedy(covers, covered):
+    covered = covered.copy()
+    picks = []
+
+    while True:
+        gains = (covers & ~covered).sum(axis=1)
+        row = int(np.argmax(gains))
+
+        if gains[row] == 0:
+            return picks
+
+        picks.append(row)
+        covered |= covers[row]
+
+
+def test_lazy_greedy_matches_naive_greedy():
+
+    rng = np.random.default_rng(0)
+
+    for _ in range(50):
+        covers = rng.random((rng.integers(1, 80), rng.integers(1, 30))) < 0.15
+        covered = rng.random(covers.shape[1]) < 0.2
+
+        picks = GreedyMaxCoverage(covers).run(covered=covered)
+
+        assert [row for row, _ in picks] == naive_greedy(covers, covered)
+
+        for row, new in picks:
+            assert not covered[new].any() and covers[row, new].all()
+            covered[new] = True
+
+
+def test_weighted_and_budgeted_coverage():
+
+    covers = np.array(
+        [
+            [1, 1, 0, 0],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1],
+            [0, 1, 1, 1],
+        ],
+        dtype=bool,
+    )
+
+    # the last list is worth more than the other three together
+    picks = GreedyMaxCoverage(covers, weights=[1, 1, 1, 5]).run(max_domains=1)
+    assert [row for row, _ in picks] == [3]
+
+    # with a budget of 2, the expensive domain is ranked by gain per cost
+    costs = np.array([1, 1, 1, 3])
+    picks = GreedyMaxCoverage(covers, costs=costs).run(budget=2)
+    assert sum(costs[row] for row, _ in picks) <= 2
+
+    best = max(
+        covers[list(rows)].any(axis=0).sum()
+        for rows in combinations(range(4), 2)
+        if costs[list(rows)].sum() <= 2
+    )
+    assert sum(len(new) for _, new in picks) == best
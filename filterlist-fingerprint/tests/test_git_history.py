@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta, timezone
+import os
+import subprocess
+
+import pytest
+from gh_scraper.git_history import LocalRepo, track_rules_history_local
+
+# (date, content of filters/a.txt, content of filters/b.txt)
+HISTORY = [
+    (datetime(2024, 1, 1), "||old.com^\n||always.com^\n", "##.gone\n"),
+    (datetime(2024, 1, 10), "||always.com^\n||mid.com^\n", "##.gone\n##.kept\n"),
+    (datetime(2024, 1, 20), "||always.com^\n||mid.com^\n||new.com^\n", "##.kept\n"),
+    (datetime(2024, 1, 30), "||always.com^\n||new.com^\n", "##.kept\n"),
+]
+
+
+def _git(cwd, *args, date=None):
+    env = dict(os.environ)
+    env |= {
+        "GIT_AUTHOR_NAME": "test",
+        "GIT_AUTHOR_EMAIL": "test@example.com",
+        "GIT_COMMITTER_NAME": "test",
+        "GIT_COMMITTER_EMAIL": "test@example.com",
+    }
+    if date:
+        env |= {
+            "GIT_AUTHOR_DATE": date.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+            "GIT_COMMITTER_DATE": date.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+        }
+    subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True)
+
+
+@pytest.fixture
+def fixture_repo(tmp_path):
+    repo = tmp_path / "upstream"
+    (repo / "filters").mkdir(parents=True)
+    _git(repo, "init", "-b", "master")
+
+    for date, content_a, content_b in HISTORY:
+        (repo / "filters" / "a.txt").write_text(content_a)
+        (repo / "filters" / "b.txt").write_text(content_b)
+        _git(repo, "add", "-A")
+        _git(repo, "commit", "-m", f"update {date}", date=date)
+
+    return repo
+
+
+def test_track_rules_history_local(fixture_repo, tmp_path):
+
+    local_repo = LocalRepo.clone(fixture_repo.as_uri(), tmp_path / "clones" / "upstream")
+    assert len(local_repo.commits()) == len(HISTORY)
+
+    watched_rules = ["||always.com^", "||mid.com^", "||new.com^", "##.kept", "##.gone"]
+    timedeltas = [timedelta(days=d) for d in (0, 5, 15, 25, 40)]
+
+    last_seen = track_rules_history_local(
+        local_repo,
+        ["filters/a.txt", "filters/b.txt", "filters/missing.txt"],
+        watched_rules,
+        datetime(2024, 2, 1),
+        timedeltas,
+    )
+
+    # snapshots: 02-01 -> 01-30, 01-27 -> 01-20, 01-17 -> 01-10, 01-07 -> 01-01, 12-23 -> none
+    assert last_seen == {
+        # present in every snapshot until the history ends
+        "||always.com^": None,
+        "||mid.com^": None,
+        "||new.com^": "2024-01-20T00:00:00Z",
+        "##.kept": "2024-01-10T00:00:00Z",
+        "##.gone": None,
+    }
+
+    # an existing clone is updated in place
+    local_repo = LocalRepo.clone(
+        fixture_repo.as_uri(),
+        tmp_path / "clones" / "upstream",
+        since=datetime(2024, 1, 15),
+    )
+    newest = datetime(2024, 1, 30, tzinfo=timezone.utc)
+    assert local_repo.commits()[-1][0] == int(newest.timestamp())
+
+
+def test_shallow_clone_reaches_the_oldest_snapshot(fixture_repo, tmp_path):
+
+    watched_rules = ["||always.com^", "||mid.com^", "||new.com^", "##.kept", "##.gone"]
+    timedeltas = [timedelta(days=d) for d in (0, 5, 15)]
+    download_timestamp = datetime(2024, 2, 1)
+    # no commit between the 01-10 one and the oldest snapshot
+    oldest_snapshot = download_timestamp - timedeltas[-1]
+    oldest = int(datetime(2024, 1, 10, tzinfo=timezone.utc).timestamp())
+
+    # deepened one commit at a time from a clone cut at the oldest snapshot
+    dest = tmp_path / "clones" / "stepwise"
+    _git(
+        tmp_path,
+        "clone",
+        "--bare",
+        f"--shallow-since={int(oldest_snapshot.replace(tzinfo=timezone.utc).timestamp())}",
+        fixture_repo.as_uri(),
+        str(dest),
+    )
+    stepwise = LocalRepo(dest)
+    assert stepwise.commits()[0][0] > oldest
+
+    stepwise.deepen(oldest_snapshot, step=1)
+    assert stepwise.commits()[0][0] == oldest
+    assert len(stepwise.commits()) == len(HISTORY) - 1
+
+    shallow = LocalRepo.clone(
+        fixture_repo.as_uri(), tmp_path / "clones" / "shallow", since=oldest_snapshot
+    )
+    full = LocalRepo.clone(fixture_repo.as_uri(), tmp_path / "clones" / "full")
+
+    def _last_seen(repo):
+        return track_rules_history_local(
+            repo,
+            ["filters/a.txt", "filters/b.txt"],
+            watched_rules,
+            download_timestamp,
+            timedeltas,
+        )
+
+    assert _last_seen(stepwise) == _last_seen(shallow) == _last_seen(full)
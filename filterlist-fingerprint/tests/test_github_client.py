@@ -0,0 +1,139 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from gh_scraper.github import GitHubAPIError, GitHubClient
+from gh_scraper.scrape_issues import scrape_issues_iter
+
+N_ISSUES = 25
+PER_PAGE = 10
+
+
+def make_issue(i):
+    return {
+        "url": f"https://api.github.com/repos/o/r/issues/{i}",
+        "number": i,
+        "created_at": f"2024-01-{31 - i:02d}T00:00:00Z",
+    }
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+
+    calls = []
+    throttle = set()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        page = int(params.get("page", ["1"])[0])
+        per_page = int(params.get("per_page", [str(PER_PAGE)])[0])
+
+        self.calls.append((url.path, page, self.headers.get("Authorization")))
+
+        if url.path != "/repos/o/r/issues":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        # secondary rate limit once per throttled page
+        if page in self.throttle:
+            self.throttle.discard(page)
+            self.send_response(429)
+            self.send_header("Retry-After", "3")
+            self.end_headers()
+            return
+
+        etag = f'"page-{page}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        issues = [
+            make_issue(i)
+            for i in range((page - 1) * per_page, min(page * per_page, N_ISSUES))
+        ]
+        body = json.dumps(issues).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Remaining", "0" if page == 1 else "100")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 30))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    FakeGitHubHandler.calls = []
+    FakeGitHubHandler.throttle = set()
+
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    httpd.shutdown()
+
+
+def test_paginate_with_cache_and_rate_limits(server, tmp_path):
+
+    sleeps = []
+    FakeGitHubHandler.throttle = {2}
+
+    with GitHubClient(
+        token="secret",
+        cache_dir=tmp_path,
+        prefetch=1,
+        base_url=server,
+        sleep=sleeps.append,
+    ) as client:
+        issues = list(scrape_issues_iter("o/r", {"per_page": PER_PAGE}, client=client))
+
+    assert [issue["number"] for issue in issues] == list(range(N_ISSUES))
+
+    # slept once for the exhausted quota of page 1 and once for the 429 of page 2
+    assert len(sleeps) == 2
+    assert 3 in sleeps
+    assert all(auth == "Bearer secret" for _, _, auth in FakeGitHubHandler.calls)
+
+    # second run is served from the cache through 304s
+    FakeGitHubHandler.calls = []
+    with GitHubClient(
+        cache_dir=tmp_path, prefetch=4, base_url=server, sleep=sleeps.append
+    ) as client:
+        cached = list(scrape_issues_iter("o/r", {"per_page": PER_PAGE}, client=client))
+
+    assert cached == issues
+
+
+def test_scrape_issues_date_and_page_limits(server):
+
+    with GitHubClient(base_url=server, prefetch=3, sleep=lambda s: None) as client:
+        issues = list(
+            scrape_issues_iter(
+                "o/r",
+                {"per_page": PER_PAGE},
+                page_start=2,
+                date_limit=datetime(2024, 1, 15),
+                client=client,
+            )
+        )
+        assert [issue["number"] for issue in issues] == list(range(10, 17))
+
+        issues = list(
+            scrape_issues_iter("o/r", {"per_page": PER_PAGE}, pages_limit=2, client=client)
+        )
+        assert len(issues) == 2 * PER_PAGE
+
+        with pytest.raises(GitHubAPIError):
+            client.get("repos/o/unknown/issues")
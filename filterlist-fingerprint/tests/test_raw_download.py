@@ -0,0 +1,104 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+from filterlist_parser.raw import (
+    download_lists,
+    load_many_rules,
+    load_rules_iter,
+    load_rules_str,
+    read_list_header,
+)
+
+LISTS = {
+    "/a.txt": ("W/\"a1\"", "! Title: A\n||a.com^\n##.ad\n"),
+    "/b.txt": ("\"b1\"", "[Adblock Plus 2.0]\n||b.com^\n"),
+}
+
+
+class FilterlistHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in LISTS:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag, body = LISTS[self.path]
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FilterlistHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    httpd.shutdown()
+
+
+def test_download_lists_conditional(server, tmp_path, monkeypatch):
+
+    filterlists = [
+        {"name": "List A", "url": f"{server}/a.txt"},
+        {"name": "List B", "url": f"{server}/b.txt"},
+        {"name": "Missing", "url": f"{server}/missing.txt"},
+    ]
+
+    statuses = download_lists(filterlists, tmp_path, max_workers=4, retries=0)
+
+    assert statuses == {
+        "List A": "downloaded",
+        "List B": "downloaded",
+        "Missing": "failed",
+    }
+    assert read_list_header(tmp_path / "list-a.txt")["etag"] == 'W/"a1"'
+    assert list(load_rules_iter("List A", tmp_path)) == ["||a.com^\n", "##.ad\n"]
+    assert list(load_rules_iter("List B", tmp_path)) == ["||b.com^\n"]
+    assert load_rules_str("List A", tmp_path) == "||a.com^\n##.ad\n"
+    assert load_many_rules(["List A", "List B"], tmp_path, as_bytes=True) == {
+        "List A": [b"||a.com^\n", b"##.ad\n"],
+        "List B": [b"||b.com^\n"],
+    }
+    assert not list(tmp_path.glob("*.part"))
+
+    # second run only revalidates
+    statuses = download_lists(filterlists[:2], tmp_path, max_workers=4, retries=0)
+    assert statuses == {"List A": "not-modified", "List B": "not-modified"}
+
+    statuses = download_lists(filterlists[:2], tmp_path, refresh=False)
+    assert statuses == {"List A": "skipped", "List B": "skipped"}
+
+    # upstream update is picked up
+    monkeypatch.setitem(LISTS, "/b.txt", ("\"b2\"", "||b.com^\n||c.com^\n"))
+    statuses = download_lists(filterlists[:2], tmp_path, max_workers=4, retries=0)
+    assert statuses == {"List A": "not-modified", "List B": "downloaded"}
+    assert list(load_rules_iter("List B", tmp_path)) == ["||b.com^\n", "||c.com^\n"]
+
+
+def test_load_rules_crlf(tmp_path):
+
+    (tmp_path / "list-c.txt").write_bytes(
+        b"[Adblock Plus 2.0]\r\n! Title: C\r\n\r\n||c.com^\r\n\r\n##.ad\r\n\n"
+    )
+
+    assert list(load_rules_iter("List C", tmp_path)) == ["||c.com^\n", "##.ad\n"]
+    assert list(load_rules_iter("List C", tmp_path, as_bytes=True)) == [
+        b"||c.com^\r\n",
+        b"##.ad\r\n",
+    ]
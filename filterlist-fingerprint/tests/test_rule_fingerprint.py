@@ -147,4 +147,53 @@ def test_general_fingerprint():
         assert set(results[0]) == set(results_rules[0])
         assert results[1] == results_rules[1]
         assert results[2] == results_rules[2]
-        
\ No newline at end of file
+        
+
+def test_filterlist_rule_masks_candidates():
+
+    from fingerprint.common import (
+        filterlist_rule_masks,
+        viable_candidates_negative,
+        viable_candidates_positive,
+    )
+
+    rng = np.random.default_rng(0)
+
+    # more lists than fit in one word
+    filterlists_matrix = rng.random((70, 200)) < 0.3
+    rule_masks = filterlist_rule_masks(filterlists_matrix)
+    available = rng.random(200) < 0.8
+
+    assert rule_masks.shape == (200, 2)
+
+    for rule in range(200):
+        lists = filterlists_matrix[:, rule]
+
+        certain = filterlists_matrix[lists].all(axis=0)
+        target = filterlists_matrix[~lists].any(axis=0)
+
+        assert (viable_candidates_positive(rule_masks, rule, available) == available & ~certain).all()
+        assert (viable_candidates_negative(rule_masks, rule, available) == available & target).all()
+
+
+def test_iterative_general_fingerprint():
+
+    from fingerprint.general import IterativeGeneralFingerprinting
+
+    users_subscriptions = create_rule_sets(n_sets=50, n_rules=40)
+    user_subscriptions_df = pd.DataFrame([{"index": i, "identifiable_lists": json.dumps(subcriptions)} for i, subcriptions in enumerate(users_subscriptions)])
+
+    fingerprinter = IterativeGeneralFingerprinting(user_subscriptions_df)
+    removed = set()
+
+    for _ in range(3):
+        (mask, anon_sets, _), id_from_index = fingerprinter.fingerprint(5)
+
+        # same partition as fingerprinting the subscriptions without the removed lists
+        remaining_df = user_subscriptions_df.assign(identifiable_lists=[json.dumps(sorted(set(s) - removed)) for s in users_subscriptions])
+        (_, anon_sets_ref, _), _ = general_fingerprinting(remaining_df, 5)
+
+        assert sorted(map(sorted, anon_sets)) == sorted(map(sorted, anon_sets_ref))
+
+        removed |= {id_from_index[m] for m in mask}
+        fingerprinter.remove_lists({id_from_index[m] for m in mask})
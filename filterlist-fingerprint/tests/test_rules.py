@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+# the rules module loads the AGLint binding
+pytest.importorskip("pynpm")
+
+from filterlist_parser.rules import RULE_COLUMNS, write_rule_frames
+
+
+def _frames():
+    rows = [
+        {column: None for column in RULE_COLUMNS}
+        | {"rule": f"||{i}.com^", "network": True, "well_formed": True}
+        for i in range(3)
+    ]
+    rows[1]["activating_domains"] = '["a.com"]'
+
+    return [
+        pd.DataFrame([], columns=RULE_COLUMNS),
+        pd.DataFrame(rows[:1], columns=RULE_COLUMNS),
+        pd.DataFrame([], columns=RULE_COLUMNS),
+        pd.DataFrame(rows[1:], columns=RULE_COLUMNS),
+    ]
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_write_rule_frames_empty_chunks(tmp_path, suffix):
+    fp = tmp_path / f"rules{suffix}"
+
+    assert write_rule_frames(_frames(), fp) == 3
+
+    if suffix == ".csv":
+        written = pd.read_csv(fp)
+    else:
+        pytest.importorskip("pyarrow")
+        written = pd.read_parquet(fp)
+
+    assert list(written.columns) == RULE_COLUMNS
+    assert written["rule"].tolist() == ["||0.com^", "||1.com^", "||2.com^"]
+    assert written["network"].tolist() == [True, True, True]
+    assert written["activating_domains"].tolist()[1] == '["a.com"]'
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_write_rule_frames_without_rows_writes_the_header(tmp_path, suffix):
+    fp = tmp_path / f"rules{suffix}"
+    frames = [pd.DataFrame([], columns=RULE_COLUMNS)] * 2
+
+    assert write_rule_frames(frames, fp) == 0
+    assert write_rule_frames([], tmp_path / f"none{suffix}") == 0
+
+    for written_fp in (fp, tmp_path / f"none{suffix}"):
+        if suffix == ".csv":
+            written = pd.read_csv(written_fp)
+        else:
+            pytest.importorskip("pyarrow")
+            written = pd.read_parquet(written_fp)
+
+        assert list(written.columns) == RULE_COLUMNS
+        assert written.empty
@@ -0,0 +1,116 @@
+import random
+import time
+
+import pandas as pd
+import pytest
+from gh_scraper import scrape_commits
+from gh_scraper.scrape_commits import parse_commit_patch, unpack_commits_iter
+
+PATCH = """From 0123456789abcdef Mon Sep 17 00:00:00 2001
+From: test <test@example.com>
+Date: Mon, 1 Jan 2024 00:00:00 +0000
+Subject: [PATCH] update
+
+---
+ filters/a.txt | 5 +++--
+ 1 file changed, 3 insertions(+), 2 deletions(-)
+
+diff --git a/filters/a.txt b/filters/a.txt
+index 1111111..2222222 100644
+--- a/filters/a.txt
++++ b/filters/a.txt
+@@ -1,4 +1,3 @@
+ ||keep.com^
+-||old.com^
++||new.com^
+ ||keep2.com^
+-||gone.com^
+@@ -10,2 +9,3 @@
+ ||x.com^
++||added.com^
+ ||y.com^
+"""
+
+
+def _commit(sha, day=1):
+    return {"sha": sha, "commit": {"author": {"date": f"2024-01-{day:02d}T00:00:00Z"}}}
+
+
+def test_parse_commit_patch():
+    changes = parse_commit_patch(PATCH, _commit("abc"))
+
+    # the removed line of a modification is also counted as removed, so the
+    # removals are an upper bound (see the module docstring)
+    assert [
+        (c["change_type"], c["prev_rule"], c["new_rule"]) for c in changes
+    ] == [
+        ("modified", "||old.com^\n", "||new.com^\n"),
+        ("removed", "||old.com^\n", None),
+        ("removed", "||gone.com^\n", None),
+        ("added", None, "||added.com^\n"),
+    ]
+    assert {c["file_path"] for c in changes} == {"filters/a.txt"}
+    assert {c["commit_id"] for c in changes} == {"abc"}
+    assert {c["timestamp"] for c in changes} == {"2024-01-01T00:00:00Z"}
+
+
+@pytest.fixture
+def fake_patches(monkeypatch):
+    """Serve PATCH, or an empty patch for the commits starting with 'empty'"""
+
+    fetched = []
+
+    def fetch_commit_patch(repo, sha, session=None):
+        fetched.append(sha)
+        # finish out of order
+        time.sleep(random.random() / 100)
+        return "" if sha.startswith("empty") else PATCH
+
+    monkeypatch.setattr(scrape_commits, "fetch_commit_patch", fetch_commit_patch)
+
+    return fetched
+
+
+@pytest.mark.parametrize("parsers", [0, 2])
+def test_unpack_commits_iter(fake_patches, parsers):
+    commits = [_commit(f"{'empty' if i % 3 == 0 else 'sha'}{i}") for i in range(20)]
+
+    results = list(unpack_commits_iter("o/r", commits, fetchers=4, parsers=parsers))
+
+    assert [commit["sha"] for commit, _ in results] == [c["sha"] for c in commits]
+    for commit, changes in results:
+        assert len(changes) == (0 if commit["sha"].startswith("empty") else 4)
+        assert {c["commit_id"] for c in changes} <= {commit["sha"]}
+
+
+def test_scrape_commits_resume(fake_patches, monkeypatch, tmp_path):
+    commits = [_commit("sha1", 3), _commit("empty2", 2), _commit("sha3", 1)]
+    limit = {"n": 2}
+
+    def scrape_commits_iter(**kwargs):
+        yield from commits[: limit["n"]]
+
+    monkeypatch.setattr(scrape_commits, "scrape_commits_iter", scrape_commits_iter)
+
+    def _scrape():
+        scrape_commits.scrape_commits(
+            tmp_path, {"repo": "o/r"}, fetchers=2, parsers=0, batch_size=1
+        )
+
+    _scrape()
+    assert fake_patches == ["sha1", "empty2"]
+
+    # the commit without changes is not fetched again
+    limit["n"] = 3
+    _scrape()
+    assert fake_patches == ["sha1", "empty2", "sha3"]
+
+    changes = pd.read_csv(tmp_path / "changes.csv")
+    assert changes["index"].tolist() == list(range(8))
+    assert changes["commit_id"].tolist() == ["sha1"] * 4 + ["sha3"] * 4
+
+    processed = pd.read_csv(tmp_path / "processed_commits.csv")
+    assert processed.to_dict("list") == {
+        "commit_id": ["sha1", "empty2", "sha3"],
+        "n_changes": [4, 0, 4],
+    }
@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import contextlib
+import fcntl
 import json
 import pathlib
 import random
+import shutil
 import sys
 import time
 import os
 import traceback
+import urllib.parse
 
 from filterlists import common, adguard, ublock
+import replay
 import stats
 
 from pyvirtualdisplay import Display
@@ -59,55 +64,16 @@ def webStats(webdriver):
     return domComplete - navigationStart, loadEnd - navigationStart
 
 
-def main(number_of_tries, flag, filterlists_str, args_lst):
+PROFILES_PATH = pathlib.Path("/profiles")
 
-    # Filterlists
-    if len(args_lst) == 4:
-        if filterlists_str == "all":
-            filterlists = "all"
-        elif filterlists_str == "default":
-            filterlists = None
-        elif filterlists_str == "mid":
-            filterlists = common.extensions_mid_filterlists[args_lst[-1]]
-
-    else:
-        filterlists = None
-
-    # skip if exists but repeat if adguard
-    fname = "/data/" + args_lst[0].split("//")[1]
+EXTENSIONS_PATH = pathlib.Path("/home/seluser/measure/extensions/extn_crx")
 
-    if args_lst[-1] != "adguard":
-        if os.path.isfile(fname):
-            f = open(fname, "r")
-            data = json.loads(f.read())
-            f.close()
-
-            if args_lst[-1]:
-                if (
-                    args_lst[-1] in data["stats"]
-                    and filterlists_str in data["stats"][args_lst[-1]]
-                ):
-                    print(
-                        f"Skipping {args_lst[0]} with {args_lst[-1]} and {filterlists_str}"
-                    )
-                    return
-
-            else:
-                if fname in data["stats"]:
-                    print(f"Skipping {args_lst[0]}")
-                    return
-
-    # Start X
-    # vdisplay = Display(visible=False, size=(1920, 1080))
-
-    # cpu = int(args_lst[2])
+WARMUP_URL = "https://saiid.ch"
 
-    # port = 5907 + cpu
-    # vdisplay = Display(visible=True, size=(1920, 1080), backend='xvnc', rfbport=port)
 
-    # vdisplay.start()
+def chrome_options():
+    """Options of the measured Chrome"""
 
-    # Prepare Chrome
     options = Options()
     # options.headless = False
     # options.add_argument("--headless=new")
@@ -126,6 +92,164 @@ def main(number_of_tries, flag, filterlists_str, args_lst):
     # options.add_extension("/home/seluser/measure/harexporttrigger-0.6.3.crx")
     options.binary_location = "/usr/local/bin/chrome/chrome"
 
+    return options
+
+
+def get_filterlists(extension, filterlists_str):
+    """Filterlists to configure in the extension for a filterlist tier"""
+
+    if not extension:
+        return None
+
+    if filterlists_str == "all":
+        return "all"
+    elif filterlists_str == "mid":
+        return common.extensions_mid_filterlists[extension]
+
+    return None
+
+
+def add_extensions(options, extensions):
+    """Install the extensions (comma separated) in Chrome, return the last one"""
+
+    extn = None
+
+    for extension in extensions.split(","):
+        matches = list(EXTENSIONS_PATH.glob("{}*.crx".format(extension)))
+        if matches and len(matches) == 1:
+            options.add_extension(str(matches[0]))
+            extn = extension
+        else:
+            print(f"{extensions} - Extension not found")
+            sys.exit(1)
+
+    return extn
+
+
+def wait_for_extension(driver, extn):
+    """Wait for the extension to load and get past its first-run page"""
+
+    time.sleep(2)  # wait for extension to load
+    if extn == "adguard":
+        time.sleep(10)
+
+    if extn == "adblock":
+        time.sleep(15)
+    elif extn == "ghostery":
+        windows = driver.window_handles
+        for window in windows:
+            try:
+                driver.switch_to.window(window)
+                url_start = driver.current_url[:16]
+                if url_start == "chrome-extension":
+                    element = driver.find_element(
+                        By.XPATH, "//ui-button[@type='success']"
+                    )
+                    element.click()
+                    time.sleep(2)
+                    break
+            except Exception as e:
+                continue
+
+
+def setup_extension(driver, extn, filterlists):
+    """Configure the filterlists of the extension"""
+
+    if extn == "adguard":
+        adblocker_id = common.get_extension_id(driver)
+        print(adblocker_id)
+        adguard.setup(driver, adblocker_id, filterlists)
+        print("Loaded AdGuard with", filterlists)
+
+    elif extn == "ublock":
+        adblocker_id = common.get_extension_id(driver)
+        ublock.setup(driver, adblocker_id, filterlists)
+        print("Loaded uBlock with", filterlists)
+
+
+def is_measured(fname, extension, filterlists_str, trial=None):
+    """Check if the site was already measured with the configuration (in the trial)"""
+
+    if not os.path.isfile(fname):
+        return False
+
+    with open(fname, "r") as f:
+        data = json.loads(f.read())
+
+    stats = data["stats"]
+    if trial is not None:
+        stats = data.get("trials", {}).get(str(trial), {})
+
+    if extension:
+        return extension in stats and filterlists_str in stats[extension]
+
+    return fname in stats
+
+
+def save_stats(fname, extn, filterlists_str, stat_data, trial=None):
+    """
+    Add the measurement of a configuration to the data file of the site
+
+    The measurements of repeated trials are kept under "trials", by trial
+    number, and the first trial is also kept under "stats" as a single run.
+    """
+
+    if os.path.isfile(fname):
+        f = open(fname, "r")
+        data = json.loads(f.read())
+        f.close()
+    else:
+        # open the /data/website file and create the dict
+        data = {}
+        data["stats"] = {}
+
+    print("-" * 25)
+    print(fname)
+    print(extn)
+    print("-" * 25)
+
+    if trial is None or trial == 0:
+        data["stats"][extn] = data["stats"].get(extn, {})
+        data["stats"][extn][filterlists_str] = stat_data
+
+    if trial is not None:
+        trial_stats = data.setdefault("trials", {}).setdefault(str(trial), {})
+        trial_stats.setdefault(extn, {})[filterlists_str] = stat_data
+
+    f = open(fname, "w")
+    json_obj = json.dumps(data)
+    f.write(json_obj)
+    f.close()
+
+
+def main(number_of_tries, flag, filterlists_str, args_lst, trial=None):
+
+    # Filterlists
+    filterlists = (
+        get_filterlists(args_lst[-1], filterlists_str) if len(args_lst) == 4 else None
+    )
+
+    # skip if exists but repeat if adguard
+    fname = "/data/" + args_lst[0].split("//")[1]
+
+    if args_lst[-1] != "adguard":
+        if is_measured(fname, args_lst[-1], filterlists_str, trial):
+            print(f"Skipping {args_lst[0]} with {args_lst[-1]} and {filterlists_str}")
+            return
+
+    # Start X
+    # vdisplay = Display(visible=False, size=(1920, 1080))
+
+    # cpu = int(args_lst[2])
+
+    # port = 5907 + cpu
+    # vdisplay = Display(visible=True, size=(1920, 1080), backend='xvnc', rfbport=port)
+
+    # vdisplay.start()
+
+    # Prepare Chrome
+    options = chrome_options()
+
     if flag == 1:
         driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(args_lst[1])
@@ -141,79 +265,46 @@ def main(number_of_tries, flag, filterlists_str, args_lst):
             else:
                 driver.quit()
                 # vdisplay.stop()
-                return main(number_of_tries - 1, flag, filterlists_str, args_lst)
+                return main(
+                    number_of_tries - 1, flag, filterlists_str, args_lst, trial
+                )
 
         driver.quit()
         # vdisplay.stop()
 
     else:
         # Install other addons
-        extensions_path = pathlib.Path("/home/seluser/measure/extensions/extn_crx")
         print(args_lst)
         fname = "/data/" + args_lst[0].split("//")[1]
         extn = fname
         if args_lst[-1] != "":
-            for extension in args_lst[-1].split(","):
-                matches = list(extensions_path.glob("{}*.crx".format(extension)))
-                if matches and len(matches) == 1:
-                    options.add_extension(str(matches[0]))
-                    extn = extension
-                else:
-                    print(f"{args_lst[-1]} - Extension not found")
-                    sys.exit(1)
+            extn = add_extensions(options, args_lst[-1])
         # Launch Chrome and install our extension for getting HARs
         driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(args_lst[1])
 
         # Start perf timer
         # perf = perfevents.PerfEvents(args.timeout)
-        stat = stats.Stats(args_lst[1] + 10, fname, args_lst[2])
+        stat = stats.Stats(
+            args_lst[1] + 10, fname, args_lst[2], root_pid=driver.service.process.pid
+        )
         # We need to wait for everything to open up properly
 
-        time.sleep(2)  # wait for extension to load
-        if extn == "adguard":
-            time.sleep(10)
-
-        if extn == "adblock":
-            time.sleep(15)
-        elif extn == "ghostery":
-            windows = driver.window_handles
-            for window in windows:
-                try:
-                    driver.switch_to.window(window)
-                    url_start = driver.current_url[:16]
-                    if url_start == "chrome-extension":
-                        element = driver.find_element(
-                            By.XPATH, "//ui-button[@type='success']"
-                        )
-                        element.click()
-                        time.sleep(2)
-                        break
-                except Exception as e:
-                    continue
+        wait_for_extension(driver, extn)
 
         try:
 
-            if args_lst[-1] == "adguard":
-                adblocker_id = common.get_extension_id(driver)
-                print(adblocker_id)
-                adguard.setup(driver, adblocker_id, filterlists)
-                print("Loaded AdGuard with", filterlists)
-
-            elif args_lst[-1] == "ublock":
-                adblocker_id = common.get_extension_id(driver)
-                ublock.setup(driver, adblocker_id, filterlists)
-                print("Loaded uBlock with", filterlists)
+            setup_extension(driver, extn, filterlists)
 
             # if we loaded an extension we need to open a site for the first-time logic to happen
-            driver.get("https://saiid.ch")
+            driver.get(WARMUP_URL)
             wait_until_loaded(driver, args_lst[1])
 
             time.sleep(2)
 
             # Make a page load
             stat.start()
-            time.sleep(2)  # to record 2 extra mpstat cycle
+            time.sleep(2)  # to record 2 seconds of idle load
             # started = datetime.now()
             driver.get(args_lst[0])
 
@@ -235,83 +326,528 @@ def main(number_of_tries, flag, filterlists_str, args_lst):
             else:
                 driver.quit()
                 # vdisplay.stop()
-                return main(number_of_tries - 1, flag, filterlists_str, args_lst)
+                return main(
+                    number_of_tries - 1, flag, filterlists_str, args_lst, trial
+                )
 
-        if os.path.isfile(fname):
-            f = open(fname, "r")
-            data = json.loads(f.read())
-            f.close()
-        else:
-            # open the /data/website file and create the dict
-            data = {}
-            data["stats"] = {}
+        save_stats(fname, extn, filterlists_str, stat_data, trial)
 
-        print("-" * 25)
-        print(fname)
-        print(extn)
-        print("-" * 25)
+        driver.quit()
+        # vdisplay.stop()
 
-        data["stats"][extn] = data["stats"].get(extn, {})
-        data["stats"][extn][filterlists_str] = stat_data
+        time.sleep(3)
 
-        f = open(fname, "w")
-        json_obj = json.dumps(data)
-        f.write(json_obj)
-        f.close()
 
-        driver.quit()
-        # vdisplay.stop()
+def profile_name(extn, filterlists_str):
+    return "{}-{}".format(extn or "control", filterlists_str)
+
+
+def build_profile(extn, filterlists_str, timeout):
+    """
+    Configure the extension once and save the Chrome profile for reuse
+
+    Profiles are shared by the workers through the /profiles volume. The first
+    worker to need a profile builds it, the others wait on the lock and reuse it.
+    """
+
+    profile = PROFILES_PATH / profile_name(extn, filterlists_str)
+    configured = profile / ".configured"
+
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+
+    with open(PROFILES_PATH / (profile.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if configured.exists():
+            return profile
+
+        tmp_profile = PROFILES_PATH / (profile.name + ".tmp")
+        shutil.rmtree(tmp_profile, ignore_errors=True)
+
+        options = chrome_options()
+        options.add_argument("--user-data-dir={}".format(tmp_profile))
+        if extn:
+            add_extensions(options, extn)
+
+        driver = webdriver.Chrome(options=options)
+        driver.set_page_load_timeout(timeout)
+
+        try:
+            wait_for_extension(driver, extn)
+            setup_extension(driver, extn, get_filterlists(extn, filterlists_str))
+
+            # first-time logic of the extension
+            driver.get(WARMUP_URL)
+            wait_until_loaded(driver, timeout)
+            time.sleep(2)
+        finally:
+            driver.quit()
+
+        shutil.rmtree(profile, ignore_errors=True)
+        tmp_profile.rename(profile)
+        configured.touch()
+
+    return profile
+
+
+def copy_profile(profile, cpu):
+    """Private copy of a saved profile, for one browser session"""
+
+    session_profile = pathlib.Path("/tmp") / "profile-{}-{}".format(cpu, profile.name)
+    shutil.rmtree(session_profile, ignore_errors=True)
+    shutil.copytree(profile, session_profile)
+
+    # locks of the browser that saved the profile
+    for lock in session_profile.glob("Singleton*"):
+        lock.unlink()
+
+    return session_profile
+
+
+# origins of the page and of the resources and frames it loaded
+ORIGINS_SCRIPT = """
+return [location.href]
+    .concat(performance.getEntriesByType('resource').map(entry => entry.name))
+    .map(url => new URL(url).origin)
+    .filter(origin => origin.startsWith('http'));
+"""
+
+
+def site_origin(site):
+    url = urllib.parse.urlsplit(site)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def visited_origins(driver):
+    """Origins the loaded page may have stored data for, third parties included"""
+
+    origins = set(driver.execute_script(ORIGINS_SCRIPT))
+    for cookie in driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]:
+        domain = cookie["domain"].lstrip(".")
+        origins.update({"http://" + domain, "https://" + domain})
+
+    return origins
+
+
+def clear_browsing_data(driver, origins):
+    """Clear the cache, the cookies and the storage of the origins visited so far"""
+
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in sorted(origins):
+        driver.execute_cdp_cmd(
+            "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"}
+        )
+
+
+def start_session(extn, filterlists_str, timeout, cpu, offline=False):
+    """Launch Chrome on a copy of the saved profile of the configuration"""
+
+    profile = build_profile(extn, filterlists_str, timeout)
+    session_profile = copy_profile(profile, cpu)
+
+    options = chrome_options()
+    options.add_argument("--user-data-dir={}".format(session_profile))
+    if offline:
+        for argument in replay.chrome_arguments(cpu):
+            options.add_argument(argument)
+    if extn:
+        add_extensions(options, extn)
+
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(timeout)
+
+    # let the extension load its saved configuration
+    time.sleep(2)
+    if extn == "adguard":
+        time.sleep(10)
+
+    return driver, session_profile
+
+
+def measure_site(driver, site, fname, timeout, cpu, origins=None):
+    """
+    Measure a page load in a new tab of a running session
+
+    The cache, the cookies and the storage of every origin in `origins` are
+    cleared right before the measurement, and the origins visited by the load
+    are added to it, for the next sites of the session.
+    """
+
+    if origins is None:
+        origins = set()
+    origins.add(site_origin(site))
+
+    base_window = driver.current_window_handle
+
+    driver.switch_to.new_window("tab")
+
+    try:
+        clear_browsing_data(driver, origins)
+
+        # Start perf timer
+        stat = stats.Stats(
+            timeout + 10, fname, cpu, root_pid=driver.service.process.pid
+        )
+
+        stat.start()
+        time.sleep(2)  # to record 2 seconds of idle load
+        driver.get(site)
+
+        wait_until_loaded(driver, timeout)
+
+        # Stop collecting performance data
+        stat_data = stat.stop()
+
+        # collect webstats
+        domComplete, loadEnd = webStats(driver)
+        stat_data["webStats"] = [domComplete, loadEnd]
+
+        origins.update(visited_origins(driver))
+
+    finally:
+        driver.close()
+        driver.switch_to.window(base_window)
+
+    return stat_data
+
+
+def calibrate_sites(sites, timeout, cpu, offline=False, loads=3):
+    """
+    Load each site a few times in a throwaway browser without extension, before
+    any configuration is measured, as the calibration of `main`
+    """
+
+    options = chrome_options()
+    if offline:
+        for argument in replay.chrome_arguments(cpu):
+            options.add_argument(argument)
+
+    driver = None
+
+    # a failed calibration is not a failed measurement
+    try:
+        driver = webdriver.Chrome(options=options)
+        driver.set_page_load_timeout(timeout)
+
+        for site in sites:
+            if offline and not replay.archive_path(site).is_file():
+                continue
+
+            server = (
+                replay.WebPageReplay("replay", replay.archive_path(site), cpu)
+                if offline
+                else contextlib.nullcontext()
+            )
+
+            try:
+                with server:
+                    for i in range(loads):
+                        driver.get(site)
+                        wait_until_loaded(driver, timeout)
+
+            except Exception as e:
+                print(e, "SITE: ", site)
+
+    except Exception as e:
+        print(e, "calibration")
+
+    finally:
+        if driver is not None:
+            driver.quit()
+
+
+def measure_session(
+    sites, extn, filterlists_str, timeout, cpu, offline=False, trial=None
+):
+    """
+    Measure many sites with a single browser session of a configuration
+
+    Args:
+        sites: list of URLs
+        extn: extension name, empty string for the control
+        filterlists_str: filterlist tier (default, mid, all)
+        timeout: page load timeout
+        cpu: CPU the container is pinned to
+        offline: serve the sites from their recorded archive
+        trial: number of the trial, for repeated measurements
+
+    Returns:
+        failed: sites that could not be measured
+    """
+
+    sites = [
+        site
+        for site in sites
+        if extn == "adguard"
+        or not is_measured(
+            "/data/" + site.split("//")[1], extn, filterlists_str, trial
+        )
+    ]
+
+    failed = []
+
+    if offline:
+        failed = [site for site in sites if not replay.archive_path(site).is_file()]
+        for site in failed:
+            print(f"No archive for {site}, record it first")
+
+        sites = [site for site in sites if site not in failed]
+
+    if not sites:
+        return failed
+
+    driver = session_profile = None
+    # origins to clear before each site, they may outlive a browser restart
+    origins = set()
+
+    for site in sites:
+        fname = "/data/" + site.split("//")[1]
+
+        for number_of_tries in range(3, -1, -1):
+            try:
+                if driver is None:
+                    driver, session_profile = start_session(
+                        extn, filterlists_str, timeout, cpu, offline
+                    )
+
+                if offline:
+                    with replay.WebPageReplay(
+                        "replay", replay.archive_path(site), cpu
+                    ):
+                        stat_data = measure_site(
+                            driver, site, fname, timeout, cpu, origins
+                        )
+                else:
+                    stat_data = measure_site(
+                        driver, site, fname, timeout, cpu, origins
+                    )
+                break
+
+            except Exception as e:
+                print(e, "SITE: ", site)
+                print(traceback.format_exc())
+
+                # restart the browser, its state is unknown
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                driver = None
+        else:
+            failed.append(site)
+            continue
+
+        save_stats(fname, extn or fname, filterlists_str, stat_data, trial)
 
         time.sleep(3)
 
+    if driver is not None:
+        driver.quit()
+
+    if session_profile is not None:
+        shutil.rmtree(session_profile, ignore_errors=True)
+
+    return failed
+
+
+def configuration_order(interleaved=False):
+    """
+    Order of the (extension, filterlist tier) configurations of a round
+
+    The control comes first, then each extension with its tiers in random
+    order. Interleaved rounds shuffle all the configurations, control
+    included, so that the drift of the machine does not favor any of them.
+    """
+
+    configurations = [("", "default")]
+
+    for extn in ["adguard", "ublock"]:
+
+        options = ["default", "mid", "all"]
+        random.shuffle(options)
+
+        configurations += [(extn, filterlist_str) for filterlist_str in options]
+
+    if interleaved:
+        random.shuffle(configurations)
+
+    return configurations
+
+
+def record_site(site, timeout, cpu):
+    """
+    Record the responses of a page load of the site to its archive
+
+    The site is loaded without extension, all the requests of the control are
+    then served when measuring offline.
+
+    Returns:
+        recorded: False if the site could not be recorded
+    """
+
+    archive = replay.archive_path(site)
+
+    if archive.is_file():
+        print(f"Skipping {site}, already recorded")
+        return True
+
+    for number_of_tries in range(3, -1, -1):
+        options = chrome_options()
+        for argument in replay.chrome_arguments(cpu):
+            options.add_argument(argument)
+
+        driver = None
+
+        try:
+            with replay.WebPageReplay("record", archive, cpu):
+                driver = webdriver.Chrome(options=options)
+                driver.set_page_load_timeout(timeout)
+
+                driver.get(site)
+                wait_until_loaded(driver, timeout)
+
+                # requests made after the load event
+                time.sleep(5)
+
+                driver.quit()
+                driver = None
+
+            return True
+
+        except Exception as e:
+            print(e, "SITE: ", site)
+            print(traceback.format_exc())
+
+            if driver is not None:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+
+            # partial recording
+            archive.unlink(missing_ok=True)
+
+    return False
+
 
 if __name__ == "__main__":
     # Parse the command line arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("website")
+    parser.add_argument("website", nargs="+")
     parser.add_argument("--timeout", type=int, default=60)
     # parser.add_argument('--extensions')
     parser.add_argument("--extensions-wait", type=int, default=10)
     parser.add_argument("--cpu")
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="measure all the websites in one browser session per configuration",
+    )
+    parser.add_argument(
+        "--repetitions",
+        type=int,
+        default=1,
+        help="measure each configuration in this many interleaved trials",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=stats.INTERVAL,
+        help="CPU load sampling period in seconds (0.05 to 0.1 for short loads)",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="record the responses of the websites to archives, without measuring",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="measure the websites offline from their archives, in sessions",
+    )
     args = parser.parse_args()
 
-    args_lst = [args.website, args.timeout, args.cpu]
+    cpu = int(args.cpu)
 
-    cpu = int(args_lst[2])
+    if args.sample_interval <= 0:
+        parser.error("--sample-interval must be positive")
+    stats.INTERVAL = args.sample_interval
+
+    if args.record or args.replay:
+        try:
+            replay.check_installed()
+        except RuntimeError as e:
+            sys.exit(str(e))
+
+    # with a spare CPU in the container (see cpu_wrapper --sampler-cpu), the
+    # browser runs on the measured CPU and the samplers of stats.Stats on the other
+    if len(os.sched_getaffinity(0)) > 1:
+        os.sched_setaffinity(0, {cpu})
 
     port = 5907 + cpu
     vdisplay = Display(visible=True, size=(1920, 1080), backend="xvnc", rfbport=port)
 
     vdisplay.start()
 
-    # # calibrate
-    for i in range(3):
-        main(3, 1, None, args_lst)
-
-    main(
-        3,
-        0,
-        "default",
-        args_lst
-        + [
-            "",
-        ],
-    )
+    if args.record:
+        failed = [
+            website
+            for website in args.website
+            if not record_site(website, args.timeout, args.cpu)
+        ]
+
+        vdisplay.stop()
+        sys.exit(1 if failed else 0)
+
+    # with repetitions, each trial is a round over all the configurations
+    trials = [None] if args.repetitions == 1 else list(range(args.repetitions))
+
+    if args.session or args.replay:
+        failed = set()
+
+        # calibrate once per site, every configuration is then measured alike
+        calibrate_sites(args.website, args.timeout, args.cpu, offline=args.replay)
+
+        for trial in trials:
+            for extn, filterlist_str in configuration_order(trial is not None):
+                failed.update(
+                    measure_session(
+                        args.website,
+                        extn,
+                        filterlist_str,
+                        args.timeout,
+                        args.cpu,
+                        offline=args.replay,
+                        trial=trial,
+                    )
+                )
 
-    for extn in ["adguard", "ublock"]:
+        vdisplay.stop()
 
-        options = ["default", "mid", "all"]
-        random.shuffle(options)
+        # let the wrapper retry the failed sites
+        sys.exit(1 if failed else 0)
 
-        for filterlist_str in options:
-            main(
-                3,
-                0,
-                filterlist_str,
-                args_lst
-                + [
-                    extn,
-                ],
-            )
+    for website in args.website:
+
+        args_lst = [website, args.timeout, args.cpu]
+
+        # # calibrate
+        for i in range(3):
+            main(3, 1, None, args_lst)
+
+        for trial in trials:
+            for extn, filterlist_str in configuration_order(trial is not None):
+                main(
+                    3,
+                    0,
+                    filterlist_str,
+                    args_lst
+                    + [
+                        extn,
+                    ],
+                    trial,
+                )
 
     vdisplay.stop()
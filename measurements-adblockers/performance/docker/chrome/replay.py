@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import functools
+import hashlib
+import os
+import pathlib
+import signal
+import socket
+import subprocess
+import time
+
+WPR_PATH = "/usr/local/bin/wpr"
+WPR_DIR = pathlib.Path("/home/seluser/measure/wpr")
+
+ARCHIVES_PATH = pathlib.Path("/archives")
+
+# containers share the host network, each CPU gets its own ports
+HTTP_PORT = 18000
+HTTPS_PORT = 19000
+
+
+def check_installed():
+    """Raise if the image was built without Web Page Replay"""
+
+    if not os.access(WPR_PATH, os.X_OK):
+        raise RuntimeError(
+            "wpr not installed: build the image with CATAPULT_COMMIT set "
+            "(see performance/docker/chrome/wpr.commit) to record or replay"
+        )
+
+
+def archive_path(site):
+    return ARCHIVES_PATH / (site.split("//")[1].replace("/", "_") + ".wprgo")
+
+
+@functools.lru_cache()
+def spki_hash(cert_file=WPR_DIR / "wpr_cert.pem"):
+    """Base64 SHA-256 of the public key of the certificate, for Chrome to trust it"""
+
+    pubkey = subprocess.run(
+        ["openssl", "x509", "-noout", "-pubkey", "-in", str(cert_file)],
+        capture_output=True,
+        check=True,
+    ).stdout
+    der = subprocess.run(
+        ["openssl", "pkey", "-pubin", "-outform", "der"],
+        input=pubkey,
+        capture_output=True,
+        check=True,
+    ).stdout
+
+    return base64.b64encode(hashlib.sha256(der).digest()).decode()
+
+
+def chrome_arguments(cpu):
+    """Chrome arguments sending all the traffic to the replay server of the CPU"""
+
+    http_port = HTTP_PORT + int(cpu)
+    https_port = HTTPS_PORT + int(cpu)
+
+    return [
+        f"--host-resolver-rules=MAP *:80 127.0.0.1:{http_port},"
+        f"MAP *:443 127.0.0.1:{https_port},EXCLUDE localhost",
+        f"--ignore-certificate-errors-spki-list={spki_hash()}",
+    ]
+
+
+class WebPageReplay:
+    """
+    Web Page Replay server, recording the responses of a site to an archive or
+    serving them back
+
+    In replay mode, the requests missing from the archive get a 404 and the
+    JavaScript clock and random numbers are made deterministic, so that every
+    load of the site runs on the same bytes.
+    """
+
+    def __init__(self, mode, archive, cpu):
+        """
+        Args:
+            mode: "record" or "replay"
+            archive: path to the archive
+            cpu: CPU of the container, for the ports
+        """
+
+        self._mode = mode
+        self._archive = pathlib.Path(archive)
+        self._http_port = HTTP_PORT + int(cpu)
+        self._https_port = HTTPS_PORT + int(cpu)
+        self.process = None
+
+    def start(self, timeout=30):
+        check_installed()
+
+        if self._mode == "replay" and not self._archive.is_file():
+            raise FileNotFoundError(f"No archive {self._archive}")
+
+        self._archive.parent.mkdir(parents=True, exist_ok=True)
+
+        cmd = [
+            WPR_PATH,
+            self._mode,
+            f"--http_port={self._http_port}",
+            f"--https_port={self._https_port}",
+            f"--https_cert_file={WPR_DIR / 'wpr_cert.pem'}",
+            f"--https_key_file={WPR_DIR / 'wpr_key.pem'}",
+            f"--inject_scripts={WPR_DIR / 'deterministic.js'}",
+            str(self._archive),
+        ]
+        self.process = subprocess.Popen(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        # wait for the server to listen
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"wpr {self._mode} exited for {self._archive}")
+            try:
+                with socket.create_connection(("127.0.0.1", self._https_port), 1):
+                    return self
+            except OSError:
+                time.sleep(0.25)
+
+        self.stop()
+        raise TimeoutError(f"wpr {self._mode} did not start for {self._archive}")
+
+    def stop(self, timeout=60):
+        if self.process is None or self.process.poll() is not None:
+            return
+
+        # the archive is written when the recording is interrupted
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
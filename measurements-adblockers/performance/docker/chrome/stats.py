@@ -1,106 +1,249 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import collections
-import csv
-import io
 import os
-import signal
-import subprocess
 import threading
-import json
 import time
-import hashlib
-import random 
 
-class PerfEventsCSVDialect(csv.Dialect):
-    delimiter = ' '
-    lineterminator = '\n'
-    quoting = csv.QUOTE_NONE
-    skipinitialspace = True
+# default sampling period, in seconds (cpu.py --sample-interval). /proc/stat
+# counts in 1 / CLK_TCK seconds (usually 10 ms), so the CPU load of a period is
+# known within 100 / (CLK_TCK * INTERVAL) percent: 1% at 1 second, as the 1 second
+# cycles of mpstat, 10% at 100 ms. The CPU time of the browser (proc_cpu) is
+# counted in the same ticks, whatever the period
+INTERVAL = 1.0
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# CPUs of the container, before the measuring process pins itself to one
+ALLOWED_CPUS = os.sched_getaffinity(0)
+
+
+def read_cpu_times(cpu=None):
+    """
+    Read the jiffies spent by a CPU in each mode from /proc/stat
+
+    Returns:
+        times: (user, nice, system, idle, iowait, irq, softirq, steal, guest, guest_nice)
+    """
+
+    name = "cpu" if cpu is None else f"cpu{cpu}"
+
+    with open("/proc/stat", "r") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] == name:
+                times = [int(v) for v in fields[1:11]]
+                return times + [0] * (10 - len(times))
+
+    raise ValueError(f"CPU {cpu} not found in /proc/stat")
+
+
+def read_process(pid):
+    """
+    Read the parent, name, CPU time (seconds) and RSS (MB) of a process from /proc/<pid>/stat
+
+    Returns None if the process exited.
+    """
+
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # the name is between parentheses and can contain spaces
+    comm = stat[stat.index("(") + 1 : stat.rindex(")")]
+    fields = stat[stat.rindex(")") + 2 :].split()
+
+    ppid = int(fields[1])
+    cpu_time = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    rss = int(fields[21]) * PAGE_SIZE / 1e6
+
+    return ppid, comm, cpu_time, rss
+
+
+def process_tree(root_pid=None, name="chrome"):
+    """
+    Read the processes of the measured browser
+
+    Args:
+        root_pid: the descendants of this process are measured. The processes
+            named `name` are measured if None
+        name: prefix of the process names, when root_pid is None
+
+    Returns:
+        processes: {pid: (comm, cpu time, rss)}
+    """
+
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            process = read_process(int(entry))
+            if process is not None:
+                processes[int(entry)] = process
+
+    if root_pid is None:
+        return {
+            pid: (comm, cpu_time, rss)
+            for pid, (ppid, comm, cpu_time, rss) in processes.items()
+            if comm.startswith(name)
+        }
+
+    children = {}
+    for pid, (ppid, *_) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+
+    tree = {}
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        ppid, comm, cpu_time, rss = processes[pid]
+        tree[pid] = (comm, cpu_time, rss)
+        stack.extend(children.get(pid, []))
+
+    return tree
+
 
 class Stats(threading.Thread):
-    def __init__(self, timeout, filename, cpu):
+    """
+    Sample the load of a CPU and the resources of the browser processes
+
+    The readings have the fields of `mpstat -P <cpu>`: usr, sys and iowait, the
+    percentage of each period spent by the CPU in each mode. They are completed
+    with the CPU time (seconds) and RSS (MB) of the browser processes, as series
+    over the whole tree and as totals per process.
+
+    The sampling thread runs on the other CPUs of the container if it has any, so
+    that scanning /proc does not load the measured CPU.
+
+    A last reading is taken when the sampling stops, over the part of the period
+    elapsed since the previous one: its proc_cpu is scaled to a whole period and
+    `last_period` holds the elapsed fraction, to weight it.
+    """
+
+    def __init__(self, timeout, filename, cpu, interval=None, root_pid=None):
+        """
+        Args:
+            timeout: maximum duration of the sampling, in seconds
+            filename: name of the measurement, for the logs
+            cpu: CPU to sample, all the CPUs if None
+            interval: sampling period, in seconds, INTERVAL if None
+            root_pid: the descendants of this process are the browser, the
+                processes named chrome if None
+        """
+
         self._timeout = timeout
         self._fname = filename
         self._cpu = cpu
-        self._json_file = '/tmp/' + hashlib.md5(str(random.random()).encode()).hexdigest() + ".json"
-        self._open_file()
-        threading.Thread.__init__(self)
-    
-    def _open_file(self):
-        self._f = open(self._json_file, "w")
+        self._interval = INTERVAL if interval is None else interval
+        self._root_pid = root_pid
+        self._stop_event = threading.Event()
+
+        self._cpu_usr = []
+        self._cpu_sys = []
+        self._cpu_iowait = []
+        self._proc_cpu = []
+        self._proc_rss = []
+        self._processes = {}
+        self._last_period = 1.0
+
+        threading.Thread.__init__(self, daemon=True)
+
+    def _sample_processes(self):
+        tree = process_tree(self._root_pid)
+
+        for pid, (comm, cpu_time, rss) in tree.items():
+            first_cpu_time, _, _, rss_max = self._processes.get(
+                pid, (cpu_time, comm, cpu_time, 0)
+            )
+            self._processes[pid] = (first_cpu_time, comm, cpu_time, max(rss_max, rss))
+
+        return sum(cpu_time for _, cpu_time, _ in tree.values()), sum(
+            rss for _, _, rss in tree.values()
+        )
 
     def run(self):
         try:
-            cmd = ["mpstat", "-P", self._cpu, "1", f"{self._timeout + 1}",
-                   "-o", "JSON"]
-            self.process = subprocess.Popen(cmd, universal_newlines=True,
-                                            stdout=self._f,
-                                            stderr=subprocess.DEVNULL)
-            self.pid = self.process.pid
-            # self.process.wait()
-        except subprocess.CalledProcessError as e:
+            others = ALLOWED_CPUS - {int(self._cpu)} if self._cpu is not None else set()
+            if others:
+                # only moves this thread
+                os.sched_setaffinity(0, others)
+
+            previous = read_cpu_times(self._cpu)
+            previous_proc_cpu, _ = self._sample_processes()
+
+            start_time = time.monotonic()
+            deadline = start_time + self._timeout
+            next_sample = start_time + self._interval
+
+            # periods are scheduled from the start, so they do not drift
+            while True:
+                stopped = self._stop_event.wait(max(next_sample - time.monotonic(), 0))
+
+                # fraction of the period elapsed when stopped between two samples
+                period = 1.0
+                if stopped:
+                    elapsed = time.monotonic() - (next_sample - self._interval)
+                    period = min(max(elapsed / self._interval, 0.0), 1.0)
+
+                current = read_cpu_times(self._cpu)
+                proc_cpu, proc_rss = self._sample_processes()
+
+                delta = [c - p for c, p in zip(current, previous)]
+                user, nice, system, idle, iowait, irq, softirq, steal, guest, _ = delta
+                # guest time is already counted in user time
+                total = sum(delta[:8])
+
+                # no tick elapsed since the previous sample, nothing to read
+                if stopped and (total == 0 or period == 0):
+                    break
+
+                total = total or 1
+
+                self._cpu_usr.append(round(100 * (user - guest) / total, 2))
+                self._cpu_sys.append(round(100 * system / total, 2))
+                self._cpu_iowait.append(round(100 * iowait / total, 2))
+                self._proc_cpu.append(round((proc_cpu - previous_proc_cpu) / period, 3))
+                self._proc_rss.append(round(proc_rss, 3))
+
+                if stopped:
+                    self._last_period = max(round(period, 3), 0.001)
+                    break
+
+                previous = current
+                previous_proc_cpu = proc_cpu
+
+                next_sample += self._interval
+                if next_sample > deadline:
+                    print(f"{self._fname}: sampling timeout after {self._timeout} seconds")
+                    break
+
+        except Exception as e:
             print(f"Error collecting performance events: {e}")
 
     def stop(self):
-        try:
-            # sleep for 5 cycles for mpstat to cool down
-            time.sleep(5)
-            # Grep process id of sleep
-            # cmd = ["pgrep", "-P", f"{self.process.pid}"]
-            # run = subprocess.run(cmd,
-                                #  stdout=subprocess.PIPE,
-                                #  stderr=subprocess.DEVNULL)
-            # pid_str = run.stdout.strip().decode('utf-8')
-            # print(f"pid_str: {pid_str}")
-            # if self.pid == "":
-            #     pid = 0
-            # else:
-            #     pid = int(pid_str)
-
-            os.kill(self.pid, signal.SIGTERM)
-            os.kill(self.pid, signal.SIGKILL)
-        except Exception as e:
-            print(e)
-            print("timeout happened")
-        # except subprocess.CalledProcessError as e:
-        #     log.error(f"Error stopping performance event mpstat 1 timeout: {e}")
-
-        # self.process.wait()
-        if self._f.closed <= 0:
-            self._f.close()
+        self._stop_event.set()
+        self.join()
+
         return self.parse()
 
     def parse(self):
-        # Parse performance data
-        try:
-            f = open(self._json_file, "r")
-            #print(f.read())
-            read_data = f.read()
-            data = json.loads(read_data)
-        except json.JSONDecodeError as je:
-            read_data += ']}]}}'
-            data = json.loads(read_data)
-        except Exception as e:
-            print("Error:", e)
-            #f.close()
-            return -1
-        
-        if f.closed <= 0:
-            f.close()
-        
-        cpu_usr = []
-        cpu_sys = []
-        cpu_iowait = []
-        for readings in data["sysstat"]["hosts"][0]["statistics"]:
-            cpu_usr.append(readings["cpu-load"][0]["usr"])
-            cpu_sys.append(readings["cpu-load"][0]["sys"])
-            cpu_iowait.append(readings["cpu-load"][0]["iowait"])
-        
         readings_dict = {}
-        readings_dict['usr'] = cpu_usr
-        readings_dict['sys'] = cpu_sys
-        readings_dict['iowait'] = cpu_iowait
-                
+        readings_dict["usr"] = self._cpu_usr
+        readings_dict["sys"] = self._cpu_sys
+        readings_dict["iowait"] = self._cpu_iowait
+        readings_dict["proc_cpu"] = self._proc_cpu
+        readings_dict["proc_rss"] = self._proc_rss
+        readings_dict["processes"] = {
+            str(pid): {
+                "comm": comm,
+                "cpu_time": round(cpu_time - first_cpu_time, 3),
+                "rss_max": round(rss_max, 3),
+            }
+            for pid, (first_cpu_time, comm, cpu_time, rss_max) in self._processes.items()
+        }
+        readings_dict["interval"] = self._interval
+        readings_dict["last_period"] = self._last_period
+
         return readings_dict
@@ -188,11 +188,11 @@ def main(number_of_tries, flag, filterlists_str, args_lst):
             ublock_id = common.get_extension_id(driver)
             ublock.setup(driver, ublock_id, lists)
             
-        stat = stats.Stats(args_lst[1]+10, fname, args_lst[2])
+        stat = stats.Stats(args_lst[1]+10, fname, args_lst[2], root_pid=driver.service.process.pid)
         
         # Make a page load
         stat.start()
-        time.sleep(2) # to record 2 extra mpstat cycle
+        time.sleep(2) # to record 2 seconds of idle load
         # started = datetime.now()
         
         driver.get(args_lst[0])
@@ -36,225 +36,233 @@ def wait_until_loaded(webdriver, timeout=60, period=0.25, min_time=0):
     return False
 
 
-def image_alt_stats(driver):
-    """Get the image alt stats."""
-
-    script = """
-    // get the count of images with an alt attribute where the :before is styled with background-image
-    var images = document.querySelectorAll('img[alt]:not([alt=""])');
-    var matches = []
-    for (var i = 0; i < images.length; i++) {
-        var image = images[i];
-        var style = window.getComputedStyle(image, ':before');
-        if (style.getPropertyValue('background') !== 'none' || style.getPropertyValue('background-image') !== 'none') {
-            matches.push({
-                'src': image.src, 
-                'alt': image.alt,
-                'style': {
-                    'background': style.getPropertyValue('background')? style.getPropertyValue('background'): style.getPropertyValue('background-image'),
-                }
-            })
-        }
-    }
-    return {
-        'count': {
-            'total': images.length,
-            'withAlt': document.querySelectorAll('img[alt]:not([alt=""])').length,
-            'matches': matches.length
-        },
-        'matches': matches
-    }
-    """
+# "background" of elements without a background
+NO_BACKGROUND = "rgba(0, 0, 0, 0) none repeat scroll 0% 0% / auto padding-box border-box"
 
-    return driver.execute_script(script)
+# installed at the start of the documents, the messages are logged from the
+# start of the page (the first crawls logged them from 2 seconds after the load)
+API_OVERRIDE = """
+(function() {
 
+    // as in the first crawls, only the top document is logged
+    if (window !== window.top || window.POST_MESSAGE_LOG) return;
 
-def api_override(driver):
-    """Override the postMessage and addEventListener functions to log messages."""
-
-    # override postMessage to log messages
-
-    script = """
-    
-    //on window ready add this
-    (function() {
-        
-        if (window.POST_MESSAGE_LOG) return;
-        
-        window.POST_MESSAGE_LOG = [];
-        window.LISTEN_MESSAGE_LOG = [];
-        var originalPostMessage = window.postMessage;
-        var patchedPostMessage = function(message, targetOrigin=undefined, transfer=undefined, options=undefined) {
-            
-            originalPostMessage(message, targetOrigin, transfer, options);
-            
-            window.POST_MESSAGE_LOG.push({
-                'callstack': (new Error()).stack,
-                'targetOrigin': targetOrigin? targetOrigin: options? options.origin? `${options.origin}`: '*': '*',
-            });
-        };
-        window.postMessage = patchedPostMessage;
-        
-        window.addEventListener('message', function(event) {
-            window.LISTEN_MESSAGE_LOG.push({
-                'origin': `${event.origin}`,
-                'source': `${event.source}`,
-            });
+    window.POST_MESSAGE_LOG = [];
+    window.LISTEN_MESSAGE_LOG = [];
+    var originalPostMessage = window.postMessage;
+    var patchedPostMessage = function(message, targetOrigin) {
+
+        // (message, targetOrigin, transfer) or (message, {targetOrigin, transfer})
+        var result = originalPostMessage.apply(window, arguments);
+
+        var origin = (targetOrigin && typeof targetOrigin === 'object') ? targetOrigin.targetOrigin : targetOrigin;
+
+        window.POST_MESSAGE_LOG.push({
+            'callstack': (new Error()).stack,
+            'targetOrigin': origin ? `${origin}` : '*',
+        });
+
+        return result;
+    };
+    window.postMessage = patchedPostMessage;
+
+    window.addEventListener('message', function(event) {
+        window.LISTEN_MESSAGE_LOG.push({
+            'origin': `${event.origin}`,
+            'source': `${event.source}`,
         });
-    })();
-    """
-
-    return driver.execute_script(script)
-
-
-def iframe_and_post_message_stats(driver):
-    """Get the iframe and postMessage stats."""
-
-    script = """
-    
-    var iframes = [];
-    
-    try{
-    document.querySelectorAll('iframe').forEach(function(iframe) {
-        iframes.push({
-            'src': iframe.src,
-            'name': iframe.name,
-            'title': iframe.title,
-            'allow': iframe.allow,
-            'loading': iframe.loading,
-            'referrerPolicy': iframe.referrerPolicy
-            });
     });
+})();
+"""
+
+# resolves once the page is complete and neither the DOM nor the resources
+# changed for quietMs, or after timeoutMs
+WAIT_UNTIL_QUIET = """
+var quietMs = arguments[0];
+var timeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+
+var start = performance.now();
+var last = start;
+var resources = performance.getEntriesByType('resource').length;
+
+var observer = new MutationObserver(function() { last = performance.now(); });
+observer.observe(document, {childList: true, subtree: true});
+
+var timer = setInterval(function() {
+    var now = performance.now();
+    var n = performance.getEntriesByType('resource').length;
+
+    if (n !== resources) {
+        resources = n;
+        last = now;
     }
-    catch (e) {
-        throw new Error(e + ' ' + e.stack);
+
+    if ((document.readyState === 'complete' && now - last >= quietMs) || now - start >= timeoutMs) {
+        clearInterval(timer);
+        observer.disconnect();
+        done(now - start);
     }
-    
-    var postMessageLog = window.POST_MESSAGE_LOG;
-    var listenMessageLog = window.LISTEN_MESSAGE_LOG;
-    
-    // check if scripts contain the keyword `postMessage`
-    
-    var staticPostMessageCount = 0;
-    
-    document.querySelectorAll('script').forEach(function(script) {
-        if (script.text.includes('window.postMessage')) {
-            staticPostMessageCount += 1;
-        }
-    });
-    
-    return {
-        'count': {
-            'iframes': iframes.length,
-            'postMessage': postMessageLog?.length,
-            'listenMessage': listenMessageLog?.length,
-            'staticPostMessage': staticPostMessageCount,
-        },
-        
-        'iframes': iframes,
-        'postMessage': postMessageLog,
-        'listenMessage': listenMessageLog,
+}, 100);
+"""
+
+# one pass over the img, iframe and script elements, and one over the rules of
+# the stylesheets
+FEATURE_COLLECTOR = """
+var details = arguments[0];
+var maxSamples = arguments[1];
+var NO_BACKGROUND = arguments[2];
+
+var samples = {
+    'image_alt': [], 'iframes': [], 'lazy': [], 'container_style': [], 'animation': [],
+};
+
+function sample(name, value) {
+    if (details && samples[name].length < maxSamples) {
+        samples[name].push(value());
     }
-    """
+}
 
-    return driver.execute_script(script)
+var imageAlt = {'total': 0, 'withAlt': 0, 'matches': 0, 'background': 0, 'backgroundImage': 0};
+var lazy = {'total': 0, 'lazy': 0};
+var iframes = 0;
+var staticPostMessage = 0;
 
+var elements = document.querySelectorAll('img, iframe, script');
+for (var i = 0; i < elements.length; i++) {
+    var element = elements[i];
+    var name = element.localName;
 
-def lazy_loading_stats(driver):
-    """Get the lazy loading attack-related statistics."""
+    if (name === 'img') {
+        lazy.total += 1;
 
-    script = """
-    var images = document.querySelectorAll('img');
-    var lazyImages = Array.prototype.filter.call(images, function(image) {
-        return image.getAttribute('loading') === 'lazy';
-    });
-    
-    return {
-        'count': {
-            'total': images.length,
-            'lazy': lazyImages.length,
-        },
-        'lazy': lazyImages.map(function(image) {
-            return {
-                'src': image.src,
-                'loading': image.loading,
-            }
-        })
-    }
-    """
-
-    return driver.execute_script(script)
-
-
-def container_style_queries(driver):
-    """Get css styles where @container is used."""
-
-    # external stylesheets
-    script = """
-    var stylesheets = document.styleSheets;
-    var containerStyles = [];
-    for (var i = 0; i < stylesheets.length; i++) {
-        
-        try{
-        
-        var rules = stylesheets[i].cssRules;
-        for (var j = 0; j < rules.length; j++) {
-            var rule = rules[j];
-            if (rule.cssText.includes('@container')) {
-                containerStyles.push({
-                    'cssTextStart': rule.cssText.slice(0, 100),
-                    'hasStyle': rule.cssText.includes('style('),
-                })
-            }
+        if (element.getAttribute('loading') === 'lazy') {
+            lazy.lazy += 1;
+            sample('lazy', () => ({'src': element.src, 'loading': element.loading}));
         }
 
-        } catch (e) {
-            console.log(e);
+        // images with an alt attribute where the :before is styled with background-image
+        if (!element.getAttribute('alt')) continue;
+
+        imageAlt.total += 1;
+        imageAlt.withAlt += 1;
+
+        var style = window.getComputedStyle(element, ':before');
+        var background = style.getPropertyValue('background');
+        var backgroundImage = style.getPropertyValue('background-image');
+
+        if (background !== 'none' || backgroundImage !== 'none') {
+            imageAlt.matches += 1;
+
+            var value = background ? background : backgroundImage;
+            if (value !== NO_BACKGROUND) {
+                imageAlt.background += 1;
+                if (value.includes('url')) imageAlt.backgroundImage += 1;
             }
+
+            sample('image_alt', () => ({'src': element.src, 'alt': element.alt, 'style': {'background': value}}));
+        }
+    } else if (name === 'iframe') {
+        iframes += 1;
+        sample('iframes', () => ({
+            'src': element.src,
+            'name': element.name,
+            'title': element.title,
+            'allow': element.allow,
+            'loading': element.loading,
+            'referrerPolicy': element.referrerPolicy,
+        }));
+    } else if (name === 'script') {
+        // check if scripts contain the keyword `postMessage`
+        if ((element.text || '').includes('window.postMessage')) staticPostMessage += 1;
     }
-    return containerStyles;
-    """
-
-    return driver.execute_script(script)
-
-
-def keyframes_with_background(driver):
-    """Get the keyframes containing background-image styles."""
-
-    # get keyframes with background-image
-
-    script = """
-    var stylesheets = document.styleSheets;
-    var keyframes = [];
-    for (var i = 0; i < stylesheets.length; i++) {
-        
-        try{
-        
-        var rules = stylesheets[i].cssRules;
-        for (var j = 0; j < rules.length; j++) {
-            var rule = rules[j];
-            if (rule.type === 7) {
-                keyframes.push({
-                    'name': rule.name,
-                    'cssText': rule.cssText,
-                    'hasBackgroundImage': rule.cssText.includes('background-image') || rule.cssText.includes('background: url('),
-                    'hasBackground': rule.cssText.includes('background'),
-                    'makesRequest': rule.cssText.includes(' url('),
-                })
-            }
+}
+
+var container = {'total': 0, 'style': 0};
+var animation = {'total': 0, 'background': 0, 'backgroundImage': 0, 'makesRequest': 0};
+
+var stylesheets = document.styleSheets;
+for (var i = 0; i < stylesheets.length; i++) {
+    var rules;
+    try {
+        rules = stylesheets[i].cssRules;
+    } catch (e) {
+        // cross-origin stylesheet
+        continue;
+    }
+
+    for (var j = 0; j < rules.length; j++) {
+        var rule = rules[j];
+        var cssText = rule.cssText;
+
+        if (cssText.includes('@container')) {
+            container.total += 1;
+            if (cssText.includes('style(')) container.style += 1;
+            sample('container_style', () => ({'cssTextStart': cssText.slice(0, 100), 'hasStyle': cssText.includes('style(')}));
         }
 
-        } catch (e) {
-            console.log(e);
-            }
+        if (rule.type === 7) {
+            animation.total += 1;
+            if (cssText.includes('background')) animation.background += 1;
+            if (cssText.includes('background-image') || cssText.includes('background: url(')) animation.backgroundImage += 1;
+            if (cssText.includes(' url(')) animation.makesRequest += 1;
+            sample('animation', () => ({'name': rule.name, 'cssText': cssText}));
+        }
     }
-    return keyframes;
-    """
+}
+
+var postMessageLog = window.POST_MESSAGE_LOG;
+var listenMessageLog = window.LISTEN_MESSAGE_LOG;
+
+var features = {
+    'version': 2,
+    'image_alt': {'count': imageAlt},
+    'iframe_post_message': {'count': {
+        'iframes': iframes,
+        'postMessage': postMessageLog ? postMessageLog.length : null,
+        'listenMessage': listenMessageLog ? listenMessageLog.length : null,
+        'staticPostMessage': staticPostMessage,
+    }, 'messageLogStart': 'document_start'},
+    'lazy_loading': {'count': lazy},
+    'container_style': {'count': container},
+    'animation': {'count': animation},
+};
 
-    return driver.execute_script(script)
+if (details) {
+    samples['postMessage'] = (postMessageLog || []).slice(0, maxSamples);
+    samples['listenMessage'] = (listenMessageLog || []).slice(0, maxSamples);
+    features['samples'] = samples;
+}
+
+return features;
+"""
+
+
+def api_override(driver):
+    """Override the postMessage and addEventListener functions to log messages, from the start of the next documents."""
+
+    driver.execute_cdp_cmd(
+        "Page.addScriptToEvaluateOnNewDocument", {"source": API_OVERRIDE}
+    )
 
 
-def main(number_of_tries, flag, args_lst):
+def wait_until_quiet(driver, quiet=1, timeout=10):
+    """Wait until the DOM and the resources of the page stop changing, return the waited seconds."""
+
+    driver.set_script_timeout(timeout + 5)
+    return (
+        driver.execute_async_script(WAIT_UNTIL_QUIET, quiet * 1000, timeout * 1000)
+        / 1000
+    )
+
+
+def collect_features(driver, details=False, max_samples=20):
+    """Get the counts of the features of the page, with some samples of each if details."""
+
+    return driver.execute_script(FEATURE_COLLECTOR, details, max_samples, NO_BACKGROUND)
+
+
+def main(number_of_tries, flag, args_lst, details=False):
 
     # Start X
     # vdisplay = Display(visible=False, size=(1920, 1080))
@@ -295,8 +303,6 @@ def main(number_of_tries, flag, args_lst):
             print(f"{args_lst[0]} already crawled. Skipping...")
             return
 
-        stat_data = {}
-
         # make sure the directory exists
         os.makedirs("/data/" + args_lst[0].split("//")[1], exist_ok=True)
 
@@ -304,18 +310,12 @@ def main(number_of_tries, flag, args_lst):
         driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(args_lst[1])
 
-        driver.get(args_lst[0])
-        time.sleep(2)
         api_override(driver)
+        driver.get(args_lst[0])
         wait_until_loaded(driver, args_lst[1])
+        wait_until_quiet(driver)
 
-        time.sleep(10)
-
-        stat_data["image_alt"] = image_alt_stats(driver)
-        stat_data["iframe_post_message"] = iframe_and_post_message_stats(driver)
-        stat_data["lazy_loading"] = lazy_loading_stats(driver)
-        stat_data["container_style"] = container_style_queries(driver)
-        stat_data["animation"] = keyframes_with_background(driver)
+        stat_data = collect_features(driver, details)
 
         print("-" * 25)
         print(fname)
@@ -335,7 +335,7 @@ def main(number_of_tries, flag, args_lst):
         else:
             driver.quit()
             # vdisplay.stop()
-            return main(number_of_tries - 1, flag, args_lst)
+            return main(number_of_tries - 1, flag, args_lst, details)
 
     driver.quit()
     # vdisplay.stop()
@@ -351,6 +351,11 @@ if __name__ == "__main__":
     # parser.add_argument('--extensions')
     parser.add_argument("--extensions-wait", type=int, default=10)
     parser.add_argument("--cpu", type=int)
+    parser.add_argument(
+        "--details",
+        action="store_true",
+        help="also save samples of the elements and rules behind the counts",
+    )
     args = parser.parse_args()
 
     port = 5907 + args.cpu
@@ -362,6 +367,6 @@ if __name__ == "__main__":
 
         args_lst = [website, args.timeout, args.cpu]
 
-        main(3, 0, args_lst)
+        main(3, 0, args_lst, args.details)
 
     vdisplay.stop()
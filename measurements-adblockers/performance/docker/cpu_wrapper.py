@@ -2,65 +2,110 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
 import json
 import logging.config
-import random
-import re
+import os
 import subprocess
-import time
 import uuid
-import threading
-import multiprocessing
 
-
-def divide_chunks(l, n):
-    # looping till length l
-    for i in range(0, len(l), n):
-        yield l[i : i + n]
-
-
-def run(log, browser, domains, cpu):
-    for domain in domains:
-        run_configuration(log, browser, domain, cpu)
-
-
-def run_configuration(log, browser, domain, cpu):
-    log.info(f"Collecting mpstat data via {browser} for '{domain}' on cpu '{cpu}'")
+import scheduler
+
+
+def run_configuration(
+    log,
+    browser,
+    site_timeout,
+    session,
+    mode,
+    repetitions,
+    sampler_cpu,
+    sample_interval,
+    domains,
+    cpu,
+):
+    log.info(f"Collecting mpstat data via {browser} for {domains} on cpu '{cpu}'")
     try:
-        get_domain(log, browser, domain, cpu)
+        return get_domain(
+            log,
+            browser,
+            domains,
+            cpu,
+            site_timeout * len(domains) * repetitions,
+            session,
+            mode,
+            repetitions,
+            sampler_cpu,
+            sample_interval,
+        )
 
     except Exception as e:
-        log.error(f"Unknown error for domain '{domain}': {e}")
-
+        log.error(f"Unknown error for domains {domains}: {e}")
+        return False
+
+
+def get_domain(
+    log,
+    browser,
+    domains,
+    cpu,
+    timeout=None,
+    session=False,
+    mode=None,
+    repetitions=1,
+    sampler_cpu=None,
+    sample_interval=None,
+):
+    # the measurement method is set for the whole run, retried sites included
+    flags = " --session" if session and mode != "record" else ""
+    if mode:
+        flags += f" --{mode}"
+    if repetitions > 1 and mode != "record":
+        flags += f" --repetitions {repetitions}"
+    if sample_interval is not None and mode != "record":
+        flags += f" --sample-interval {sample_interval:g}"
+    domain = " ".join(domains)
+    # offline measurements are kept apart from the live ones
+    data = "./chrome/replaydata" if mode == "replay" else "./chrome/data"
+    name = f"cpu-{cpu}-{uuid.uuid4().hex[:8]}"
+
+    env_var = f"CUSTOM_CMD=python3 /home/seluser/measure/cpu.py --cpu {cpu}{flags} {domain}"
+    cmd = [
+        "docker",
+        "run",
+        "--rm",
+        "--name",
+        name,
+        "-v",
+        "/dev/shm:/dev/shm",
+        "-v",
+        f"{data}:/data",
+        "-v",
+        "./chrome/profiles:/profiles",
+        "-v",
+        "./chrome/archives:/archives",
+        "--cpuset-cpus",
+        # the sampler leaves the measured CPU to the browser
+        cpu if sampler_cpu is None else f"{cpu},{sampler_cpu}",
+        "--net",
+        "host",
+        "--security-opt",
+        "seccomp=seccomp.json",
+        "-e",
+        env_var,
+        f"mpstat-{browser}",
+    ]
+    # we can use "--shm-size=2g" instead of /dev/shm:/dev/shm
 
-def get_domain(log, browser, domain, cpu):
     try:
-        env_var = (
-            f"CUSTOM_CMD=python3 /home/seluser/measure/cpu.py --cpu {cpu} {domain}"
+        run = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
         )
-        cmd = [
-            "docker",
-            "run",
-            "--rm",
-            "-v",
-            "/dev/shm:/dev/shm",
-            "-v",
-            "./chrome/data:/data",
-            "--cpuset-cpus",
-            cpu,
-            "--net",
-            "host",
-            "--security-opt",
-            "seccomp=seccomp.json",
-            "-e",
-            env_var,
-            f"mpstat-{browser}",
-        ]
-        # we can use "--shm-size=2g" instead of /dev/shm:/dev/shm
-
-        run = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        log.error(f"Error in container for '{domain}': {e.output}")
+    except subprocess.TimeoutExpired:
+        # killing the docker client leaves the container running
+        subprocess.run(["docker", "kill", name], capture_output=True)
+        log.error(f"Timeout after {timeout} seconds for {domains} on cpu '{cpu}'")
+        return False
 
     stdout = run.stdout.decode("utf-8")
     stderr = run.stderr.decode("utf-8")
@@ -69,6 +114,8 @@ def get_domain(log, browser, domain, cpu):
     log.info(stdout)
     log.error(stderr)
 
+    return run.returncode == 0
+
 
 def main():
     # Parse command line arguments
@@ -78,6 +125,53 @@ def main():
     parser.add_argument("domains_list_file")
     parser.add_argument("cpus")
     parser.add_argument("browser")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help="sites per container, measured in browser sessions on the saved profiles (0: one container and fresh browsers per site)",
+    )
+    parser.add_argument(
+        "--site-timeout",
+        type=int,
+        default=1800,
+        help="seconds allowed per site, for all the configurations",
+    )
+    parser.add_argument("--tries", type=int, default=3, help="attempts per site")
+    parser.add_argument(
+        "--repetitions",
+        type=int,
+        default=1,
+        help="interleaved trials of all the configurations per site",
+    )
+    parser.add_argument(
+        "--sampler-cpu",
+        help="spare CPU added to every container to run the CPU load sampler, off the measured CPUs",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        help="CPU load sampling period in seconds (default: 1, as mpstat), e.g. 0.05 to 0.1 to sample short page loads",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--record",
+        action="store_const",
+        const="record",
+        dest="mode",
+        help="record the sites to chrome/archives, without measuring",
+    )
+    mode.add_argument(
+        "--replay",
+        action="store_const",
+        const="replay",
+        dest="mode",
+        help="measure the sites offline from chrome/archives, to chrome/replaydata",
+    )
+    parser.add_argument(
+        "--ledger",
+        help="progress ledger of the sites, to resume a run (default: cpu[_<mode>]_progress.jsonl next to the log)",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log, level=logging.DEBUG)
@@ -103,37 +197,44 @@ def main():
         "adguard",
     ]
 
-    # RUNNING 4 DOCKERS ON 4 DIFFERENT CPU CORES
+    ledger_fp = args.ledger or os.path.join(
+        os.path.dirname(args.log),
+        f"cpu_{args.mode}_progress.jsonl" if args.mode else "cpu_progress.jsonl",
+    )
+
+    # ONE DOCKER AT A TIME ON EACH CPU CORE, PULLING SITES FROM A SHARED QUEUE
     # cpus_list = ['0','1','2','3']
     cpus_list = [str(cpu) for cpu in range(int(args.cpus))]
-    thread_list = []
-    domain_set = list(divide_chunks(domains, int(len(domains) / len(cpus_list))))
-    print(domain_set)
-    for i in range(len(cpus_list)):
-        thread_list.append(
-            multiprocessing.Process(
-                target=run,
-                args=(
-                    log,
-                    args.browser,
-                    domain_set[i],
-                    cpus_list[i],
-                ),
-            )
-        )
 
-    log.info("starting threads ....")
-    for thread in thread_list:
-        log.info(f"Starting run for '{thread}'")
-        start_time = time.time()
-        print("thread starts")
-        thread.start()
-        log.info(f"Elapsed time: {time.time() - start_time} seconds for '{thread}'")
-
-    log.info("joining threads ....")
-    for thread in thread_list:
-        print("thread joins")
-        thread.join()
+    if args.sampler_cpu in cpus_list:
+        raise ValueError(f"The sampler CPU '{args.sampler_cpu}' must not be measured")
+
+    if args.sample_interval is not None and args.sample_interval <= 0:
+        raise ValueError(f"The sample interval '{args.sample_interval}' must be positive")
+
+    failed = scheduler.run_sites(
+        log,
+        functools.partial(
+            run_configuration,
+            log,
+            args.browser,
+            args.site_timeout,
+            # batches of any size are measured in browser sessions
+            args.batch_size > 0,
+            args.mode,
+            args.repetitions,
+            args.sampler_cpu,
+            args.sample_interval,
+        ),
+        domains,
+        cpus_list,
+        ledger_fp,
+        batch_size=args.batch_size,
+        tries=args.tries,
+    )
+
+    if failed:
+        print(f"{len(failed)} sites failed, see {ledger_fp}")
 
 
 if __name__ == "__main__":
@@ -1,106 +1,306 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import subprocess
+
+import argparse
+import http.client
 import json
-import time
-import re
 import logging
-import math
+import os
+import socket
+import threading
+import time
+import urllib.parse
 
 log = logging.getLogger('docker_stats')
 
-data = {}
-val = 1
-count = 0
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to the Docker Engine API over its unix socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def list_containers(socket_path=DOCKER_SOCKET):
+    """Return {id: name} of the running containers"""
+
+    conn = UnixHTTPConnection(socket_path, timeout=10)
+    try:
+        conn.request("GET", "/containers/json")
+        response = conn.getresponse()
+        containers = json.loads(response.read())
+    finally:
+        conn.close()
+
+    return {c["Id"]: c["Names"][0].lstrip("/") for c in containers}
+
+
+def stream_stats(container_id, socket_path=DOCKER_SOCKET):
+    """Yield the stats of a container, one JSON object per second, until it stops"""
+
+    conn = UnixHTTPConnection(socket_path)
+    try:
+        conn.request(
+            "GET", f"/containers/{urllib.parse.quote(container_id)}/stats?stream=true"
+        )
+        response = conn.getresponse()
+        if response.status != 200:
+            return
+
+        # the body is chunked, with one JSON object per line
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        conn.close()
+
+
+def parse_name(name):
+    """Return (extension, site) of a container named <extension>_<site>, or None"""
+
+    parts = name.split("_", 1)
+    if len(parts) != 2 or '.' not in parts[1]:
+        return None
+
+    return parts[0], parts[1]
+
+
+def sample(stats):
+    """
+    One reading of the stats stream: CPU load, memory and IO of the container
+
+    The CPU load and memory usage are computed as by `docker stats`.
+    """
+
+    cpu = stats.get("cpu_stats", {})
+    precpu = stats.get("precpu_stats", {})
+
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get(
+        "cpu_usage", {}
+    ).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    online_cpus = cpu.get("online_cpus") or len(
+        cpu.get("cpu_usage", {}).get("percpu_usage") or [1]
+    )
+
+    cpu_percent = 0.0
+    if cpu_delta > 0 and system_delta > 0:
+        cpu_percent = cpu_delta / system_delta * online_cpus * 100
+
+    memory = stats.get("memory_stats", {})
+    # the page cache is not counted in the usage, cgroup v1 then v2
+    cache = memory.get("stats", {}).get(
+        "total_inactive_file", memory.get("stats", {}).get("inactive_file", 0)
+    )
+    mem = max(memory.get("usage", 0) - cache, 0)
+
+    blkio_read = blkio_write = 0
+    for entry in stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []:
+        if entry.get("op", "").lower() == "read":
+            blkio_read += entry.get("value", 0)
+        elif entry.get("op", "").lower() == "write":
+            blkio_write += entry.get("value", 0)
+
+    networks = (stats.get("networks") or {}).values()
+
+    return {
+        "read": stats.get("read"),
+        "cpu": round(cpu_percent, 3),
+        "ram": round(mem / 2**20, 3),
+        "ram_limit": round(memory.get("limit", 0) / 2**20, 3),
+        "blkio_read": blkio_read,
+        "blkio_write": blkio_write,
+        "net_rx": sum(n.get("rx_bytes", 0) for n in networks),
+        "net_tx": sum(n.get("tx_bytes", 0) for n in networks),
+    }
+
+
+class StatsWriter:
+    """
+    Append-only JSON lines file of the readings, flushed to disk periodically.
+    The readings written after `close` are dropped.
+    """
+
+    def __init__(self, fname, flush_interval=5):
+        self._f = open(fname, "a")
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._f.closed:
+                return
+
+            self._f.write(line)
+            if time.monotonic() - self._last_flush >= self._flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._f.closed:
+                return
+
+            self._flush()
+            self._f.close()
 
 
+class Collector:
+    """
+    Record the stats of every running container to an append-only file
+
+    Each container is followed by a thread holding one streaming connection to
+    the Docker Engine, and new containers are discovered every `poll` seconds.
+    """
+
+    def __init__(self, fname, socket_path=DOCKER_SOCKET, poll=1.0, flush_interval=5):
+        self.socket_path = socket_path
+        self.poll = poll
+        self.writer = StatsWriter(fname, flush_interval)
+        self._followed = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stopped = False
+
+    def _follow(self, container_id, name):
+        names = parse_name(name)
+        try:
+            for stats in stream_stats(container_id, self.socket_path):
+                if self._stop_event.is_set():
+                    break
+
+                # the first reading has no previous reading to compute the CPU load
+                if not stats.get("precpu_stats", {}).get("system_cpu_usage"):
+                    continue
+
+                record = {"container": name, "time": time.time()}
+                if names is not None:
+                    record["extn"], record["site"] = names
+                record.update(sample(stats))
+                self.writer.write(record)
+
+        except Exception as e:
+            log.error(f"Error collecting stats of '{name}': {e}")
+
+        finally:
+            with self._lock:
+                self._followed.pop(container_id, None)
+
+    def discover(self):
+        """Follow the containers started since the last discovery"""
+
+        containers = list_containers(self.socket_path)
+
+        with self._lock:
+            if self._stopped:
+                return containers
+
+            for container_id, name in containers.items():
+                if container_id in self._followed:
+                    continue
+
+                thread = threading.Thread(
+                    target=self._follow, args=(container_id, name), daemon=True
+                )
+                self._followed[container_id] = thread
+                thread.start()
+
+        return containers
+
+    def run(self, idle_timeout=180):
+        """Collect until stopped, or after `idle_timeout` seconds without containers"""
+
+        last_seen = time.monotonic()
 
-def run():
-    global data
-    global val
-    while val == 1: 
         try:
-            cmd = ["docker", "stats", "--no-stream"]
-            run = subprocess.run(cmd, universal_newlines=True,
-                                            stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE)
-            stdout = run.stdout
-            stderr = run.stderr
-
-            parse(stdout)
-            # print(data)
-            time.sleep(1.5)                
-        except subprocess.CalledProcessError as e:
-            log.error(f"Error collecting performance events: {e}")
+            while not self._stop_event.is_set():
+                try:
+                    if self.discover():
+                        last_seen = time.monotonic()
+                except OSError as e:
+                    log.error(f"Error listing the containers: {e}")
+
+                if idle_timeout is not None and time.monotonic() - last_seen > idle_timeout:
+                    break
+
+                self._stop_event.wait(self.poll)
         except KeyboardInterrupt:
-            stop('docker_stats.json')
-
-    return
-
-def stop(fname):
-    global data
-    global val
-    val = 0
-    f = open(fname, "w")
-    json.dump(data, f)
-    f.close()
-    return
-
-def parse(stdout):
-    global data
-    global count
-    # Parse RAM data
-    print('-'*50)
-    print('Count:', count)
-    print('-'*50)
-    lst = stdout.split('\n')
-
-    if len(lst) == 2 and lst[1] == '':
-        count += 1
-        if count == 120:
-            stop('docker_stats.json')
-
-    if len(lst) > 2:
-        for entry in lst[1:-1]:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop following the containers and close the file, once"""
+
+        with self._lock:
+            if self._stopped:
+                return
+
+            self._stopped = True
+            self._stop_event.set()
+            threads = list(self._followed.values())
+
+        for thread in threads:
+            # streams get a reading every second
+            thread.join(timeout=2)
+
+        # the threads still blocked on a stream write nothing after this
+        self.writer.close()
+
+
+def ram_by_site(fname):
+    """Return the RAM (MB) readings as {extension: {site: [readings]}}"""
+
+    data = {}
+    with open(fname, "r") as f:
+        for line in f:
             try:
-                entry_lst = re.split("\s\s+", entry)
-                if entry_lst[1] == '--' or '.' not in entry_lst[1].split("_")[1]:
-                    count += 1
-                    if count == 120:
-                        stop('docker_stats.json')
-                        return
-                    continue
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # line cut by a crash
+                continue
 
-                ram = entry_lst[3].split(" / ")[0]
-                if len(ram.split('KiB')) == 2:
-                    ram = float(ram.split('KiB')[0])
-                    ram = round(ram*math.pow(10,-3), 3)
-                elif len(ram.split('MiB')) == 2:
-                    ram = float(ram.split('MiB')[0])
-                    ram = round(ram, 3)
-                elif len(ram.split('GiB')) == 2:
-                    ram = float(ram.split('GiB')[0])
-                    ram = round(ram*math.pow(10, 3), 3)
-                extn = entry_lst[1].split("_")[0]
-                site = entry_lst[1].split("_")[1]
-                count = 0                
-                
-                # print(data)
-                if extn in data.keys():
-                    # print(1)
-                    if site in data[extn].keys():
-                        # print(2)
-                        data[extn][site].append(ram)
-                    else:
-                        # print(3)
-                        data[extn][site] = [ram]
-                else:
-                    # print(4)
-                    data[extn] = {site: [ram]}
-            except Exception as e:
-                print(e)
+            if "extn" not in record:
                 continue
-    return
 
-run()
+            data.setdefault(record["extn"], {}).setdefault(record["site"], []).append(
+                record["ram"]
+            )
+
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="docker_stats.jsonl")
+    parser.add_argument("--socket", default=DOCKER_SOCKET)
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between container discoveries")
+    parser.add_argument("--flush-interval", type=float, default=5)
+    parser.add_argument("--idle-timeout", type=float, default=180, help="stop after this many seconds without containers")
+    args = parser.parse_args()
+
+    collector = Collector(args.output, args.socket, args.poll, args.flush_interval)
+    collector.run(args.idle_timeout)
+
+    # summary in the format of the previous collector
+    with open('docker_stats.json', "w") as f:
+        json.dump(ram_by_site(args.output), f)
+
 
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,9 @@
 set -e
 
 # Check if the correct number of arguments are provided
-if [ "$#" -ne 5 ]; then
-    echo "Usage: bash $0 <LOGS_PATH> <DOMAINS_LIST_PATH> <METRIC> <CPUS> <BROWSER>"
-    echo "Example: bash $0 logs  ../../websites_inner_pages.json cpu 4 chrome"
+if [ "$#" -lt 5 ]; then
+    echo "Usage: bash $0 <LOGS_PATH> <DOMAINS_LIST_PATH> <METRIC> <CPUS> <BROWSER> [WRAPPER_OPTIONS...]"
+    echo "Example: bash $0 logs  ../../websites_inner_pages.json cpu 4 chrome --batch-size 50"
     exit 1
 fi
 
@@ -44,8 +44,14 @@ popd > /dev/null
 # create data directory with suitable permissions
 mkdir -p "${SELFPATH}/chrome/data"
 mkdir -p "${SELFPATH}/chrome/webdata"
+mkdir -p "${SELFPATH}/chrome/profiles"
+mkdir -p "${SELFPATH}/chrome/archives"
+mkdir -p "${SELFPATH}/chrome/replaydata"
 sudo chmod 777 "${SELFPATH}/chrome/data"
 sudo chmod 777 "${SELFPATH}/chrome/webdata"
+sudo chmod 777 "${SELFPATH}/chrome/profiles"
+sudo chmod 777 "${SELFPATH}/chrome/archives"
+sudo chmod 777 "${SELFPATH}/chrome/replaydata"
 
 # source ~/work/pes/pes/bin/activate
 python3 -m venv ./measure
@@ -58,5 +64,6 @@ python3 "${METRIC}_wrapper.py" \
 ${LOGS}/${UUID}.log \
 ${DOMAINS_LIST} \
 ${CPUS} \
-${BROWSER}
+${BROWSER} \
+"${@:6}"
 echo "Completed measurement run '${UUID}' at $(date)"
\ No newline at end of file
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+import time
+
+
+def divide_chunks(l, n):
+    # looping till length l
+    for i in range(0, len(l), n):
+        yield l[i : i + n]
+
+
+class ProgressLedger:
+    """
+    Append-only record of the outcome of each attempt on a site
+
+    Each line is a JSON object {"site", "status", "attempt", "cpu", "duration",
+    "time"}, with status "done" or "failed". Only the scheduler process writes
+    to the ledger, and each line is flushed to disk once written, so a killed
+    run loses at most the sites that were in flight.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def load(self):
+        """Return {site: (done, number of failed attempts)} from the previous runs"""
+
+        progress = {}
+
+        if not os.path.isfile(self.fp):
+            return progress
+
+        with open(self.fp, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # line cut by a crash
+                    continue
+
+                done, failures = progress.get(entry["site"], (False, 0))
+
+                if entry["status"] == "done":
+                    done = True
+                else:
+                    failures += 1
+
+                progress[entry["site"]] = (done, failures)
+
+        return progress
+
+    def record(self, sites, status, attempt, cpu, duration):
+        with open(self.fp, "a") as f:
+            for site in sites:
+                entry = {
+                    "site": site,
+                    "status": status,
+                    "attempt": attempt,
+                    "cpu": cpu,
+                    "duration": duration,
+                    "time": time.time(),
+                }
+                f.write(json.dumps(entry) + "\n")
+
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def worker(run_batch, cpu, tasks, results):
+    """Pull batches of sites from the shared queue and run them on one CPU"""
+
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            return
+
+        sites, attempt = task
+
+        start_time = time.time()
+        try:
+            success = run_batch(sites, cpu)
+        except Exception as e:
+            print(f"Error for {sites} on cpu '{cpu}': {e}")
+            success = False
+
+        results.put((sites, attempt, cpu, success, time.time() - start_time))
+
+
+def run_sites(log, run_batch, sites, cpus_list, ledger_fp, batch_size=1, tries=3):
+    """
+    Run the sites on workers pinned to the CPUs, pulling from a shared queue
+
+    Args:
+        log: logger
+        run_batch: function (sites, cpu) -> True if the batch succeeded
+        sites: list of sites
+        cpus_list: list of CPUs, one worker per CPU
+        ledger_fp: path to the progress ledger, the sites already done or
+            failed `tries` times are skipped
+        batch_size: number of sites per task
+        tries: number of attempts per site
+
+    Returns:
+        failed: sites given up after `tries` attempts
+    """
+
+    ledger = ProgressLedger(ledger_fp)
+    progress = ledger.load()
+
+    # sites in a failed batch are retried one by one
+    attempts = {}
+    pending = []
+    for site in dict.fromkeys(sites):
+        done, failures = progress.get(site, (False, 0))
+        if not done and failures < tries:
+            pending.append(site)
+            attempts[site] = failures
+
+    log.info(
+        f"{len(sites) - len(pending)} sites already done or given up, {len(pending)} to run"
+    )
+    print(f"{len(pending)} sites to run on {len(cpus_list)} cpus")
+
+    if not pending:
+        return []
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+
+    outstanding = 0
+    for batch in divide_chunks(pending, max(batch_size, 1)):
+        tasks.put((batch, max(attempts[site] for site in batch) + 1))
+        outstanding += 1
+
+    workers = [
+        multiprocessing.Process(target=worker, args=(run_batch, cpu, tasks, results))
+        for cpu in cpus_list
+    ]
+
+    log.info("starting workers ....")
+    for process in workers:
+        process.start()
+
+    failed = []
+    n_done = 0
+
+    while outstanding:
+        batch, attempt, cpu, success, duration = results.get()
+        outstanding -= 1
+
+        ledger.record(batch, "done" if success else "failed", attempt, cpu, duration)
+
+        if success:
+            n_done += len(batch)
+            log.info(f"Done {batch} on cpu '{cpu}' in {duration:.1f} seconds")
+            print(f"{n_done}/{len(pending)} sites done")
+            continue
+
+        log.error(f"Failed {batch} on cpu '{cpu}' (attempt {attempt}/{tries})")
+
+        for site in batch:
+            attempts[site] = attempts[site] + 1
+
+            if attempts[site] < tries:
+                tasks.put(([site], attempts[site] + 1))
+                outstanding += 1
+            else:
+                failed.append(site)
+                log.error(f"Giving up on '{site}' after {tries} attempts")
+
+    log.info("joining workers ....")
+    for _ in workers:
+        tasks.put(None)
+
+    for process in workers:
+        process.join()
+
+    return failed
@@ -2,52 +2,47 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
 import json
 import logging.config
+import os
 import subprocess
-import time
-import multiprocessing
-
-def divide_chunks(l, n):
-    # looping till length l
-    for i in range(0, len(l), n):
-        if i+n > len(l):
-            yield l[i:]
-        else:
-            yield l[i:i + n]
-
-def run(log, browser, domains, cpu):
-    # random.shuffle(domains)
-    for _domains in divide_chunks(domains, 10):
-        run_configuration(log, browser, _domains, cpu)
+import uuid
 
+import scheduler
 
-def run_configuration(log, browser, domains, cpu):
+def run_configuration(log, browser, site_timeout, domains, cpu):
     log.info(f"Collecting mpstat data via {browser} for '{domains}' on cpu '{cpu}'")
     try:
-        get_domain(log, browser, domains, cpu)
+        return get_domain(log, browser, domains, cpu, site_timeout * len(domains))
 
     except Exception as e:
         log.error(f"Unknown error for domain '{cpu}': {e}")
+        return False
+
+
+def get_domain(log, browser, domains, cpu, timeout=None):
+    domains_escaped = [f'"{d}"' for d in domains]
+    name = f"web-{cpu}-{uuid.uuid4().hex[:8]}"
+    env_var = f'CUSTOM_CMD=python3 /home/seluser/measure/web.py --cpu {cpu} --websites {" ".join(domains_escaped)}'
+    cmd = ["docker", "run", "--rm",
+            "--name", name,
+            "-v", "/dev/shm:/dev/shm",
+            "-v", "./chrome/webdata:/data",
+            "--cpuset-cpus", cpu,
+            "--net", "host",
+           "--security-opt", "seccomp=seccomp.json", 
+           "-e", env_var,
+           f"mpstat-{browser}"]
+    # we can use "--shm-size=2g" instead of /dev/shm:/dev/shm
 
-
-def get_domain(log, browser, domains, cpu):
     try:
-        domains_escaped = [f'"{d}"' for d in domains]
-        env_var = f'CUSTOM_CMD=python3 /home/seluser/measure/web.py --cpu {cpu} --websites {" ".join(domains_escaped)}'
-        cmd = ["docker", "run", "--rm",
-                "-v", "/dev/shm:/dev/shm",
-                "-v", "./chrome/webdata:/data",
-                "--cpuset-cpus", cpu,
-                "--net", "host",
-               "--security-opt", "seccomp=seccomp.json", 
-               "-e", env_var,
-               f"mpstat-{browser}"]
-        # we can use "--shm-size=2g" instead of /dev/shm:/dev/shm
-        
-        run = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        log.error(f"Error in container for '{cpu}': {e.output}")
+        run = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # killing the docker client leaves the container running
+        subprocess.run(["docker", "kill", name], capture_output=True)
+        log.error(f"Timeout after {timeout} seconds for '{domains}' on cpu '{cpu}'")
+        return False
     
     stdout = run.stdout.decode('utf-8')
     stderr = run.stderr.decode('utf-8')
@@ -61,6 +56,8 @@ def get_domain(log, browser, domains, cpu):
     #except Exception as e:
     #    log.error(f"Error decoding output for domain {domain}: {e}")
 
+    return run.returncode == 0
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser()
@@ -69,6 +66,10 @@ def main():
     parser.add_argument('domains_list_file')
     parser.add_argument('cpus')
     parser.add_argument('browser')
+    parser.add_argument('--batch-size', type=int, default=10, help="sites per container")
+    parser.add_argument('--site-timeout', type=int, default=300, help="seconds allowed per site")
+    parser.add_argument('--tries', type=int, default=3, help="attempts per site")
+    parser.add_argument('--ledger', help="progress ledger of the sites, to resume a run (default: web_progress.jsonl next to the log)")
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log, level=logging.DEBUG)
@@ -108,28 +109,24 @@ def main():
     ]
 
 
-    # RUNNING 4 DOCKERS ON 4 DIFFERENT CPU CORES
+    ledger_fp = args.ledger or os.path.join(os.path.dirname(args.log), 'web_progress.jsonl')
+
+    # ONE DOCKER AT A TIME ON EACH CPU CORE, PULLING SITES FROM A SHARED QUEUE
     # cpus_list = ['0','1','2','3']
     cpus_list = [str(cpu) for cpu in range(int(args.cpus))]
-    thread_list = []
-    domain_set = list(divide_chunks(domains, int(len(domains)/len(cpus_list))))
-    print(domain_set)
-    for i in range(len(cpus_list)):
-        thread_list.append(multiprocessing.Process(target=run, args=(log, args.browser, domain_set[i], cpus_list[i],)))
-    
-    log.info("starting threads ....")
-    for thread in thread_list:
-        log.info(f"Starting run for '{thread}'")
-        start_time = time.time()
-        print('thread starts')
-        thread.start()
-        log.info(f"Elapsed time: {time.time() - start_time} seconds for '{thread}'")
-
-    log.info("joining threads ....")
-    for thread in thread_list:
-        print('thread joins')
-        thread.join()
 
+    failed = scheduler.run_sites(
+        log,
+        functools.partial(run_configuration, log, args.browser, args.site_timeout),
+        domains,
+        cpus_list,
+        ledger_fp,
+        batch_size=args.batch_size,
+        tries=args.tries,
+    )
+
+    if failed:
+        print(f'{len(failed)} sites failed, see {ledger_fp}')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+"""
+Statistical analysis of repeated CPU measurements of the ad-blockers.
+
+The measurements of each site are read per trial (a round over all the
+configurations, see `cpu.py --repetitions`). Sites measured once count as a
+single trial. The faulty trials and the failed or timed out page loads are
+dropped, then the outlier trials. Each configuration is compared with the
+control of the same site and trial, and the per-site paired differences are
+summarized with bootstrap confidence intervals and effect sizes:
+
+    python3 benchmark_stats.py <data_path> <output_path> [--n-boot 10000] [--seed 0]
+
+The results are written to `benchmark_stats.json` in the output folder, for
+regression tracking across runs.
+"""
+
+import argparse
+import json
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from process_cpu_data import (
+    METRICS,
+    NpEncoder,
+    check_single_sampler,
+    extn_lst,
+    fl_lst,
+    measurement_row,
+)
+
+OUTPUT_NAME = "benchmark_stats.json"
+
+# modified z-score above which a trial is an outlier
+OUTLIER_THRESHOLD = 3.5
+
+# the sites with fewer trials are not checked for outliers
+MIN_OUTLIER_TRIALS = 3
+
+# page loads over this time (ms) timed out, as in process_cpu_data
+LOAD_TIMEOUT = 30000
+
+
+def trial_rows(site_fp):
+    """One row per (extension, filterlist, trial) of a website"""
+
+    website = site_fp.name
+
+    with open(site_fp, "r") as f:
+        data = json.load(f)
+
+    # the single run of the sites measured without repetitions
+    trials = data.get("trials") or {"0": data["stats"]}
+
+    rows = []
+
+    for trial, stats in trials.items():
+        for extn in extn_lst:
+            key = f"/data/{website}" if extn == "control" else extn
+
+            for fl in ["default"] if extn == "control" else fl_lst:
+                row = measurement_row(website, extn, fl, stats.get(key, {}).get(fl))
+                row["trial"] = int(trial)
+                rows.append(row)
+
+    return rows
+
+
+def load_trials(data_path):
+    """Read the per-site JSON files into a table with one row per trial"""
+
+    site_fps = [Path(entry.path) for entry in os.scandir(data_path) if entry.is_file()]
+
+    with Pool(os.cpu_count()) as p:
+        rows = [
+            row
+            for site_rows in tqdm(
+                p.imap(trial_rows, site_fps, chunksize=64),
+                total=len(site_fps),
+                desc="Loading sites",
+            )
+            for row in site_rows
+        ]
+
+    return pd.DataFrame(
+        rows,
+        columns=["site", "extension", "filterlist", "trial"]
+        + METRICS
+        + ["faulty", "sampler"],
+    )
+
+
+def valid_trials(trials):
+    """
+    Mask of the trials with a complete measurement and a page load that neither
+    failed (negative timings) nor timed out
+    """
+
+    return ~trials["faulty"] & trials["loadEnd"].between(0, LOAD_TIMEOUT)
+
+
+def flag_outliers(trials, metric, threshold=OUTLIER_THRESHOLD):
+    """
+    Flag the trials far from the other trials of the same (site, extension,
+    filterlist) by their modified z-score. The deviations from the median of the
+    site are scaled by their median (MAD) over all the sites of the configuration,
+    as a handful of trials per site is too few for a stable scale. If most
+    deviations are null, they are scaled by their mean instead (1.2533 mean
+    absolute deviation estimates the standard deviation like 1.4826 MAD).
+
+    The sites with fewer than `MIN_OUTLIER_TRIALS` trials are not flagged: both
+    trials of a pair are as far from their median, so the bad one is unknown.
+    """
+
+    by_site = trials.groupby(["site", "extension", "filterlist"], observed=True)[
+        metric
+    ]
+    deviation = (trials[metric] - by_site.transform("median")).abs()
+    checked = by_site.transform("count") >= MIN_OUTLIER_TRIALS
+
+    by_configuration = deviation.where(checked).groupby(
+        [trials["extension"], trials["filterlist"]], observed=True
+    )
+    mad = by_configuration.transform("median")
+    mean_deviation = by_configuration.transform("mean")
+
+    z = (0.6745 * deviation / mad.where(mad > 0)).fillna(
+        deviation / (1.2533 * mean_deviation.where(mean_deviation > 0))
+    )
+
+    return trials[metric].isna() | (checked & (z > threshold))
+
+
+def paired_differences(trials, metric, threshold=OUTLIER_THRESHOLD):
+    """
+    Per-site differences between each configuration and the control, paired by
+    trial, after removing the invalid (see `valid_trials`) and outlier trials
+
+    Returns:
+        differences: columns site, extension, filterlist, diff (mean over the
+            trials), control (mean over the trials) and n_trials
+        n_invalid: number of invalid trials per configuration, control included
+        n_outliers: number of outlier trials per configuration, control included
+    """
+
+    valid = valid_trials(trials)
+    n_invalid = (~valid).groupby(
+        [trials["extension"], trials["filterlist"]], observed=True
+    ).sum()
+
+    trials = trials[valid]
+    trials = trials.assign(outlier=flag_outliers(trials, metric, threshold))
+
+    n_outliers = trials.groupby(["extension", "filterlist"], observed=True)[
+        "outlier"
+    ].sum()
+
+    kept = trials[~trials["outlier"]]
+
+    control = kept[kept["extension"] == "control"][["site", "trial", metric]].rename(
+        columns={metric: "control"}
+    )
+
+    paired = kept[kept["extension"] != "control"].merge(
+        control, on=["site", "trial"], how="inner"
+    )
+    paired["diff"] = paired[metric] - paired["control"]
+
+    differences = (
+        paired.groupby(["site", "extension", "filterlist"], observed=True)
+        .agg(
+            diff=("diff", "mean"),
+            control=("control", "mean"),
+            n_trials=("trial", "nunique"),
+        )
+        .reset_index()
+    )
+
+    return differences, n_invalid, n_outliers
+
+
+def bootstrap_ci(values, statistic=np.mean, n_boot=10_000, alpha=0.05, rng=None):
+    """
+    Percentile bootstrap confidence interval of a statistic
+
+    Args:
+        values: 1-D array of observations
+        statistic: function of an array and an axis, e.g. np.mean, np.median
+        n_boot: number of resamples
+        alpha: the interval covers 1 - alpha
+        rng: numpy random generator
+
+    Returns:
+        (low, high)
+    """
+
+    values = np.asarray(values, dtype=float)
+
+    if len(values) < 2:
+        return np.nan, np.nan
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    # resample in blocks to bound the memory
+    estimates = []
+    block = max(1, 10_000_000 // len(values))
+    for start in range(0, n_boot, block):
+        size = min(block, n_boot - start)
+        samples = values[rng.integers(0, len(values), size=(size, len(values)))]
+        estimates.append(statistic(samples, axis=1))
+
+    estimates = np.concatenate(estimates)
+
+    return (
+        float(np.quantile(estimates, alpha / 2)),
+        float(np.quantile(estimates, 1 - alpha / 2)),
+    )
+
+
+def effect_sizes(diff, control):
+    """
+    Effect sizes of the paired differences
+
+    Returns:
+        cohen_dz: mean difference over the standard deviation of the differences
+        relative_median: median of the differences relative to the median control
+    """
+
+    std = np.std(diff, ddof=1) if len(diff) > 1 else np.nan
+    median_control = np.median(control)
+
+    return {
+        "cohen_dz": float(np.mean(diff) / std) if std > 0 else np.nan,
+        "relative_median": (
+            float(np.median(diff) / median_control) if median_control else np.nan
+        ),
+    }
+
+
+def analyze(trials, metrics=METRICS, n_boot=10_000, alpha=0.05, seed=0):
+    """
+    Paired comparison of each configuration with the control
+
+    Returns:
+        results: {metric: {extension: {filterlist: summary}}}
+    """
+
+    rng = np.random.default_rng(seed)
+
+    results = {}
+
+    for metric in metrics:
+        differences, n_invalid, n_outliers = paired_differences(trials, metric)
+        results[metric] = {}
+
+        for extn in extn_lst[1:]:
+            results[metric][extn] = {}
+
+            for fl in fl_lst:
+                sel = differences[
+                    (differences["extension"] == extn)
+                    & (differences["filterlist"] == fl)
+                ]
+                diff = sel["diff"].to_numpy()
+                control = sel["control"].to_numpy()
+
+                if len(diff) == 0:
+                    continue
+
+                results[metric][extn][fl] = {
+                    "n_sites": len(diff),
+                    "mean_trials": float(sel["n_trials"].mean()),
+                    "n_invalid": int(n_invalid.get((extn, fl), 0)),
+                    "n_invalid_control": int(n_invalid.get(("control", "default"), 0)),
+                    "n_outliers": int(n_outliers.get((extn, fl), 0)),
+                    "n_outliers_control": int(n_outliers.get(("control", "default"), 0)),
+                    "mean_diff": float(np.mean(diff)),
+                    "mean_ci": bootstrap_ci(diff, np.mean, n_boot, alpha, rng),
+                    "median_diff": float(np.median(diff)),
+                    "median_ci": bootstrap_ci(diff, np.median, n_boot, alpha, rng),
+                    **effect_sizes(diff, control),
+                }
+
+    return results
+
+
+def without_nan(obj):
+    """Replace the NaN by None, for a valid JSON output"""
+
+    if isinstance(obj, dict):
+        return {k: without_nan(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [without_nan(v) for v in obj]
+    if isinstance(obj, float) and np.isnan(obj):
+        return None
+
+    return obj
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_path", type=Path)
+    parser.add_argument("output_path", type=Path)
+    parser.add_argument("--metrics", nargs="+", default=METRICS, choices=METRICS)
+    parser.add_argument("--n-boot", type=int, default=10_000)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.data_path.is_dir():
+        print("Invalid path")
+        return
+
+    args.output_path.mkdir(parents=True, exist_ok=True)
+
+    trials = load_trials(args.data_path)
+    check_single_sampler(trials)
+
+    ret_data = {
+        "n_sites": int(trials["site"].nunique()),
+        "n_trials": int(trials["trial"].nunique()),
+        "n_boot": args.n_boot,
+        "alpha": args.alpha,
+        "seed": args.seed,
+        "metrics": analyze(trials, args.metrics, args.n_boot, args.alpha, args.seed),
+    }
+
+    with open(args.output_path / OUTPUT_NAME, "w") as f:
+        json.dump(without_nan(ret_data), f, cls=NpEncoder, indent=2)
+
+
+if __name__ == "__main__":
+    main()
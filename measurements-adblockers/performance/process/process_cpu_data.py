@@ -1,97 +1,85 @@
 #!/usr/bin/env python3
 # https://stackoverflow.com/questions/3748136/how-is-cpu-usage-calculated
 
-from collections import defaultdict
+"""
+Process the CPU measurements of the ad-blockers.
+
+The per-site JSON files are read once into a table with one row per (site,
+extension, filterlist), saved as `cpu_data.parquet` in the output folder. The
+statistics and plots are computed from that table, which can be passed instead
+of the data folder to re-plot without reading the JSON files again:
+
+    python3 process_cpu_data.py <OUTPUT FOLDER PATH>/cpu_data.parquet <NEW OUTPUT FOLDER PATH>
+"""
+
 from multiprocessing import Pool
 import os
 import json
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import sys
 from tqdm import tqdm
 from pathlib import Path
 
-# get the datapath from the command line
-if len(sys.argv) < 3:
-    print("Usage: python3 process_cpu_data.py <data_path> <output_path>")
-    sys.exit(1)
-
-DATA_PATH = Path(sys.argv[1])
-
-if not os.path.exists(DATA_PATH) or not os.path.isdir(DATA_PATH):
-    print("Invalid path")
-    sys.exit(1)
-
-OUTPUT_PATH = Path(sys.argv[2])
-
-# check if directory is not empty or is a file
-if os.path.exists(OUTPUT_PATH):
-    if os.path.isfile(OUTPUT_PATH):
-        print("Invalid output path")
-        sys.exit(1)
-    elif len(os.listdir(OUTPUT_PATH)) > 0:
-        print("Output path is not empty")
-        sys.exit(1)
-
-OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
-
-plt.style.use(
-    {
-        "axes.spines.left": True,
-        "axes.spines.bottom": True,
-        "axes.spines.top": False,
-        "axes.spines.right": False,
-        "xtick.bottom": True,
-        "ytick.left": True,
-        "axes.grid": True,
-        "grid.linestyle": ":",
-        "grid.linewidth": 0.5,
-        "grid.alpha": 0.5,
-        "grid.color": "k",
-        "axes.edgecolor": "k",
-        "axes.linewidth": 0.5,
-    }
-)
-
-# # use serif font
-plt.rcParams["font.family"] = "serif"
-plt.rcParams["font.serif"] = ["Times New Roman"] + plt.rcParams["font.serif"]
-
-# # change text scaling
-plt.rcParams.update({"font.size": 12})
-
-# gray scale colors
-plt.rcParams["axes.prop_cycle"] = plt.cycler(
-    color=[
-        "#000000",
-        "#999999",
-        "#666666",
-        "#333333",
-        "#666666",
-        "#999999",
-        "#000000",
-    ]
-)
-
 
 RULE_COUNTS = {
     "adguard": {"default": "1k", "mid": "4k", "all": "8k"},
     "ublock": {"default": "2k", "mid": "6k", "all": "7k"},
 }
 
+extn_lst = ["control", "ublock", "adguard"]
+
+fl_lst = ["default", "mid", "all"]
 
-def sort(feature_dict):
-    zipped = zip(
-        feature_dict[extn_lst[0]],
-        feature_dict[extn_lst[1]],
-        feature_dict[extn_lst[2]],
-        feature_dict[extn_lst[3]],
+CPU_STATS = ["usr", "sys", "iowait"]
+
+# per-site values compared between the extensions and the control
+METRICS = [
+    f"{stat}_{agg}" for stat in CPU_STATS for agg in ("max", "avg")
+] + ["domComplete", "loadEnd"]
+
+TABLE_NAME = "cpu_data.parquet"
+
+
+def setup_plot_style():
+    plt.style.use(
+        {
+            "axes.spines.left": True,
+            "axes.spines.bottom": True,
+            "axes.spines.top": False,
+            "axes.spines.right": False,
+            "xtick.bottom": True,
+            "ytick.left": True,
+            "axes.grid": True,
+            "grid.linestyle": ":",
+            "grid.linewidth": 0.5,
+            "grid.alpha": 0.5,
+            "grid.color": "k",
+            "axes.edgecolor": "k",
+            "axes.linewidth": 0.5,
+        }
+    )
+
+    # # use serif font
+    plt.rcParams["font.family"] = "serif"
+    plt.rcParams["font.serif"] = ["Times New Roman"] + plt.rcParams["font.serif"]
+
+    # # change text scaling
+    plt.rcParams.update({"font.size": 12})
+
+    # gray scale colors
+    plt.rcParams["axes.prop_cycle"] = plt.cycler(
+        color=[
+            "#000000",
+            "#999999",
+            "#666666",
+            "#333333",
+            "#666666",
+            "#999999",
+            "#000000",
+        ]
     )
-    sorted_zipped = sorted(zipped)
-    unzipped = list(zip(*sorted_zipped))
-    for i in range(len(extn_lst)):
-        feature_dict[extn_lst[i]] = list(unzipped[i])
-    return feature_dict
 
 
 class NpEncoder(json.JSONEncoder):
@@ -105,521 +93,395 @@ class NpEncoder(json.JSONEncoder):
         return super(NpEncoder, self).default(obj)
 
 
-def generate_stats_dict(data_dict):
-    websites = np.array(data_dict["websites"])
+# INGESTION
 
-    dele = defaultdict(dict)
-    d = defaultdict(dict)
 
-    ret = defaultdict(dict)
+def measurement_row(website, extn, fl, entry):
+    """
+    Flatten one measurement: the CPU load series, their max and average, the
+    page load timings and whether the measurement is faulty
 
-    colors = ["b", "g", "r"]
+    A measurement is faulty if it is missing or incomplete. The extensions are
+    also faulty when the CPU samples do not cover the page load (fewer than 4
+    mpstat cycles, or /proc samples spanning less than the load) or when the load
+    takes over 60 seconds, the control is kept as long as it is complete.
+    """
 
-    for extn in extn_lst:
-        if extn == "control":
-            continue
+    row = {"site": website, "extension": extn, "filterlist": fl}
 
-        plt.figure(figsize=(4, 3))
+    complete = entry is not None and all(
+        key in entry for key in CPU_STATS + ["webStats"]
+    )
 
-        for fl, c in tqdm(
-            zip(fl_lst, colors), desc=f"Plotting for {extn}", total=len(fl_lst)
-        ):
-            # extn_stat.append(np.array(stat_plot[1][extn]))
-            dele[extn][fl] = np.array(stat_plot[1][extn][fl])
-            d[extn][fl] = {}
+    # the last 3 mpstat cycles are recorded after the page load, the /proc
+    # sampler (with an "interval") stops at the page load
+    proc = complete and "interval" in entry
+    tail = 0 if proc else 3
 
-            # filter all -1 values from stat_plot
-            dummy = np.array(stat_plot[1]["control"]["default"])
-            index = np.where(dele[extn][fl] == -1)
+    for stat in CPU_STATS:
+        values = [float(v) for v in entry[stat]] if complete else None
 
-            np.delete(dele[extn][fl], index)
-            np.delete(dummy, index)
+        row[stat] = values
+        row[f"{stat}_max"] = max(values) if values else np.nan
+        if proc and values:
+            row[f"{stat}_avg"] = np.average(values, weights=period_weights(entry))
+        else:
+            row[f"{stat}_avg"] = (
+                np.mean(values[: len(values) - tail])
+                if values and len(values) > tail
+                else np.nan
+            )
 
-            mask2 = (np.abs(dummy) > 30000) | (dummy < 0)
+    dom_complete, load_end = entry["webStats"] if complete else (np.nan, np.nan)
+    row["domComplete"] = dom_complete
+    row["loadEnd"] = load_end
 
-            mask1 = (np.abs(dele[extn][fl]) > 30000) | (dele[extn][fl] < 0)
-            extn_stats = dele[extn][fl][~mask1 & ~mask2]
-            dummy = dummy[~mask1 & ~mask2]
+    faulty = not complete
 
-            zipped = zip((extn_stats - dummy) / dummy, websites)
-            sorted_zipped = sorted(zipped)
-            unzipped = list(zip(*sorted_zipped))
-            x = list(unzipped[1])  # x -> website
-            y = list(unzipped[0])  # y -> extn_time - ctrl_time
+    if extn != "control" and not faulty:
+        if proc:
+            covered = bool(entry["usr"]) and sampled_seconds(entry) * 1000 >= load_end
+        else:
+            covered = len(entry["usr"]) >= 4
 
-            ret[extn][fl] = np.sort(np.array(y))
+        # if the duration is larger than 60 seconds, then it is faulty
+        faulty = not covered or load_end - dom_complete > 60000
 
-            for j in range(len(x)):
-                d[extn][fl][x[j]] = y[j]
+    row["faulty"] = faulty
+    row["sampler"] = sampler(entry) if complete else None
 
-            # # plot
-            plt.plot(
-                np.sort(np.array(y) * 100),
-                label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
-                color=c,
-                linewidth=2,
-                alpha=0.7,
-            )
+    return row
 
-        plt.legend()
-        plt.title(f"Page load time difference for {extn}", fontsize=10)
-        plt.xlabel("Websites Sorted")
-        plt.ylabel("Additional Page Load Time (%)")
-        plt.yscale("log")
 
-        plt.show()
-        plt.savefig(OUTPUT_PATH / f"stat_{extn}.pdf", bbox_inches="tight")
+def period_weights(entry):
+    """Weights of the /proc samples, the last one covers a fraction of a period"""
 
-        # print the medians
-        print(f"{extn} median LOAD TIME (std) (%):")
+    weights = [1.0] * len(entry["usr"])
+    if weights:
+        weights[-1] = entry.get("last_period", 1.0)
 
-        for fl in fl_lst:
-            print(f"{fl}: {np.median(ret[extn][fl])} ({np.std(ret[extn][fl])})")
-    return ret
+    return weights
 
 
-# list of all files in /data folder
-path = str(DATA_PATH.absolute()) + "/"
-dir_list = os.listdir(path)
+def sampled_seconds(entry):
+    """Time covered by the /proc samples of a measurement, in seconds"""
 
-extn_lst = ["control", "ublock", "adguard"]
+    return entry["interval"] * sum(period_weights(entry))
 
-fl_lst = ["default", "mid", "all"]
 
-data_dict = {"websites": []}
+def sampler(entry):
+    """
+    Source of the CPU load series of a measurement: "mpstat" (1 second cycles and
+    3 cycles after the load) or "proc <interval>s" (stats.Stats)
+    """
 
-for extn in extn_lst:
-    data_dict[extn] = (
-        {}
-    )  # data_dict = {'websites': [list_of_websites], 'extn_lst[i]': [list of [usr, sys, iowait, stats]]}
+    if "interval" not in entry:
+        return "mpstat"
 
-    if extn == "control":
-        data_dict[extn]["default"] = []
-    else:
-        for fl in fl_lst:
-            data_dict[extn][fl] = []
+    return f"proc {entry['interval']:g}s"
 
 
-faulty_sites = defaultdict(dict)
-# faulty_extn = {}
-for extn in extn_lst:
-    faulty_sites[extn] = {}
+def check_single_sampler(table):
+    """The CPU loads of different samplers are not comparable, refuse to mix them"""
 
-    if extn == "control":
-        faulty_sites[extn]["default"] = []
-    else:
-        for fl in fl_lst:
-            faulty_sites[extn][fl] = []
+    if "sampler" not in table:
+        return
 
+    samplers = table["sampler"].dropna().value_counts()
 
-def check_for_keys(website_data, website):
-    # website_data -> data dict of each website, website -> website
-    global faulty_sites
+    if len(samplers) > 1:
+        raise ValueError(
+            "The measurements mix CPU load samplers, process them separately: "
+            + ", ".join(f"{name} ({n})" for name, n in samplers.items())
+        )
+
+
+def website_rows(site_fp):
+    """One row per (extension, filterlist) of a website, missing ones are faulty"""
+
+    website = site_fp.name
+
+    with open(site_fp, "r") as f:
+        stats = json.load(f)["stats"]
+
+    rows = []
 
     for extn in extn_lst:
-        if extn == "control":
-            if f"/data/{website}" not in website_data.keys():
-                faulty_sites[extn]["default"].append(website)
-                # progressbar.update(3)
-        else:
-            if extn not in website_data.keys():
+        key = f"/data/{website}" if extn == "control" else extn
+
+        for fl in ["default"] if extn == "control" else fl_lst:
+            rows.append(measurement_row(website, extn, fl, stats.get(key, {}).get(fl)))
 
-                for fl in fl_lst:
-                    faulty_sites[extn][fl].append(website)
+    return rows
 
-                # progressbar.update(3)
 
-            else:
-                for fl in fl_lst:
-                    if (
-                        fl not in website_data[extn].keys()
-                        or len(website_data[extn][fl]["usr"]) < 4
-                    ):
-                        faulty_sites[extn][fl].append(website)
-                    else:
-                        # if the duration is larger than 60 seconds, then it is faulty
-                        dur = (
-                            website_data[extn][fl]["webStats"][1]
-                            - website_data[extn][fl]["webStats"][0]
-                        )
+def build_cpu_table(data_path):
+    """Read the per-site JSON files once into a table"""
 
-                        if dur > 60000:
-                            faulty_sites[extn][fl].append(website)
-                            print(website, extn, fl, dur)
-                            print(website_data[extn][fl]["webStats"])
-                            print()
+    site_fps = [Path(entry.path) for entry in os.scandir(data_path) if entry.is_file()]
+
+    with Pool(os.cpu_count()) as p:
+        rows = [
+            row
+            for site_rows in tqdm(
+                p.imap(website_rows, site_fps, chunksize=64),
+                total=len(site_fps),
+                desc="Loading sites",
+            )
+            for row in site_rows
+        ]
+
+    table = pd.DataFrame(
+        rows,
+        columns=["site", "extension", "filterlist"]
+        + CPU_STATS
+        + METRICS
+        + ["faulty", "sampler"],
+    )
 
-                    # progressbar.update(1)
+    table["extension"] = pd.Categorical(table["extension"], categories=extn_lst)
+    table["filterlist"] = pd.Categorical(table["filterlist"], categories=fl_lst)
+    table["faulty"] = table["faulty"].astype(bool)
 
-    # progressbar.close()
+    return table
 
 
-# load all the data from the files in 1 dictionary
-all_data = {}
+def load_cpu_table(data_path, output_path):
+    """
+    Load the table of measurements, from the JSON files of a data folder (the table
+    is then saved in the output folder) or from a previously saved table
+    """
 
+    if data_path.is_file():
+        return pd.read_parquet(data_path)
 
-def load_website(website):
-    with open(path + website, "r") as f:
-        return {**json.load(f)}
+    table = build_cpu_table(data_path)
+    table.to_parquet(output_path / TABLE_NAME, index=False)
 
+    return table
 
-site_data = []
 
-with Pool(12) as p:
-    site_data = list(tqdm(p.imap(load_website, dir_list), total=len(dir_list)))
+# STATISTICS
 
-all_data = dict(zip(dir_list, site_data))
 
-# populate the faulty_sites dict
-for website in all_data:
-    check_for_keys(all_data[website]["stats"], website)
+def site_measurements(table):
+    """
+    Per-site metrics of each configuration, columns (metric, extension, filterlist).
+    Sites with a faulty control are dropped, faulty configurations take the values
+    of the control.
 
-faulty_num = {}
-for extn in extn_lst[1:]:
+    Returns:
+        the per-site metrics and the number of faulty measurements per configuration
+    """
 
-    faulty_num[extn] = {}
+    control = table[table["extension"] == "control"].set_index("site")
+    sites = control.index[~control["faulty"]]
 
-    for fl in fl_lst:
-        faulty_num[extn][fl] = 0
+    wide = table.pivot(
+        index="site", columns=["extension", "filterlist"], values=METRICS
+    ).loc[sites]
+    faulty = table.pivot(
+        index="site", columns=["extension", "filterlist"], values="faulty"
+    ).loc[sites]
 
-for website in dir_list:
-    # control case
-    key = "/data/" + website
-    data = all_data[website]
+    faulty_num = {}
 
-    if website in faulty_sites["control"]["default"]:
-        continue
     for extn in extn_lst[1:]:
+        faulty_num[extn] = {}
 
         for fl in fl_lst:
-            if website in faulty_sites[extn][fl]:
-                data["stats"][extn] = data["stats"].get(extn, {})
-                data["stats"][extn][fl] = {"webStats": [-1, -1]}
-
-    data_dict["websites"].append(website)
-
-    try:
-        usr_c = data["stats"][key]["default"]["usr"]
-        sys_c = data["stats"][key]["default"]["sys"]
-        iowait_c = data["stats"][key]["default"]["iowait"]
-        webStats_c = data["stats"][key]["default"]["webStats"]
-        data_dict["control"] = data_dict.get("control", {})
-        data_dict["control"]["default"].append([usr_c, sys_c, iowait_c, webStats_c])
-    except KeyError as k:
-        # print(website, k, "- dropping website")
-        faulty_sites += 1
-        data_dict["websites"] = data_dict["websites"][:-1]
-        continue
-
-    # extn case
-    for extn in extn_lst[1:]:  # opting out the 'control' case
-        for fl in fl_lst:
-            key = extn
-            try:
-                usr = data["stats"][key][fl]["usr"]
-                syst = data["stats"][key][fl]["sys"]
-                iowait = data["stats"][key][fl]["iowait"]
-                webStats = data["stats"][key][fl]["webStats"]
-                data_dict[extn] = data_dict.get(extn, {})
-                data_dict[extn][fl].append([usr, syst, iowait, webStats])
-            except KeyError as k:
-                usr = usr_c
-                syst = sys_c
-                iowait = iowait_c
-                webStats = webStats_c
-                data_dict[extn] = data_dict.get(extn, {})
-                data_dict[extn][fl].append([usr, syst, iowait, webStats])
-                faulty_num[extn][fl] += 1
-                # print(website, extn,  k)
-                pass
-
-print(faulty_num)  # manually removed the 0.0 extries corresponding to the number here
-
-max_plot = [{}, {}, {}]  # for usr, sys, iowait
-avg_plot = [{}, {}, {}]
-stat_plot = [{}, {}]
-
-for i in range(4):  # initialization
-    for extn in data_dict:
-
-        if extn not in extn_lst:
-            continue
-
-        for fl in data_dict[extn]:
-
-            if extn == "control" and fl != "default":
-                continue
-
-            if extn != "websites":
-                if i == 3:
-                    stat_plot[0][extn] = stat_plot[0].get(extn, {})
-                    stat_plot[1][extn] = stat_plot[1].get(extn, {})
-                    stat_plot[0][extn][fl] = []
-                    stat_plot[1][extn][fl] = []
-                else:
-                    max_plot[i][extn] = max_plot[i].get(extn, {})
-                    avg_plot[i][extn] = avg_plot[i].get(extn, {})
-                    max_plot[i][extn][fl] = []
-                    avg_plot[i][extn][fl] = []
-
-for i in range(len(data_dict["control"]["default"])):
-    for extn in data_dict:
-
-        if extn not in extn_lst:
-            continue
-
-        for fl in data_dict[extn]:
-
-            if extn == "control" and fl != "default":
-                continue
-
-            for j in range(4):
-                if extn != "websites":
-
-                    if j == 3:
-                        # # filter out -1 values from stat_plot
-                        # if data_dict[extn][i][j][0] == -1 or data_dict[extn][i][j][1] == -1:
-                        #     continue
-
-                        stat_plot[0][extn][fl].append(data_dict[extn][fl][i][j][0])
-                        stat_plot[1][extn][fl].append(data_dict[extn][fl][i][j][1])
-                    else:
-
-                        try:
-                            # max
-                            max_plot[j][extn][fl].append(max(data_dict[extn][fl][i][j]))
-
-                            # avg
-                            avg_plot[j][extn][fl].append(
-                                sum(data_dict[extn][fl][i][j][:-3])
-                                / len(data_dict[extn][fl][i][j][:-3])
-                            )  # can do [:-1] so that last entry can be ignored (which would mostly be close to 0) bcoz I did run mpstat for 5 extra cycle
-                        except Exception as e:
-                            print(e, extn, fl, i, j)
-                            print(data_dict[extn][fl][i])
-
-                            raise e
-
-
-# generate_stats_dict(data_dict)
-
-avg_np = {}
-max_np = {}
-for extn in extn_lst:
-
-    for fl in fl_lst:
-
-        if extn == "control" and fl != "default":
-            continue
-
-        avg_np[extn] = avg_np.get(extn, {})
-        max_np[extn] = max_np.get(extn, {})
-        avg_np[extn][fl] = np.array(avg_plot[0][extn][fl])  # 0 - usr, 1 - sys
-        max_np[extn][fl] = np.array(max_plot[0][extn][fl])  # 0 - usr, 1 - sys
-        # sys_avg[extn] = np.array(avg_plot[1][extn]) # 0 - usr, 1 - sys
-        # sys_max[extn] = np.array(max_plot[1][extn]) # 0 - usr, 1 - sys
+            is_faulty = faulty[(extn, fl)].astype(bool)
+            faulty_num[extn][fl] = int(is_faulty.sum())
 
+            for metric in METRICS:
+                wide[(metric, extn, fl)] = wide[(metric, extn, fl)].where(
+                    ~is_faulty, wide[(metric, "control", "default")]
+                )
 
-def plot_max():
-    median_lst = []
-    mean_lst = []
+    return wide, faulty_num
 
-    colors = ["b", "g", "r"]
-    for extn in max_np.keys():
 
-        if extn not in extn_lst:
-            continue
+def relative_to_control(wide, metric, extn, fl):
+    return (
+        wide[(metric, extn, fl)] - wide[(metric, "control", "default")]
+    ).to_numpy()
 
-        if extn != "control":
-            plt.figure()
 
-            for fl, c in zip(fl_lst, colors):
-                median_lst.append(
-                    np.median(max_np[extn][fl] - max_np["control"]["default"])
-                )
-                mean_lst.append(
-                    np.mean(max_np[extn][fl] - max_np["control"]["default"])
-                )
-                # print('max')
-                # print(f'median -> {median_lst}')
-                # print(f'mean -> {mean_lst}')
-                plt.plot(
-                    np.sort(max_np[extn][fl] - max_np["control"]["default"]),
-                    label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
-                    color=c,
-                )
-                plt.axhline(
-                    np.median(max_np[extn][fl] - max_np["control"]["default"]),
-                    linestyle="dashed",
-                    color=c,
-                )
+def generate_stats_dict(wide, output_path):
+    ret = {}
 
-            plt.legend()
-            plt.title(
-                f"Maximum CPU Additional Usage Relative to Control for {extn}",
-                fontsize=10,
-            )
-            plt.xlabel("Sorted Website")
-            plt.ylabel("CPU Usage (%)")
-            # plt.yscale('log')
+    colors = ["b", "g", "r"]
 
-            plt.show()
-            plt.savefig(OUTPUT_PATH / f"max_{extn}.pdf")
+    for extn in extn_lst[1:]:
 
+        ret[extn] = {}
 
-def plot_avg():
-    median_lst = []
-    mean_lst = []
-    colors = ["b", "g", "r"]
+        plt.figure(figsize=(4, 3))
 
-    for extn in avg_np.keys():
+        for fl, c in zip(fl_lst, colors):
 
-        if extn not in extn_lst:
-            continue
+            extn_stats = wide[("loadEnd", extn, fl)].to_numpy()
+            dummy = wide[("loadEnd", "control", "default")].to_numpy()
 
-        if extn != "control":
+            # filter out failed and timed out page loads
+            mask2 = (np.abs(dummy) > 30000) | (dummy < 0)
+            mask1 = (np.abs(extn_stats) > 30000) | (extn_stats < 0)
 
-            plt.figure()
-            for fl, c in zip(fl_lst, colors):
-                median_lst.append(
-                    np.median(avg_np[extn][fl] - avg_np["control"]["default"])
-                )
-                mean_lst.append(
-                    np.mean(avg_np[extn][fl] - avg_np["control"]["default"])
-                )
+            extn_stats = extn_stats[~mask1 & ~mask2]
+            dummy = dummy[~mask1 & ~mask2]
 
-                plt.plot(
-                    np.sort(avg_np[extn][fl] - avg_np["control"]["default"]),
-                    label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
-                    color=c,
-                )
-                plt.axhline(
-                    np.median(avg_np[extn][fl] - avg_np["control"]["default"]),
-                    linestyle="dashed",
-                    color=c,
-                )
+            # y -> extn_time - ctrl_time, relative to ctrl_time
+            ret[extn][fl] = np.sort((extn_stats - dummy) / dummy)
 
-            plt.legend()
-            plt.title(
-                f"Average CPU Additional Usage Relative to Control for {extn}",
-                fontsize=10,
+            # # plot
+            plt.plot(
+                ret[extn][fl] * 100,
+                label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
+                color=c,
+                linewidth=2,
+                alpha=0.7,
             )
-            plt.xlabel("Sorted Website")
-            plt.ylabel("CPU Usage (%)")
-            # plt.yscale('log')
 
-            plt.show()
-            plt.savefig(OUTPUT_PATH / f"avg_{extn}.pdf")
+        plt.legend()
+        plt.title(f"Page load time difference for {extn}", fontsize=10)
+        plt.xlabel("Websites Sorted")
+        plt.ylabel("Additional Page Load Time (%)")
+        plt.yscale("log")
 
-            # print the medians
-            print(f"{extn} median CPU USAGE (std):")
+        plt.show()
+        plt.savefig(output_path / f"stat_{extn}.pdf", bbox_inches="tight")
 
-            for fl in fl_lst:
-                print(
-                    f"{fl}: {np.median(avg_np[extn][fl] - avg_np['control']['default'])} ({np.std(avg_np[extn][fl] - avg_np['control']['default'])})"
-                )
+        # print the medians
+        print(f"{extn} median LOAD TIME (std) (%):")
 
+        for fl in fl_lst:
+            print(f"{fl}: {np.median(ret[extn][fl])} ({np.std(ret[extn][fl])})")
 
-plot_max()
-plot_avg()
+    return ret
 
-ret_data = defaultdict(dict)
-usr_max = defaultdict(dict)
-usr_avg = defaultdict(dict)
-sys_max = defaultdict(dict)
-sys_avg = defaultdict(dict)
-cpu_avg = defaultdict(dict)
-load_time = defaultdict(dict)
 
-# print(np.max(avg_plot[0]['control']))
-# print(np.min(avg_plot[0]['control']))
+def plot_max(wide, output_path):
+    colors = ["b", "g", "r"]
 
-progressbar = tqdm(total=len(extn_lst) * len(fl_lst), desc="Generating Statistics")
-for extn in extn_lst[1:]:
+    for extn in extn_lst[1:]:
+        plt.figure()
 
-    for fl in fl_lst:
+        for fl, c in zip(fl_lst, colors):
+            usr_max = relative_to_control(wide, "usr_max", extn, fl)
 
-        usr_max[extn][fl] = np.sort(
-            np.array(max_plot[0][extn][fl])
-            - np.array(max_plot[0]["control"]["default"])
-        )
-        usr_avg[extn][fl] = np.sort(
-            np.array(avg_plot[0][extn][fl])
-            - np.array(avg_plot[0]["control"]["default"])
-        )
-        sys_max[extn][fl] = np.sort(
-            np.array(max_plot[1][extn][fl])
-            - np.array(max_plot[1]["control"]["default"])
-        )
-        sys_avg[extn][fl] = np.sort(
-            np.array(avg_plot[1][extn][fl])
-            - np.array(avg_plot[1]["control"]["default"])
-        )
-        cpu_avg[extn][fl] = np.sort(
-            np.array(avg_plot[0][extn][fl])
-            + np.array(avg_plot[1][extn][fl])
-            - np.array(avg_plot[0]["control"]["default"])
+            plt.plot(
+                np.sort(usr_max),
+                label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
+                color=c,
+            )
+            plt.axhline(np.median(usr_max), linestyle="dashed", color=c)
+
+        plt.legend()
+        plt.title(
+            f"Maximum CPU Additional Usage Relative to Control for {extn}",
+            fontsize=10,
         )
+        plt.xlabel("Sorted Website")
+        plt.ylabel("CPU Usage (%)")
+        # plt.yscale('log')
+
+        plt.show()
+        plt.savefig(output_path / f"max_{extn}.pdf")
 
-        progressbar.update(1)
 
-progressbar.close()
+def plot_avg(wide, output_path):
+    colors = ["b", "g", "r"]
 
-ret_data["usr_max"] = usr_max
-ret_data["usr_avg"] = usr_avg
-ret_data["sys_max"] = sys_max
-ret_data["sys_avg"] = sys_avg
-ret_data["cpu_avg"] = cpu_avg
-ret_data["load_time"] = generate_stats_dict(data_dict)
+    for extn in extn_lst[1:]:
+        plt.figure()
 
-with open(OUTPUT_PATH / "plot_performance.json", "w") as f:
-    json.dump(ret_data, f, cls=NpEncoder)
+        for fl, c in zip(fl_lst, colors):
+            usr_avg = relative_to_control(wide, "usr_avg", extn, fl)
 
+            plt.plot(
+                np.sort(usr_avg),
+                label=f"{fl}: {RULE_COUNTS[extn][fl]} rules",
+                color=c,
+            )
+            plt.axhline(np.median(usr_avg), linestyle="dashed", color=c)
 
-# Plot the faulty site distribution across filter lists
+        plt.legend()
+        plt.title(
+            f"Average CPU Additional Usage Relative to Control for {extn}",
+            fontsize=10,
+        )
+        plt.xlabel("Sorted Website")
+        plt.ylabel("CPU Usage (%)")
+        # plt.yscale('log')
 
+        plt.show()
+        plt.savefig(output_path / f"avg_{extn}.pdf")
 
-def plot_faulty_sites():
+        # print the medians
+        print(f"{extn} median CPU USAGE (std):")
 
-    colors = ["b", "g", "r"]
+        for fl in fl_lst:
+            usr_avg = relative_to_control(wide, "usr_avg", extn, fl)
+            print(f"{fl}: {np.median(usr_avg)} ({np.std(usr_avg)})")
 
-    # should be a matrix
-    #               | fails for all | doesn't fail for all|
-    # |fails for mid |              |                     |
-    # |doesn't fail for mid|        |                     |
+
+def performance_stats(wide):
+    """Sorted per-site differences to the control of each configuration"""
+
+    ret_data = {
+        "usr_max": {},
+        "usr_avg": {},
+        "sys_max": {},
+        "sys_avg": {},
+        "cpu_avg": {},
+    }
 
     for extn in extn_lst[1:]:
+        for name in ret_data:
+            ret_data[name][extn] = {}
 
-        matrix = np.zeros((2, 2))
+        for fl in fl_lst:
+            for name in ["usr_max", "usr_avg", "sys_max", "sys_avg"]:
+                ret_data[name][extn][fl] = np.sort(
+                    relative_to_control(wide, name, extn, fl)
+                )
+
+            ret_data["cpu_avg"][extn][fl] = np.sort(
+                (
+                    wide[("usr_avg", extn, fl)]
+                    + wide[("sys_avg", extn, fl)]
+                    - wide[("usr_avg", "control", "default")]
+                ).to_numpy()
+            )
 
-        sites_faulty_for_control = set(faulty_sites["control"]["default"])
-        sites_faulty_for_default = set(faulty_sites[extn]["default"])
+    return ret_data
 
-        site_failures = defaultdict(set)
 
-        for fl in fl_lst[1:]:
+# Plot the faulty site distribution across filter lists
 
-            for site in faulty_sites[extn][fl]:
 
-                if site in sites_faulty_for_default:
-                    continue
+def plot_faulty_sites(table):
 
-                site_failures[site].add(fl)
+    # should be a matrix
+    #               | fails for all | doesn't fail for all|
+    # |fails for mid |              |                     |
+    # |doesn't fail for mid|        |                     |
 
-        for site in site_failures:
+    faulty = table.pivot(
+        index="site", columns=["extension", "filterlist"], values="faulty"
+    ).astype(bool)
 
-            if len(site_failures[site]) == 0:
-                matrix[1][1] += 1
-            else:
+    for extn in extn_lst[1:]:
 
-                if "mid" in site_failures[site] and "all" in site_failures[site]:
-                    matrix[0][0] += 1
+        matrix = np.zeros((2, 2))
 
-                elif "mid" in site_failures[site]:
-                    matrix[0][1] += 1
+        # sites that fail for mid or all, but not for default
+        fails_mid = faulty[(extn, "mid")] & ~faulty[(extn, "default")]
+        fails_all = faulty[(extn, "all")] & ~faulty[(extn, "default")]
 
-                elif "all" in site_failures[site]:
-                    matrix[1][0] += 1
+        matrix[0][0] = (fails_mid & fails_all).sum()
+        matrix[0][1] = (fails_mid & ~fails_all).sum()
+        matrix[1][0] = (~fails_mid & fails_all).sum()
 
         # make it latex table
 
@@ -641,7 +503,56 @@ def plot_faulty_sites():
         print(matrix)
 
 
-plot_faulty_sites()
+def main():
+
+    # get the datapath from the command line
+    if len(sys.argv) < 3:
+        print(
+            "Usage: python3 process_cpu_data.py <data_path | cpu_data.parquet> <output_path>"
+        )
+        sys.exit(1)
+
+    data_path = Path(sys.argv[1])
+
+    if not os.path.exists(data_path) or not (
+        os.path.isdir(data_path) or data_path.suffix == ".parquet"
+    ):
+        print("Invalid path")
+        sys.exit(1)
+
+    output_path = Path(sys.argv[2])
+
+    # check if directory is not empty or is a file
+    if os.path.exists(output_path):
+        if os.path.isfile(output_path):
+            print("Invalid output path")
+            sys.exit(1)
+        elif len(os.listdir(output_path)) > 0:
+            print("Output path is not empty")
+            sys.exit(1)
+
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    setup_plot_style()
+
+    table = load_cpu_table(data_path, output_path)
+    check_single_sampler(table)
+
+    wide, faulty_num = site_measurements(table)
+
+    print(faulty_num)  # manually removed the 0.0 extries corresponding to the number here
+
+    plot_max(wide, output_path)
+    plot_avg(wide, output_path)
+
+    ret_data = performance_stats(wide)
+    ret_data["load_time"] = generate_stats_dict(wide, output_path)
+
+    with open(output_path / "plot_performance.json", "w") as f:
+        json.dump(ret_data, f, cls=NpEncoder)
+
+    plot_faulty_sites(table)
 
 
-sys.exit(0)
+if __name__ == "__main__":
+    main()
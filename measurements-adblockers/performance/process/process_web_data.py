@@ -1,3 +1,18 @@
+"""
+Process the web feature data.
+
+Each `stats.json` of the data folder is visited once and reduced to one row of
+feature counts, kept with the file modification time in
+`<output_path>/web_features.parquet`. A rerun only processes the sites added or
+modified since, and the statistics are computed from the table.
+
+The postMessage and message listener counts (n_post, n_listen) depend on when
+the logger was installed, given by `message_log_start`: "after_load" for the
+first crawls (2 seconds after the page load), "document_start" for the crawls
+with the single collector script (version 2), which also count the messages of
+the page load. They should not be compared across the two.
+"""
+
 import os
 from pathlib import Path
 import json
@@ -9,72 +24,223 @@ from multiprocessing import Pool
 
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 
+TABLE_NAME = "web_features.parquet"
 
-# get the datapath from the command line
-if len(sys.argv) < 3:
-    print("Usage: python3 process_web_data.py <data_path> <output_path>")
-    sys.exit(1)
+# sites reduced to rows at once
+CHUNK_SIZE = 10_000
 
-DATA_PATH = Path(sys.argv[1])
+# "background" of elements without a background
+NO_BACKGROUND = "rgba(0, 0, 0, 0) none repeat scroll 0% 0% / auto padding-box border-box"
 
-if not os.path.exists(DATA_PATH) or not os.path.isdir(DATA_PATH):
-    print("Invalid path")
-    sys.exit(1)
 
-OUTPUT_PATH = Path(sys.argv[2])
+def site_features(site_fp, mtime_ns):
+    """Reduce the web data of a site to its feature counts"""
 
-if not os.path.exists(OUTPUT_PATH) or not os.path.isdir(OUTPUT_PATH):
-    print("Invalid path")
-    sys.exit(1)
+    website = str(site_fp).split("/webdata/")[1].split("/stats.json")[0]
 
-OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+    with open(site_fp, "r") as f:
+        site = json.loads(f.read())
+
+    if site.get("version") == 2:
+        return compact_site_features(site, website, site_fp, mtime_ns)
+
+    row = {
+        "site": website,
+        "path": str(site_fp),
+        "mtime_ns": mtime_ns,
+        "n_lazy": site["lazy_loading"]["count"]["lazy"],
+        "n_lazy_total": site["lazy_loading"]["count"]["total"],
+        "n_container": 0,
+        "n_style_container": 0,
+        "n_image": site["image_alt"]["count"]["total"],
+        "n_image_alt": site["image_alt"]["count"]["withAlt"],
+        "n_image_alt_bg": 0,
+        "n_image_alt_bg_img": 0,
+        "n_iframe": site["iframe_post_message"]["count"]["iframes"],
+        "n_listen": site["iframe_post_message"]["count"]["listenMessage"],
+        "n_post": site["iframe_post_message"]["count"]["postMessage"],
+        "n_static_post": site["iframe_post_message"]["count"]["staticPostMessage"],
+        "message_log_start": "after_load",
+        "has_animation": False,
+        "n_animations": 0,
+        "n_background": 0,
+        "n_background_image": 0,
+        "n_makes_request": 0,
+    }
 
+    if site["container_style"]:
+        row["n_container"] = len(site["container_style"])
+        row["n_style_container"] = sum(
+            [1 for style in site["container_style"] if style["hasStyle"] is True]
+        )
 
-def load_website(site_fp):
-    website = str(site_fp).split("/webdata/")[1].split("/stats.json")[0]
-    with open(site_fp, "r") as f:
-        return {**json.loads(f.read()), "website": website}
+    if row["n_image"] > 0:
+        for match in site["image_alt"]["matches"]:
+
+            # if the "background" value starts with rgba(0,0,0,0) ignore
+            if (
+                "background" in match["style"]
+                and match["style"]["background"] == NO_BACKGROUND
+            ):
+                continue
 
+            if "background-image" in match["style"]:
+                row["n_image_alt_bg_img"] += 1
 
-site_data = []
+            elif (
+                "background" in match["style"] and "url" in match["style"]["background"]
+            ):
+                row["n_image_alt_bg_img"] += 1
+
+            row["n_image_alt_bg"] += 1
+
+    if "animation" in site:
+        try:
+            row |= {
+                "has_animation": True,
+                "n_animations": len(site["animation"]),
+                "n_background": len([f for f in site["animation"] if f["hasBackground"]]),
+                "n_background_image": len(
+                    [f for f in site["animation"] if f["hasBackgroundImage"]]
+                ),
+                "n_makes_request": len(
+                    [f for f in site["animation"] if f["makesRequest"]]
+                ),
+            }
+        except Exception as e:
+            print(site["animation"])
+            print(e)
 
-with Pool(12) as p:
-    site_data = list(
-        tqdm(p.imap(load_website, DATA_PATH.rglob("stats.json")), total=30000)
+    return row
+
+
+def compact_site_features(site, website, site_fp, mtime_ns):
+    """Feature counts of a site crawled with the single collector script (version 2)"""
+
+    image_alt = site["image_alt"]["count"]
+    iframe_post_message = site["iframe_post_message"]["count"]
+    animation = site["animation"]["count"]
+
+    return {
+        "site": website,
+        "path": str(site_fp),
+        "mtime_ns": mtime_ns,
+        "n_lazy": site["lazy_loading"]["count"]["lazy"],
+        "n_lazy_total": site["lazy_loading"]["count"]["total"],
+        "n_container": site["container_style"]["count"]["total"],
+        "n_style_container": site["container_style"]["count"]["style"],
+        "n_image": image_alt["total"],
+        "n_image_alt": image_alt["withAlt"],
+        "n_image_alt_bg": image_alt["background"],
+        "n_image_alt_bg_img": image_alt["backgroundImage"],
+        "n_iframe": iframe_post_message["iframes"],
+        "n_listen": iframe_post_message["listenMessage"],
+        "n_post": iframe_post_message["postMessage"],
+        "n_static_post": iframe_post_message["staticPostMessage"],
+        "message_log_start": site["iframe_post_message"].get(
+            "messageLogStart", "document_start"
+        ),
+        "has_animation": True,
+        "n_animations": animation["total"],
+        "n_background": animation["background"],
+        "n_background_image": animation["backgroundImage"],
+        "n_makes_request": animation["makesRequest"],
+    }
+
+
+def _site_features(args):
+    return site_features(*args)
+
+
+def update_feature_table(data_path, table_fp):
+    """
+    Bring the feature table up to date with the data folder: only the sites
+    added or modified since the last run are read, removed sites are dropped
+
+    Args:
+        data_path: folder with a `<site>/stats.json` per site
+        table_fp: feature table, created if missing
+
+    Returns:
+        the feature table, one row per site
+    """
+
+    table = pd.read_parquet(table_fp) if table_fp.exists() else None
+    known = (
+        {}
+        if table is None
+        else dict(zip(table["path"], table["mtime_ns"].tolist()))
     )
 
+    seen = set()
 
-print(f"Number of successful sites: {len(site_data)}")
+    def _changed_sites():
+        for site_fp in data_path.rglob("stats.json"):
+            path = str(site_fp)
+            mtime_ns = site_fp.stat().st_mtime_ns
 
+            seen.add(path)
 
-def lazy_loading_stats(site_data):
+            if known.get(path) != mtime_ns:
+                yield site_fp, mtime_ns
 
-    # | site | n_lazy | n_total | n_percent | has_lazy |
+    chunks = []
+    rows = []
 
-    lazy_loading = []
-    no_image_sites = 0
+    with Pool(12) as p:
+        for row in tqdm(
+            p.imap_unordered(_site_features, _changed_sites(), chunksize=64),
+            desc="New or modified sites",
+        ):
+            rows.append(row)
 
-    for site in site_data:
+            if len(rows) == CHUNK_SIZE:
+                chunks.append(pd.DataFrame(rows))
+                rows = []
 
-        # consider a site with no image as outlier
-        if site["lazy_loading"]["count"]["total"] == 0:
-            no_image_sites += 1
-            continue
+    if rows:
+        chunks.append(pd.DataFrame(rows))
 
-        lazy_loading.append(
-            {
-                "site": site["website"],
-                "n_lazy": site["lazy_loading"]["count"]["lazy"],
-                "n_total": site["lazy_loading"]["count"]["total"],
-                "n_percent": site["lazy_loading"]["count"]["lazy"]
-                / site["lazy_loading"]["count"]["total"],
-                "has_lazy": site["lazy_loading"]["count"]["lazy"] > 0,
-            }
+    n_updated = sum(len(chunk) for chunk in chunks)
+
+    if table is not None:
+        # keep the sites that are still there and were not updated
+        updated = set()
+        for chunk in chunks:
+            updated.update(chunk["path"])
+
+        keep = table["path"].isin(seen) & ~table["path"].isin(updated)
+        print(
+            f"Sites: {keep.sum()} unchanged, {n_updated} new or modified, {(~table['path'].isin(seen)).sum()} removed"
         )
+        chunks.insert(0, table[keep])
+
+    if not chunks:
+        raise ValueError(f"No stats.json found in {data_path}")
+
+    table = pd.concat(chunks, ignore_index=True).sort_values("site", ignore_index=True)
+
+    # write then rename so an interruption leaves the previous table
+    table.to_parquet(table_fp.with_suffix(".tmp"), index=False)
+    os.replace(table_fp.with_suffix(".tmp"), table_fp)
+
+    return table
+
+
+def lazy_loading_stats(table, output_path):
+
+    # | site | n_lazy | n_total | n_percent | has_lazy |
+
+    # consider a site with no image as outlier
+    no_image_sites = int((table["n_lazy_total"] == 0).sum())
 
-    lazy_loading_df = pd.DataFrame(lazy_loading)
+    lazy_loading_df = table.loc[
+        table["n_lazy_total"] != 0, ["site", "n_lazy", "n_lazy_total"]
+    ].rename(columns={"n_lazy_total": "n_total"})
+    lazy_loading_df["n_percent"] = lazy_loading_df["n_lazy"] / lazy_loading_df["n_total"]
+    lazy_loading_df["has_lazy"] = lazy_loading_df["n_lazy"] > 0
 
-    lazy_loading_df.to_csv(OUTPUT_PATH / "lazy_loading_stats.csv", index=False)
+    lazy_loading_df.to_csv(output_path / "lazy_loading_stats.csv", index=False)
 
     print("-------------------------")
     print("LAZY LOADING STATS")
@@ -115,40 +281,11 @@ def lazy_loading_stats(site_data):
     }
 
 
-def container_style_stats(site_data):
-
-    container_styles = []
-
-    for site in site_data:
-
-        if site["container_style"]:
-
-            container_styles.append(
-                {
-                    "site": site["website"],
-                    "n_container": len(site["container_style"]),
-                    "n_style_container": sum(
-                        [
-                            1
-                            for style in site["container_style"]
-                            if style["hasStyle"] is True
-                        ]
-                    ),
-                }
-            )
-
-        else:
-            container_styles.append(
-                {
-                    "site": site["website"],
-                    "n_container": 0,
-                    "n_style_container": 0,
-                }
-            )
+def container_style_stats(table, output_path):
 
-    container_styles_df = pd.DataFrame(container_styles)
+    container_styles_df = table[["site", "n_container", "n_style_container"]]
 
-    container_styles_df.to_csv(OUTPUT_PATH / "container_style_stats.csv", index=False)
+    container_styles_df.to_csv(output_path / "container_style_stats.csv", index=False)
 
     print("-------------------------")
     print("CONTAINER STYLE STATS")
@@ -197,59 +334,22 @@ def container_style_stats(site_data):
     }
 
 
-def image_alt_stats(site_data):
-
-    image_alts = []
-    site_no_image = 0
-
-    for site in site_data:
-
-        if site["image_alt"]["count"]["total"] == 0:
-            site_no_image += 1
-            continue
-
-        image_with_alt_bg = 0
-        image_with_alt_bg_img = 0
-
-        for match in site["image_alt"]["matches"]:
-
-            # if the "background" value starts with rgba(0,0,0,0) ignore
-            if (
-                "background" in match["style"]
-                and match["style"]["background"]
-                == "rgba(0, 0, 0, 0) none repeat scroll 0% 0% / auto padding-box border-box"
-            ):
-                continue
+def image_alt_stats(table, output_path):
 
-            if "background-image" in match["style"]:
-                image_with_alt_bg_img += 1
+    site_no_image = int((table["n_image"] == 0).sum())
 
-            elif (
-                "background" in match["style"] and "url" in match["style"]["background"]
-            ):
-                image_with_alt_bg_img += 1
+    image_alts_df = table.loc[
+        table["n_image"] != 0,
+        ["site", "n_image", "n_image_alt", "n_image_alt_bg", "n_image_alt_bg_img"],
+    ]
 
-            image_with_alt_bg += 1
-
-        image_alts.append(
-            {
-                "site": site["website"],
-                "n_image": site["image_alt"]["count"]["total"],
-                "n_image_alt": site["image_alt"]["count"]["withAlt"],
-                "n_image_alt_bg": image_with_alt_bg,
-                "n_image_alt_bg_img": image_with_alt_bg_img,
-            }
-        )
-
-    image_alts_df = pd.DataFrame(image_alts)
-
-    image_alts_df.to_csv(OUTPUT_PATH / "image_alt_stats.csv", index=False)
+    image_alts_df.to_csv(output_path / "image_alt_stats.csv", index=False)
 
     print("-------------------------")
     print("IMAGE ALT STATS")
     print(f"Number of sites with no image: {site_no_image}")
     print(
-        f"Number of sites with image: {len(image_alts_df)} / {len(site_data)} ({len(image_alts_df) / len(site_data) * 100:.2f}%)"
+        f"Number of sites with image: {len(image_alts_df)} / {len(table)} ({len(image_alts_df) / len(table) * 100:.2f}%)"
     )
     print(
         f"Number of sites with image alt: {len(image_alts_df[image_alts_df['n_image_alt'] > 0])} / {len(image_alts_df)} ({len(image_alts_df[image_alts_df['n_image_alt'] > 0]) / len(image_alts_df) * 100:.2f}%)"
@@ -314,32 +414,23 @@ def image_alt_stats(site_data):
     }
 
 
-def iframe_post_message_stats(site_data):
-
-    iframe_post_message = []
-
-    for site in site_data:
-
-        iframe_post_message.append(
-            {
-                "site": site["website"],
-                "n_iframe": site["iframe_post_message"]["count"]["iframes"],
-                "n_listen": site["iframe_post_message"]["count"]["listenMessage"],
-                "n_post": site["iframe_post_message"]["count"]["postMessage"],
-                "n_static_post": site["iframe_post_message"]["count"][
-                    "staticPostMessage"
-                ],
-            }
-        )
+def iframe_post_message_stats(table, output_path):
 
-    iframe_post_message_df = pd.DataFrame(iframe_post_message)
+    iframe_post_message_df = table[
+        ["site", "n_iframe", "n_listen", "n_post", "n_static_post"]
+    ]
 
     iframe_post_message_df.to_csv(
-        OUTPUT_PATH / "iframe_post_message_stats.csv", index=False
+        output_path / "iframe_post_message_stats.csv", index=False
     )
 
     print("-------------------------")
     print("IFRAME POST MESSAGE STATS")
+    if "message_log_start" in table and table["message_log_start"].nunique() > 1:
+        print(
+            "Warning: the message counts mix crawls logging from the document start "
+            "and from after the load"
+        )
     print(
         f"Number of sites with iframe: {len(iframe_post_message_df[iframe_post_message_df['n_iframe'] > 0])} / {len(iframe_post_message_df)} ({len(iframe_post_message_df[iframe_post_message_df['n_iframe'] > 0]) / len(iframe_post_message_df) * 100:.2f}%)"
     )
@@ -423,36 +514,20 @@ def iframe_post_message_stats(site_data):
     }
 
 
-def animation_stats(site_data):
-
-    stats = []
-
-    for site in site_data:
-        
-        if "animation" not in site:
-            continue
+def animation_stats(table, output_path):
 
-        try:
-            stats.append(
-                {
-                    "site": site["website"],
-                    "n_animations": len(site["animation"]),
-                    "n_background": len([f for f in site["animation"] if f["hasBackground"]]),
-                    "n_background_image": len(
-                        [f for f in site["animation"] if f["hasBackgroundImage"]]
-                    ),
-                    "n_makes_request": len(
-                        [f for f in site["animation"] if f["makesRequest"]]
-                    ),
-                }
-            )
-        except Exception as e:
-            print(site['animation'])
-            print(e)
+    stats_df = table.loc[
+        table["has_animation"],
+        [
+            "site",
+            "n_animations",
+            "n_background",
+            "n_background_image",
+            "n_makes_request",
+        ],
+    ]
 
-    stats_df = pd.DataFrame(stats)
-
-    stats_df.to_csv(OUTPUT_PATH / "animation_stats.csv", index=False)
+    stats_df.to_csv(output_path / "animation_stats.csv", index=False)
 
     print("-------------------------")
     print("ANIMATION STATS")
@@ -547,14 +622,41 @@ def make_json_serializable(obj):
     return obj
 
 
-stats = {
-    "n_sites": len(site_data),
-}
-stats["lazy_loading"] = lazy_loading_stats(site_data)
-stats["container_style"] = container_style_stats(site_data)
-stats["image_alt"] = image_alt_stats(site_data)
-stats["iframe_post_message"] = iframe_post_message_stats(site_data)
-stats["animation"] = animation_stats(site_data)
+def main():
+
+    # get the datapath from the command line
+    if len(sys.argv) < 3:
+        print("Usage: python3 process_web_data.py <data_path> <output_path>")
+        sys.exit(1)
+
+    data_path = Path(sys.argv[1])
+
+    if not os.path.exists(data_path) or not os.path.isdir(data_path):
+        print("Invalid path")
+        sys.exit(1)
+
+    output_path = Path(sys.argv[2])
+
+    if not os.path.exists(output_path) or not os.path.isdir(output_path):
+        print("Invalid path")
+        sys.exit(1)
+
+    table = update_feature_table(data_path, output_path / TABLE_NAME)
+
+    print(f"Number of successful sites: {len(table)}")
+
+    stats = {
+        "n_sites": len(table),
+    }
+    stats["lazy_loading"] = lazy_loading_stats(table, output_path)
+    stats["container_style"] = container_style_stats(table, output_path)
+    stats["image_alt"] = image_alt_stats(table, output_path)
+    stats["iframe_post_message"] = iframe_post_message_stats(table, output_path)
+    stats["animation"] = animation_stats(table, output_path)
+
+    with open(output_path / "stats.json", "w") as f:
+        f.write(json.dumps(make_json_serializable(stats), indent=4))
+
 
-with open(OUTPUT_PATH / "stats.json", "w") as f:
-    f.write(json.dumps(make_json_serializable(stats), indent=4))
+if __name__ == "__main__":
+    main()
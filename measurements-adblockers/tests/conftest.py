@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the scripts import their neighbours by module name, as when run from their folder
+PERFORMANCE = os.path.join(os.path.dirname(__file__), "..", "performance")
+
+for folder in ("docker", "docker/chrome", "process"):
+    sys.path.insert(0, os.path.abspath(os.path.join(PERFORMANCE, folder)))
@@ -0,0 +1,139 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import logging
+import socketserver
+import threading
+import time
+
+import pytest
+
+from docker_stats import Collector, ram_by_site
+
+CONTAINERS = [
+    {"Id": "c1", "Names": ["/ublock_example.com"]},
+    {"Id": "c2", "Names": ["/busy"]},
+]
+
+
+def make_stats(i):
+    return {
+        "read": f"2024-01-01T00:00:{i:02d}Z",
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": 100 * (i + 1)},
+            "system_cpu_usage": 1000 * (i + 1),
+            "online_cpus": 1,
+        },
+        # the first reading has no previous reading
+        "precpu_stats": (
+            {"cpu_usage": {"total_usage": 100 * i}, "system_cpu_usage": 1000 * i}
+            if i
+            else {}
+        ),
+        "memory_stats": {"usage": (10 + i) * 2**20, "stats": {"inactive_file": 0}},
+        "networks": {"eth0": {"rx_bytes": i, "tx_bytes": 2 * i}},
+    }
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+
+    # readings of each container, "busy" streams until the client leaves
+    readings = {"c1": 3, "c2": 10_000}
+    # containers whose stream ended are not running anymore
+    exited = set()
+
+    def do_GET(self):
+        if self.path == "/containers/json":
+            running = [c for c in CONTAINERS if c["Id"] not in self.exited]
+            body = json.dumps(running).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        container_id = self.path.split("/")[2]
+
+        # HTTP/1.0: the stream ends when the connection is closed
+        self.send_response(200)
+        self.end_headers()
+
+        try:
+            for i in range(self.readings[container_id]):
+                self.wfile.write(json.dumps(make_stats(i)).encode() + b"\n")
+                self.wfile.flush()
+                time.sleep(0.01)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        self.exited.add(container_id)
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def docker_socket(tmp_path):
+    FakeDockerHandler.exited = set()
+    socket_path = str(tmp_path / "docker.sock")
+    server = UnixHTTPServer(socket_path, FakeDockerHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield socket_path
+
+    server.shutdown()
+    server.server_close()
+
+
+def _records(fname):
+    with open(fname) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_collector(docker_socket, tmp_path, caplog):
+    fname = tmp_path / "stats.jsonl"
+    collector = Collector(fname, docker_socket, poll=0.05, flush_interval=0)
+
+    runner = threading.Thread(target=collector.run, kwargs={"idle_timeout": None})
+    runner.start()
+
+    # the finished container and a few readings of the busy one
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        records = _records(fname) if fname.exists() else []
+        if sum(r["container"] == "ublock_example.com" for r in records) == 2 and (
+            sum(r["container"] == "busy" for r in records) >= 5
+        ):
+            break
+        time.sleep(0.05)
+
+    with caplog.at_level(logging.ERROR, logger="docker_stats"):
+        collector.stop()
+        runner.join(timeout=5)
+        # stopped again by run, then by the caller
+        collector.stop()
+
+    assert not runner.is_alive()
+    assert not caplog.records
+
+    records = _records(fname)
+    site = [r for r in records if r["container"] == "ublock_example.com"]
+
+    assert [r["read"] for r in site] == ["2024-01-01T00:00:01Z", "2024-01-01T00:00:02Z"]
+    assert site[0]["cpu"] == 10.0
+    assert site[1]["ram"] == 12.0
+    assert site[1]["net_tx"] == 4
+    assert all("extn" not in r for r in records if r["container"] == "busy")
+
+    # the followers write nothing once stopped
+    time.sleep(0.2)
+    assert _records(fname) == records
+
+    assert ram_by_site(fname) == {"ublock": {"example.com": [11.0, 12.0]}}
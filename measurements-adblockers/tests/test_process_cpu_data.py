@@ -0,0 +1,37 @@
+import pytest
+
+from process_cpu_data import measurement_row
+
+
+def proc_entry(usr, load_end, last_period=1.0, interval=1.0):
+    return {
+        "usr": usr,
+        "sys": [0] * len(usr),
+        "iowait": [0] * len(usr),
+        "interval": interval,
+        "last_period": last_period,
+        "webStats": [load_end - 100, load_end],
+    }
+
+
+def test_short_load_sampled_by_proc_is_not_faulty():
+    # 2 seconds idle, then a 1.5 second load
+    entry = proc_entry([0, 0, 90, 60], 1500, last_period=0.5)
+    row = measurement_row("site", "ublock", "default", entry)
+
+    assert not row["faulty"]
+    # the last half period weighs half
+    assert row["usr_avg"] == pytest.approx((90 + 0.5 * 60) / 3.5)
+
+
+def test_load_not_covered_by_the_samples_is_faulty():
+    row = measurement_row("site", "ublock", "default", proc_entry([10], 3000, last_period=0.5))
+
+    assert row["faulty"]
+
+
+def test_mpstat_needs_four_cycles():
+    entry = {"usr": [1, 2, 3], "sys": [0] * 3, "iowait": [0] * 3, "webStats": [900, 1000]}
+
+    assert measurement_row("site", "ublock", "default", entry)["faulty"]
+    assert not measurement_row("site", "control", "default", entry)["faulty"]
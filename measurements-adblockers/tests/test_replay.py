@@ -0,0 +1,82 @@
+import http.client
+import http.server
+import os
+import threading
+
+import pytest
+
+import replay
+
+# a CPU whose ports are unlikely to be taken by a running measurement
+CPU = 97
+
+PAGE = b"<html><body>recorded</body></html>"
+
+requires_wpr = pytest.mark.skipif(
+    not (
+        os.access(replay.WPR_PATH, os.X_OK)
+        and (replay.WPR_DIR / "wpr_cert.pem").is_file()
+    ),
+    reason="Web Page Replay is only installed in the chrome image",
+)
+
+
+class Page(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def get(host, path="/"):
+    """GET a page of the host through the replay server, as Chrome does"""
+
+    conn = http.client.HTTPConnection("127.0.0.1", replay.HTTP_PORT + CPU, timeout=30)
+    try:
+        conn.request("GET", path, headers={"Host": host})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_start_without_wpr(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, "WPR_PATH", str(tmp_path / "wpr"))
+
+    with pytest.raises(RuntimeError, match="wpr not installed"):
+        replay.WebPageReplay("record", tmp_path / "site.wprgo", CPU).start()
+
+
+@requires_wpr
+def test_replay_offline(tmp_path):
+    archive = tmp_path / "site.wprgo"
+
+    origin = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Page)
+    thread = threading.Thread(target=origin.serve_forever, daemon=True)
+    thread.start()
+    host = f"127.0.0.1:{origin.server_port}"
+
+    try:
+        with replay.WebPageReplay("record", archive, CPU):
+            assert get(host) == (200, PAGE)
+    finally:
+        # the network is off for the replay
+        origin.shutdown()
+        origin.server_close()
+
+    assert archive.is_file()
+
+    with replay.WebPageReplay("replay", archive, CPU):
+        status, body = get(host)
+        assert status == 200
+        # the deterministic script is injected in the recorded page
+        assert b"recorded" in body
+        assert get(host, "/missing")[0] == 404
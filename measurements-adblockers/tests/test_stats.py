@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import stats
+
+BUSY = "import time\nend = time.monotonic() + 2\nwhile time.monotonic() < end: pass"
+
+
+def test_stop_reads_the_last_partial_period():
+    cpu = min(os.sched_getaffinity(0))
+    # the browser is a child of the measuring process
+    child = subprocess.Popen([sys.executable, "-c", BUSY])
+
+    try:
+        stat = stats.Stats(10, "test", cpu, interval=0.2, root_pid=os.getpid())
+        stat.start()
+        time.sleep(0.5)
+        readings = stat.stop()
+    finally:
+        child.kill()
+        child.wait()
+
+    # 2 whole periods and the half period before the stop
+    assert len(readings["usr"]) == 3
+    assert readings["last_period"] == pytest.approx(0.5, abs=0.15)
+    # the busy child used a whole CPU, over the last period as over the others
+    assert readings["proc_cpu"][-1] == pytest.approx(readings["proc_cpu"][0], abs=0.08)
+
+
+def test_interval_defaults_to_the_configured_one(monkeypatch):
+    # cpu.py --sample-interval sets the default of the measurements
+    monkeypatch.setattr(stats, "INTERVAL", 0.05)
+
+    assert stats.Stats(10, "test", None).parse()["interval"] == 0.05
+    assert stats.Stats(10, "test", None, interval=1.0).parse()["interval"] == 1.0